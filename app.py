@@ -1,4 +1,5 @@
-from flask import Flask, render_template, redirect, url_for, request, jsonify, make_response
+from flask import Flask, render_template, redirect, url_for, request, jsonify, make_response, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import (
@@ -7,9 +8,27 @@ from flask_jwt_extended import (
 )
 from datetime import timedelta, datetime, timezone, date
 import os
-from sqlalchemy import func, or_, and_
+import sys
+import json
+import base64
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import unicodedata
+import hashlib
+import hmac
+from functools import wraps
+from contextlib import contextmanager
+from sqlalchemy import func, or_, and_, text, tuple_, case, select, exists, literal, event, union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, subqueryload, selectinload, aliased
 from decimal import Decimal
 import pytz
+import click
+from calendario import CalendarioLaboral, MAXIMO_DIAS_HABILES
+from metricas import RegistroMetricas, BUCKETS_SENTENCIAS, TIPO_CONTENIDO
+from exportacion import generar_csv, generar_xlsx, TIPO_CSV, TIPO_XLSX
+import migraciones
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
@@ -27,6 +46,27 @@ DATABASE_URL = os.getenv(
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Pool de conexiones (por proceso). DB_POOL_SIZE debe cubrir los hilos de cada worker de
+# gunicorn (GUNICORN_THREADS) más el hilo del recálculo programado; ver gunicorn.conf.py.
+# DB_STATEMENT_TIMEOUT_MS / DB_LOCK_TIMEOUT_MS cortan consultas o esperas de bloqueo colgadas (0 = sin límite).
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+DB_LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', '10000'))
+# Los trabajos programados y por lotes recorren toda la cartera: sus transacciones cambian esos límites
+# por DB_TRABAJOS_STATEMENT_TIMEOUT_MS (0 = sin límite) y DB_TRABAJOS_LOCK_TIMEOUT_MS
+DB_TRABAJOS_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_TRABAJOS_STATEMENT_TIMEOUT_MS', '0'))
+DB_TRABAJOS_LOCK_TIMEOUT_MS = int(os.getenv('DB_TRABAJOS_LOCK_TIMEOUT_MS', '60000'))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '5')),
+    'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1',
+    'connect_args': {
+        'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} -c lock_timeout={DB_LOCK_TIMEOUT_MS}',
+        'application_name': os.getenv('DB_APPLICATION_NAME', 'prestamos'),
+    },
+}
+
 # Configuración de JWT en cookies
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'prestamo123')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=30)
@@ -38,6 +78,48 @@ app.config['JWT_COOKIE_CSRF_PROTECT'] = False
 # Configuración de zona horaria
 TIMEZONE = pytz.timezone('America/Lima')  # Perú
 
+# Segundos que se reutiliza el resumen de créditos antes de recalcularlo.
+# Las escrituras del propio proceso lo invalidan de inmediato; el TTL acota
+# cuánto puede tardar en verse una escritura hecha por otro worker.
+RESUMEN_CACHE_TTL = int(os.getenv('RESUMEN_CACHE_TTL', '60'))
+
+# Contraseñas: costo de bcrypt (2^rondas) y pool acotado donde se calcula, para que una ráfaga
+# de logins no acapare los workers. Si el pool y su cola están llenos, el login responde 503.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', '12'))
+app.config['BCRYPT_HILOS'] = int(os.getenv('BCRYPT_HILOS', '4'))
+app.config['BCRYPT_COLA_MAXIMA'] = int(os.getenv('BCRYPT_COLA_MAXIMA', '16'))
+
+# Recálculo programado de la cartera (hilo en segundo plano, uno activo por base de datos)
+app.config['RECALCULO_PROGRAMADO'] = os.getenv('RECALCULO_PROGRAMADO', '1') == '1'
+app.config['RECALCULO_INTERVALO_MINUTOS'] = int(os.getenv('RECALCULO_INTERVALO_MINUTOS', '30'))
+
+# Archivo de préstamos cerrados: los pagados/refinanciados hace más de ARCHIVO_ANTIGUEDAD_DIAS días pasan,
+# con sus cuotas y pagos, a las tablas *_archivados/as una vez al día (0 = no archivar)
+app.config['ARCHIVO_ANTIGUEDAD_DIAS'] = int(os.getenv('ARCHIVO_ANTIGUEDAD_DIAS', '180'))
+
+# Foto de saldos diaria: días atrasados (proceso detenido) que se recuperan como máximo al reanudar
+app.config['FOTO_SALDOS_DIAS_RECUPERAR'] = int(os.getenv('FOTO_SALDOS_DIAS_RECUPERAR', '31'))
+
+# /metrics (formato Prometheus) exige "Authorization: Bearer <METRICAS_TOKEN>"; sin token queda
+# deshabilitado, salvo METRICAS_PUBLICAS=1 (solo para desarrollo: expone rutas y volumen de tráfico)
+app.config['METRICAS_TOKEN'] = os.getenv('METRICAS_TOKEN')
+app.config['METRICAS_PUBLICAS'] = os.getenv('METRICAS_PUBLICAS', '0') == '1'
+
+# Configuración del calendario laboral
+# DIAS_LABORABLES: días de cobranza (0 = lunes ... 6 = domingo)
+# FERIADOS_PERU: '1' para no contar los feriados nacionales como días hábiles
+# FERIADOS_ADICIONALES: fechas ISO separadas por comas (días no laborables decretados)
+DIAS_LABORABLES = [int(d) for d in os.getenv('DIAS_LABORABLES', '0,1,2,3,4,5').split(',') if d.strip()]
+FERIADOS_PERU = os.getenv('FERIADOS_PERU', '1') == '1'
+FERIADOS_ADICIONALES = [
+    date.fromisoformat(f.strip()) for f in os.getenv('FERIADOS_ADICIONALES', '').split(',') if f.strip()
+]
+CALENDARIO = CalendarioLaboral(
+    dias_laborables=DIAS_LABORABLES,
+    incluir_feriados=FERIADOS_PERU,
+    feriados_adicionales=FERIADOS_ADICIONALES
+)
+
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 jwt = JWTManager(app)
@@ -67,13 +149,17 @@ class Usuario(db.Model):
 
 class Cliente(db.Model):
     __tablename__ = 'clientes'
+    # Índices creados en bases existentes por migraciones/v0002_indices_de_consultas.py
+    __table_args__ = (
+        db.Index('ix_clientes_nombre_id', 'nombre', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     dni = db.Column(db.String(15), unique=True, nullable=False)
     direccion = db.Column(db.Text)
     telefono = db.Column(db.String(20))
     fecha_registro = db.Column(db.DateTime, server_default=db.func.now())
-    trabajador_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True)
+    trabajador_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=True, index=True)
 
     prestamos = db.relationship('Prestamo', backref=db.backref('cliente', lazy=True))
     trabajador = db.relationship('Usuario', backref=db.backref('clientes', lazy=True))
@@ -87,7 +173,7 @@ class Cliente(db.Model):
         """Verifica si el cliente tiene al menos un préstamo activo"""
         return any(p.estado in ['activo', 'vencido'] for p in self.prestamos)
 
-    def to_dict(self):
+    def to_dict(self, hoy=None, campos_prestamo=None, incluir_cuotas=None):
         return {
             'id': self.id,
             'nombre': self.nombre,
@@ -95,7 +181,7 @@ class Cliente(db.Model):
             'direccion': self.direccion,
             'telefono': self.telefono,
             'fecha_registro': self.fecha_registro.isoformat() if self.fecha_registro else None,
-            'prestamos': [p.to_dict() for p in self.prestamos],
+            'prestamos': [p.to_dict(hoy, campos_prestamo, incluir_cuotas) for p in self.prestamos],
             'tiene_prestamo_activo': self.tiene_prestamo_activo(),
             'trabajador_id': self.trabajador_id,
             'trabajador_nombre': self.trabajador.nombre if self.trabajador else None
@@ -104,8 +190,14 @@ class Cliente(db.Model):
 
 class Prestamo(db.Model):
     __tablename__ = 'prestamos'
+    __table_args__ = (
+        db.Index('ix_prestamos_activos_cliente_id', 'cliente_id',
+                 postgresql_where=text("estado IN ('activo', 'vencido')")),
+        db.Index('ix_prestamos_prestamo_refinanciado_id', 'prestamo_refinanciado_id',
+                 postgresql_where=text('prestamo_refinanciado_id IS NOT NULL')),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id', ondelete='CASCADE'), nullable=False)
+    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id', ondelete='CASCADE'), nullable=False, index=True)
     monto_principal = db.Column(db.Numeric(10, 2), nullable=False)
     interes = db.Column(db.Numeric(5, 2), nullable=False)
     monto_total = db.Column(db.Numeric(10, 2), nullable=False)
@@ -122,6 +214,11 @@ class Prestamo(db.Model):
     cuota_diaria = db.Column(db.Numeric(10, 2), default=0.0)
     deuda_vencida = db.Column(db.Numeric(10, 2), default=0.0)
     prestamo_refinanciado_id = db.Column(db.Integer, db.ForeignKey('prestamos.id'), nullable=True)
+
+    # Totales acumulados de las cuotas (se actualizan con cada pago y se concilian a diario)
+    total_pagado = db.Column(db.Numeric(10, 2), nullable=False, default=0, server_default='0')
+    num_cuotas = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    ultima_fecha_pago = db.Column(db.Date, nullable=True)
     cuotas = db.relationship('Cuota', backref=db.backref('prestamo', lazy=True))
 
     def calcular_dias_transcurridos(self):
@@ -130,27 +227,32 @@ class Prestamo(db.Model):
             hoy = get_current_date()
             self.dt = (hoy - self.fecha_inicio).days
         return self.dt
-    #BORRAR SI SALE MAL
-    def calcular_deuda_vencida(self):
+    def calcular_estado_derivado(self, hoy=None):
         """
-        Calcula la deuda vencida y la mora pendiente dinámicamente.
-        Devuelve deuda_vencida, deuda_vencida_base, mora_pendiente.
+        Calcula el estado del préstamo a la fecha `hoy` como función pura de los datos guardados,
+        sin modificar el objeto. Devuelve un dict con dt, saldo, deuda_vencida, deuda_vencida_base,
+        mora_pendiente, estado y fecha_pago_completo.
         """
+        hoy = hoy or get_current_date()
+        derivado = {
+            'dt': (hoy - self.fecha_inicio).days if self.fecha_inicio else self.dt,
+            'estado': self.estado,
+            'fecha_pago_completo': self.fecha_pago_completo
+        }
         if self.estado not in ['activo', 'vencido']:
-            self.deuda_vencida = Decimal('0.0')
-            self.saldo = Decimal('0.0')
-            return 0.0, 0.0, 0.0
+            derivado.update(saldo=Decimal('0.0'), deuda_vencida=Decimal('0.0'),
+                            deuda_vencida_base=Decimal('0.0'), mora_pendiente=Decimal('0.0'))
+            return derivado
 
-        hoy = get_current_date()
         fecha_fin = self.fecha_fin or (self.fecha_inicio + timedelta(days=30))
         dias_transcurridos = calcular_dias_habiles(self.fecha_inicio, min(hoy, fecha_fin))
 
         # Calcular deuda esperada sin mora
         deuda_esperada = Decimal(str(dias_transcurridos)) * self.cuota_diaria
-        total_pagado = sum(Decimal(str(cuota.monto)) for cuota in self.cuotas)
+        total_pagado = Decimal(str(self.total_pagado or 0))
         deuda_vencida_base = max(Decimal('0.0'), deuda_esperada - total_pagado)
 
-        # Calcular mora si el préstamo está vencido
+        # Calcular mora si el préstamo está vencido (con el saldo almacenado, igual que el recálculo SQL)
         mora_total = Decimal('0.0')
         if hoy > fecha_fin and self.saldo > 0:
             dias_vencidos = calcular_dias_habiles(fecha_fin, hoy)  # Usar días hábiles para consistencia
@@ -159,21 +261,38 @@ class Prestamo(db.Model):
 
         # Calcular mora pendiente
         mora_pendiente = max(Decimal('0.0'), mora_total - (total_pagado - deuda_esperada if total_pagado > deuda_esperada else Decimal('0.0')))
-        self.deuda_vencida = deuda_vencida_base + mora_pendiente
-        self.saldo = self.monto_total - total_pagado + mora_total
+        saldo = self.monto_total - total_pagado + mora_total
 
-        # Actualizar estado
-        if hoy > fecha_fin and self.saldo > 0:
-            self.estado = 'vencido'
-        elif self.estado == 'vencido' and self.saldo <= 0:
-            self.estado = 'pagado'
-            self.fecha_pago_completo = get_current_date()
+        # Estado
+        if hoy > fecha_fin and saldo > 0:
+            derivado['estado'] = 'vencido'
+        elif self.estado == 'vencido' and saldo <= 0:
+            derivado['estado'] = 'pagado'
+            derivado['fecha_pago_completo'] = hoy
+
+        derivado.update(saldo=saldo, deuda_vencida=deuda_vencida_base + mora_pendiente,
+                        deuda_vencida_base=deuda_vencida_base, mora_pendiente=mora_pendiente)
+        return derivado
 
-        return float(self.deuda_vencida), float(deuda_vencida_base), float(mora_pendiente)
+    def calcular_deuda_vencida(self):
+        """
+        Calcula la deuda vencida y la mora pendiente y las guarda en el préstamo (solo en escrituras).
+        Devuelve deuda_vencida, deuda_vencida_base, mora_pendiente.
+        """
+        derivado = self.calcular_estado_derivado()
+        self.deuda_vencida = derivado['deuda_vencida']
+        self.saldo = derivado['saldo']
+        if self.estado not in ['activo', 'vencido']:
+            return 0.0, 0.0, 0.0
+
+        self.estado = derivado['estado']
+        self.fecha_pago_completo = derivado['fecha_pago_completo']
+        return float(self.deuda_vencida), float(derivado['deuda_vencida_base']), float(derivado['mora_pendiente'])
 
     def calcular_estado_pago_cuota(self, fecha_cuota):
         """
-        Determina si una cuota fue pagada a tiempo, anticipada o con retraso
+        Determina si una cuota fue pagada a tiempo, anticipada o con retraso.
+        Para una sola fecha; la historia completa se clasifica en una pasada con SQL_CLASIFICAR_PUNTUALIDAD.
         """
         if not self.fecha_inicio:
             return 'desconocido'
@@ -185,9 +304,13 @@ class Prestamo(db.Model):
         elif dias_desde_inicio == 0:
             return 'a_tiempo'
         else:
-            # Verificar si pagó la cuota completa del día correspondiente
-            cuotas_hasta_fecha = [c for c in self.cuotas if c.fecha_pago <= fecha_cuota]
-            total_pagado_hasta_fecha = sum(Decimal(str(c.monto)) for c in cuotas_hasta_fecha)
+            # Verificar si pagó la cuota completa del día correspondiente. Si no hay pagos
+            # posteriores a la fecha basta el total acumulado; si no, se suman las cuotas.
+            if self.ultima_fecha_pago is None or self.ultima_fecha_pago <= fecha_cuota:
+                total_pagado_hasta_fecha = Decimal(str(self.total_pagado or 0))
+            else:
+                cuotas_hasta_fecha = [c for c in self.cuotas if c.fecha_pago <= fecha_cuota]
+                total_pagado_hasta_fecha = sum(Decimal(str(c.monto)) for c in cuotas_hasta_fecha)
             esperado_hasta_fecha = Decimal(str(dias_desde_inicio + 1)) * self.cuota_diaria
             
             if total_pagado_hasta_fecha >= esperado_hasta_fecha:
@@ -195,6 +318,13 @@ class Prestamo(db.Model):
             else:
                 return 'con_retraso'
         
+    def aplicar_pago(self, monto, fecha_pago):
+        """Suma un pago a los totales acumulados; debe ir en la misma transacción que la Cuota."""
+        self.total_pagado = Decimal(str(self.total_pagado or 0)) + monto
+        self.num_cuotas = (self.num_cuotas or 0) + 1
+        if self.ultima_fecha_pago is None or fecha_pago > self.ultima_fecha_pago:
+            self.ultima_fecha_pago = fecha_pago
+
     def calcular_gastos_administrativos(self):
         """Calcula los gastos administrativos: 1 sol por cada 50 soles de monto principal, mínimo 1 sol."""
         monto_principal = Decimal(str(self.monto_principal))
@@ -209,40 +339,78 @@ class Prestamo(db.Model):
     
     
 
-    def to_dict(self):
-        self.calcular_dias_transcurridos()
-        deuda_vencida, deuda_vencida_base, mora_pendiente = self.calcular_deuda_vencida()
-        
-        return {
-            'id': self.id,
-            'cliente_id': self.cliente_id,
-            'monto_principal': float(self.monto_principal),
-            'monto_total': float(self.monto_total),
-            'interes': float(self.interes),
-            'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
-            'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None,
-            'fecha_pago_completo': self.fecha_pago_completo.isoformat() if self.fecha_pago_completo else None,
-            'estado': self.estado,
-            'saldo': float(self.saldo),
-            'mora_pendiente': float(mora_pendiente),
-            'tipo_prestamo': self.tipo_prestamo,
-            'tipo_frecuencia': self.tipo_frecuencia,
-            'dt': self.dt,
-            'cuota_diaria': float(self.cuota_diaria),
-            'deuda_vencida': float(self.deuda_vencida),
-            'prestamo_refinanciado_id': self.prestamo_refinanciado_id,
-            'total_cuotas': len(self.cuotas),
-            'cuotas': [c.to_dict() for c in self.cuotas],
-            'gastos_administrativos': float(self.calcular_gastos_administrativos())
-        }
+    def to_dict(self, hoy=None, campos=None, incluir_cuotas=None):
+        """
+        Serializa el préstamo con su estado derivado a la fecha, sin modificar la fila.
+        `campos` limita los campos (por defecto, la vista 'detail'); el estado derivado solo se
+        calcula si se pide algún campo que dependa de él. Las cuotas se incluyen con la vista
+        completa o si incluir_cuotas=True.
+        """
+        if campos is None:
+            campos = VISTAS_PRESTAMO['detail']
+            incluir_cuotas = True if incluir_cuotas is None else incluir_cuotas
+        derivado = self.calcular_estado_derivado(hoy) if CAMPOS_DERIVADOS_PRESTAMO.intersection(campos) else None
+
+        datos = {campo: CAMPOS_PRESTAMO[campo](self, derivado) for campo in campos}
+        if incluir_cuotas:
+            datos['cuotas'] = [c.to_dict() for c in self.cuotas]
+        return datos
+
+
+def _fecha_iso(fecha):
+    return fecha.isoformat() if fecha else None
+
+
+# Campos serializables de Prestamo: nombre -> función(prestamo, estado_derivado)
+CAMPOS_PRESTAMO = {
+    'id': lambda p, d: p.id,
+    'cliente_id': lambda p, d: p.cliente_id,
+    'monto_principal': lambda p, d: float(p.monto_principal),
+    'monto_total': lambda p, d: float(p.monto_total),
+    'interes': lambda p, d: float(p.interes),
+    'fecha_inicio': lambda p, d: _fecha_iso(p.fecha_inicio),
+    'fecha_fin': lambda p, d: _fecha_iso(p.fecha_fin),
+    'fecha_pago_completo': lambda p, d: _fecha_iso(d['fecha_pago_completo']),
+    'estado': lambda p, d: d['estado'],
+    'saldo': lambda p, d: float(d['saldo']),
+    'mora_pendiente': lambda p, d: float(d['mora_pendiente']),
+    'tipo_prestamo': lambda p, d: p.tipo_prestamo,
+    'tipo_frecuencia': lambda p, d: p.tipo_frecuencia,
+    'dt': lambda p, d: d['dt'],
+    'cuota_diaria': lambda p, d: float(p.cuota_diaria),
+    'deuda_vencida': lambda p, d: float(d['deuda_vencida']),
+    'prestamo_refinanciado_id': lambda p, d: p.prestamo_refinanciado_id,
+    'total_cuotas': lambda p, d: p.num_cuotas,
+    'total_pagado': lambda p, d: float(p.total_pagado or 0),
+    'ultima_fecha_pago': lambda p, d: _fecha_iso(p.ultima_fecha_pago),
+    'gastos_administrativos': lambda p, d: float(p.calcular_gastos_administrativos()),
+}
+
+# Campos que requieren calcular_estado_derivado()
+CAMPOS_DERIVADOS_PRESTAMO = frozenset(
+    ['fecha_pago_completo', 'estado', 'saldo', 'mora_pendiente', 'dt', 'deuda_vencida']
+)
+
+# Vistas con nombre: 'list' para tablas, 'collector' para el cobro en ruta, 'detail' completa (con cuotas)
+VISTAS_PRESTAMO = {
+    'list': ['id', 'cliente_id', 'monto_principal', 'monto_total', 'interes', 'saldo', 'tipo_prestamo',
+             'tipo_frecuencia', 'dt', 'total_cuotas', 'deuda_vencida', 'mora_pendiente', 'cuota_diaria',
+             'fecha_inicio', 'fecha_fin', 'fecha_pago_completo', 'estado'],
+    'collector': ['id', 'cliente_id', 'estado', 'cuota_diaria', 'saldo', 'deuda_vencida', 'mora_pendiente',
+                  'fecha_fin', 'ultima_fecha_pago'],
+    'detail': list(CAMPOS_PRESTAMO),
+}
 
 
 class Cuota(db.Model):
     __tablename__ = 'cuotas'
+    __table_args__ = (
+        db.Index('ix_cuotas_prestamo_id_fecha_pago', 'prestamo_id', 'fecha_pago'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     prestamo_id = db.Column(db.Integer, db.ForeignKey('prestamos.id', ondelete='CASCADE'), nullable=False)
     monto = db.Column(db.Numeric(10, 2), nullable=False)
-    fecha_pago = db.Column(db.Date, nullable=False, server_default=db.func.current_date())
+    fecha_pago = db.Column(db.Date, nullable=False, server_default=db.func.current_date(), index=True)
     descripcion = db.Column(db.String(200), nullable=True)
     estado_pago = db.Column(db.String(20), default='a_tiempo')  # a_tiempo, con_retraso, anticipado
 
@@ -257,10 +425,97 @@ class Cuota(db.Model):
         }
 
 
+class DiaCalendario(db.Model):
+    """Calendario laboral materializado para contar días hábiles desde SQL."""
+    __tablename__ = 'calendario_laboral'
+    # Creada en bases existentes por migraciones/v0005_tablas_de_trabajos.py
+    fecha = db.Column(db.Date, primary_key=True)
+    es_habil = db.Column(db.Boolean, nullable=False)
+    habiles_antes = db.Column(db.Integer, nullable=False)  # Días hábiles antes de la fecha
+    habiles_hasta = db.Column(db.Integer, nullable=False)  # Días hábiles hasta la fecha (inclusive)
+
+
+class EjecucionProgramada(db.Model):
+    """Registro de la última ejecución de cada trabajo programado (compartido entre workers)."""
+    __tablename__ = 'ejecuciones_programadas'
+    # Creada en bases existentes por migraciones/v0005_tablas_de_trabajos.py
+    nombre = db.Column(db.String(50), primary_key=True)
+    ultima_ejecucion = db.Column(db.DateTime(timezone=True), nullable=True)
+    fecha_calculo = db.Column(db.Date, nullable=True)  # Fecha (America/Lima) usada en el cálculo
+    duracion_ms = db.Column(db.Integer, nullable=True)
+    filas_actualizadas = db.Column(db.Integer, nullable=True)
+    motivo = db.Column(db.String(30), nullable=True)  # cambio_de_dia, intervalo, cli, manual
+
+    def to_dict(self):
+        return {
+            'nombre': self.nombre,
+            'ultima_ejecucion': self.ultima_ejecucion.isoformat() if self.ultima_ejecucion else None,
+            'fecha_calculo': self.fecha_calculo.isoformat() if self.fecha_calculo else None,
+            'duracion_ms': self.duracion_ms,
+            'filas_actualizadas': self.filas_actualizadas,
+            'motivo': self.motivo
+        }
+
+
+class SaldoDiario(db.Model):
+    """
+    Foto al cierre de cada día del estado de los préstamos activos/vencidos. Solo se agregan filas;
+    no tiene claves foráneas para que el historial se conserve aunque se borre el préstamo o el cliente.
+    """
+    __tablename__ = 'saldos_diarios'
+    # Creada en bases existentes por migraciones/v0003_saldos_diarios.py
+    __table_args__ = (
+        db.Index('ix_saldos_diarios_prestamo_id_fecha', 'prestamo_id', 'fecha'),
+        db.Index('ix_saldos_diarios_trabajador_id_fecha', 'trabajador_id', 'fecha'),
+    )
+    fecha = db.Column(db.Date, primary_key=True)
+    prestamo_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cliente_id = db.Column(db.Integer, nullable=False)
+    trabajador_id = db.Column(db.Integer, nullable=True)  # Trabajador asignado al cliente ese día
+    estado = db.Column(db.String(50), nullable=False)
+    saldo = db.Column(db.Numeric(10, 2), nullable=False)
+    deuda_vencida = db.Column(db.Numeric(10, 2), nullable=False)
+    mora_pendiente = db.Column(db.Numeric(10, 2), nullable=False)
+
+    def to_dict(self):
+        return {
+            'fecha': self.fecha.isoformat(),
+            'prestamo_id': self.prestamo_id,
+            'estado': self.estado,
+            'saldo': float(self.saldo),
+            'deuda_vencida': float(self.deuda_vencida),
+            'mora_pendiente': float(self.mora_pendiente)
+        }
+
+
+class ResumenSaldosDiario(db.Model):
+    """Totales de la foto de cada día: los gráficos de tendencia leen una fila por día."""
+    __tablename__ = 'resumen_saldos_diarios'
+    fecha = db.Column(db.Date, primary_key=True)
+    prestamos = db.Column(db.Integer, nullable=False)
+    vigentes = db.Column(db.Integer, nullable=False)
+    vencidos = db.Column(db.Integer, nullable=False)
+    saldo_total = db.Column(db.Numeric(14, 2), nullable=False)
+    deuda_vencida_total = db.Column(db.Numeric(14, 2), nullable=False)
+    mora_total = db.Column(db.Numeric(14, 2), nullable=False)
+    creado_en = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    def to_dict(self):
+        return {
+            'fecha': self.fecha.isoformat(),
+            'prestamos': self.prestamos,
+            'vigentes': self.vigentes,
+            'vencidos': self.vencidos,
+            'saldo_total': float(self.saldo_total),
+            'deuda_vencida_total': float(self.deuda_vencida_total),
+            'mora_total': float(self.mora_total)
+        }
+
+
 class Pago(db.Model):
     __tablename__ = 'pagos'
     id = db.Column(db.Integer, primary_key=True)
-    prestamo_id = db.Column(db.Integer, db.ForeignKey('prestamos.id', ondelete='CASCADE'), nullable=False)
+    prestamo_id = db.Column(db.Integer, db.ForeignKey('prestamos.id', ondelete='CASCADE'), nullable=False, index=True)
     monto = db.Column(db.Numeric(10, 2), nullable=False)
     fecha_pago = db.Column(db.Date, nullable=False, server_default=db.func.current_date())
 
@@ -273,7 +528,113 @@ class Pago(db.Model):
         }
 
 
+def tabla_de_archivo(nombre, tabla, *args):
+    """
+    Tabla fría con las mismas columnas que `tabla`, sin valores por defecto (las filas llegan
+    copiadas de la tabla vigente). `args` agrega columnas, claves foráneas e índices propios.
+    """
+    columnas = [db.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable, autoincrement=False)
+                for c in tabla.columns]
+    return db.Table(nombre, db.metadata, *columnas, *args)
+
+
+# Préstamos cerrados y antiguos, con sus cuotas y pagos (archivar_prestamos). Creadas en bases
+# existentes por migraciones/v0004_archivo_prestamos.py. Borrar el cliente borra también su archivo.
+prestamos_archivados = tabla_de_archivo(
+    'prestamos_archivados', Prestamo.__table__,
+    db.Column('archivado_en', db.DateTime(timezone=True), nullable=False, server_default=db.func.now()),
+    db.ForeignKeyConstraint(['cliente_id'], ['clientes.id'], ondelete='CASCADE'),
+    db.Index('ix_prestamos_archivados_cliente_id', 'cliente_id'),
+)
+cuotas_archivadas = tabla_de_archivo(
+    'cuotas_archivadas', Cuota.__table__,
+    db.ForeignKeyConstraint(['prestamo_id'], ['prestamos_archivados.id'], ondelete='CASCADE'),
+    db.Index('ix_cuotas_archivadas_prestamo_id_fecha_pago', 'prestamo_id', 'fecha_pago'),
+    db.Index('ix_cuotas_archivadas_fecha_pago', 'fecha_pago'),
+)
+pagos_archivados = tabla_de_archivo(
+    'pagos_archivados', Pago.__table__,
+    db.ForeignKeyConstraint(['prestamo_id'], ['prestamos_archivados.id'], ondelete='CASCADE'),
+    db.Index('ix_pagos_archivados_prestamo_id', 'prestamo_id'),
+)
+
+
+def modelo_con_archivo(modelo, archivo):
+    """
+    Alias de `modelo` sobre la unión de su tabla y su tabla de archivo: las consultas de historial
+    lo usan en lugar del modelo y devuelven objetos del modelo tanto vigentes como archivados.
+    Los objetos archivados son de solo lectura (su fila ya no está en la tabla del modelo).
+    """
+    tabla = modelo.__table__
+    union = union_all(select(*tabla.columns), select(*(archivo.c[c.name] for c in tabla.columns)))
+    return aliased(modelo, union.subquery(f'{tabla.name}_historial'))
+
+
+PrestamoHistorial = modelo_con_archivo(Prestamo, prestamos_archivados)
+CuotaHistorial = modelo_con_archivo(Cuota, cuotas_archivadas)
+
+
+# Versión de la cartera: avanza después de cada escritura (registrar_cambio_cartera) y forma parte
+# de los ETag. Una secuencia no bloquea a los escritores concurrentes y la ven todos los workers.
+# Creada en bases existentes por migraciones/v0005_tablas_de_trabajos.py.
+version_cartera_seq = db.Sequence('version_cartera', metadata=db.metadata)
+
+
 # ---------------- AUTENTICACIÓN ----------------
+# bcrypt libera el GIL, así que el pool calcula varios hashes en paralelo mientras el resto
+# de hilos sigue atendiendo solicitudes.
+_pool_bcrypt = ThreadPoolExecutor(max_workers=app.config['BCRYPT_HILOS'], thread_name_prefix='bcrypt')
+_cupos_bcrypt = threading.BoundedSemaphore(app.config['BCRYPT_HILOS'] + app.config['BCRYPT_COLA_MAXIMA'])
+_hash_de_relleno = None
+
+
+class ServidorOcupado(Exception):
+    """No hay cupo en el pool de bcrypt para atender la solicitud."""
+
+
+def _en_pool_bcrypt(funcion, *args):
+    """Ejecuta funcion en el pool de bcrypt; lanza ServidorOcupado si el pool y su cola están llenos."""
+    if not _cupos_bcrypt.acquire(blocking=False):
+        raise ServidorOcupado()
+    try:
+        return _pool_bcrypt.submit(funcion, *args).result()
+    finally:
+        _cupos_bcrypt.release()
+
+
+def generar_hash_password(password):
+    """Genera el hash bcrypt de la contraseña con el costo configurado."""
+    return _en_pool_bcrypt(bcrypt.generate_password_hash, password).decode('utf-8')
+
+
+def verificar_password(password_hash, password):
+    """
+    Verifica la contraseña en el pool de bcrypt. Sin hash (usuario inexistente) se compara
+    contra un hash de relleno para que la respuesta tarde lo mismo y no revele usuarios.
+    """
+    global _hash_de_relleno
+    if password_hash is None:
+        if _hash_de_relleno is None:
+            _hash_de_relleno = generar_hash_password(os.urandom(16).hex())
+        _en_pool_bcrypt(bcrypt.check_password_hash, _hash_de_relleno, password)
+        return False
+    return _en_pool_bcrypt(bcrypt.check_password_hash, password_hash, password)
+
+
+def costo_hash(password_hash):
+    """Rondas de un hash bcrypt ('$2b$12$...' -> 12)."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def respuesta_servidor_ocupado():
+    resp = jsonify({'msg': 'Servidor ocupado, intente nuevamente en unos segundos'})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
+
+
 @app.route('/auth/login', methods=['POST'])
 def login():
     data = request.get_json() or {}
@@ -283,9 +644,26 @@ def login():
         return jsonify({'msg': 'Faltan campos'}), 400
 
     usuario = Usuario.query.filter_by(username=username).first()
-    if usuario and bcrypt.check_password_hash(usuario.password_hash, password):
-        token = create_access_token(identity=usuario.username, additional_claims={'rol': usuario.rol})
-        resp = jsonify({'rol': usuario.rol})
+    usuario_id, password_hash, rol = (usuario.id, usuario.password_hash, usuario.rol) if usuario else (None, None, None)
+    db.session.close()  # No retener una conexión del pool mientras corre bcrypt
+
+    try:
+        valida = verificar_password(password_hash, password)
+    except ServidorOcupado:
+        return respuesta_servidor_ocupado()
+
+    if valida:
+        # Rehash transparente si cambió el costo configurado
+        if costo_hash(password_hash) != app.config['BCRYPT_LOG_ROUNDS']:
+            try:
+                nuevo_hash = generar_hash_password(password)
+                Usuario.query.filter_by(id=usuario_id, password_hash=password_hash).update({'password_hash': nuevo_hash})
+                db.session.commit()
+            except ServidorOcupado:
+                pass  # Se intentará en el próximo login
+
+        token = create_access_token(identity=username, additional_claims={'rol': rol})
+        resp = jsonify({'rol': rol})
         set_access_cookies(resp, token)
         return resp, 200
 
@@ -324,6 +702,179 @@ def refresh_expiring_jwts(response):
         return response
 
 
+# ---------------- MÉTRICAS ----------------
+# Cada request (y cada trabajo programado) acumula en una MedicionSQL las sentencias, el tiempo
+# de base de datos y el de serialización JSON de su hilo. Al terminar se publican en el header
+# Server-Timing y en los histogramas de /metrics.
+METRICAS = RegistroMetricas()
+ETIQUETAS_REQUEST = ('endpoint', 'metodo')
+metrica_requests = METRICAS.contador(
+    'http_requests_total', 'Requests atendidos por endpoint y código de estado', ETIQUETAS_REQUEST + ('estado',))
+metrica_duracion = METRICAS.histograma(
+    'http_request_duration_seconds', 'Latencia total del request', ETIQUETAS_REQUEST)
+metrica_db = METRICAS.histograma(
+    'http_request_db_seconds', 'Tiempo de ejecución de sentencias SQL por request', ETIQUETAS_REQUEST)
+metrica_serializacion = METRICAS.histograma(
+    'http_request_serialization_seconds', 'Tiempo de serialización JSON por request', ETIQUETAS_REQUEST)
+metrica_sentencias = METRICAS.histograma(
+    'http_request_sql_statements', 'Sentencias SQL por request', ETIQUETAS_REQUEST, BUCKETS_SENTENCIAS)
+
+BUCKETS_TRABAJO = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+metrica_trabajo_ejecuciones = METRICAS.contador(
+    'trabajo_programado_ejecuciones_total',
+    'Intentos de los trabajos programados (resultado: ejecutado, al_dia, en_curso, error)',
+    ('trabajo', 'motivo', 'resultado'))
+metrica_trabajo_duracion = METRICAS.histograma(
+    'trabajo_programado_duracion_seconds', 'Duración de cada ejecución', ('trabajo',), BUCKETS_TRABAJO)
+metrica_trabajo_db = METRICAS.histograma(
+    'trabajo_programado_db_seconds', 'Tiempo de sentencias SQL de cada ejecución', ('trabajo',), BUCKETS_TRABAJO)
+metrica_trabajo_sentencias = METRICAS.histograma(
+    'trabajo_programado_sql_statements', 'Sentencias SQL de cada ejecución', ('trabajo',), BUCKETS_SENTENCIAS)
+metrica_trabajo_filas = METRICAS.gauge(
+    'trabajo_programado_filas_actualizadas', 'Filas actualizadas en la última ejecución', ('trabajo',),
+    modo='mostrecent')
+metrica_trabajo_ultima = METRICAS.gauge(
+    'trabajo_programado_ultima_ejecucion_timestamp_seconds', 'Momento de la última ejecución', ('trabajo',),
+    modo='mostrecent')
+metrica_pool = METRICAS.gauge(
+    'db_pool_conexiones', 'Conexiones del pool de SQLAlchemy de todos los workers (en_uso, libres, overflow)',
+    ('estado',), modo='livesum')
+
+
+class MedicionSQL:
+    """Sentencias SQL, tiempo de base de datos y de serialización acumulados por un request o trabajo."""
+    __slots__ = ('inicio', 'sentencias', 'segundos_db', 'segundos_serializacion', 'inicio_sentencia')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.sentencias = 0
+        self.segundos_db = 0.0
+        self.segundos_serializacion = 0.0
+        self.inicio_sentencia = None
+
+
+_medicion_hilo = threading.local()
+
+
+def medicion_actual():
+    return getattr(_medicion_hilo, 'valor', None)
+
+
+@contextmanager
+def medir_sql():
+    """Mide el bloque con su propia MedicionSQL; al salir suma lo medido a la medición que lo contiene."""
+    anterior = medicion_actual()
+    medicion = _medicion_hilo.valor = MedicionSQL()
+    try:
+        yield medicion
+    finally:
+        _medicion_hilo.valor = anterior
+        if anterior is not None:
+            anterior.sentencias += medicion.sentencias
+            anterior.segundos_db += medicion.segundos_db
+            anterior.segundos_serializacion += medicion.segundos_serializacion
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    medicion = medicion_actual()
+    if medicion is not None:
+        medicion.sentencias += 1
+        medicion.inicio_sentencia = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _despues_de_sentencia(conn, cursor, statement, parameters, context, executemany):
+    medicion = medicion_actual()
+    if medicion is not None and medicion.inicio_sentencia is not None:
+        medicion.segundos_db += time.perf_counter() - medicion.inicio_sentencia
+        medicion.inicio_sentencia = None
+
+
+class ProveedorJSONMedido(DefaultJSONProvider):
+    """Proveedor JSON de Flask que suma el tiempo de json.dumps a la medición del request."""
+
+    def dumps(self, obj, **kwargs):
+        medicion = medicion_actual()
+        if medicion is None:
+            return super().dumps(obj, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            medicion.segundos_serializacion += time.perf_counter() - inicio
+
+
+app.json = ProveedorJSONMedido(app)
+
+
+@app.before_request
+def iniciar_medicion_request():
+    _medicion_hilo.valor = MedicionSQL()
+
+
+@app.after_request
+def registrar_metricas_request(response):
+    medicion = medicion_actual()
+    if medicion is None:
+        return response
+    total = time.perf_counter() - medicion.inicio
+    # La regla de la ruta (no la URL) mantiene acotado el número de series
+    etiquetas = {'endpoint': request.url_rule.rule if request.url_rule else 'sin_ruta', 'metodo': request.method}
+    metrica_requests.inc(estado=response.status_code, **etiquetas)
+    metrica_duracion.observe(total, **etiquetas)
+    metrica_db.observe(medicion.segundos_db, **etiquetas)
+    metrica_serializacion.observe(medicion.segundos_serializacion, **etiquetas)
+    metrica_sentencias.observe(medicion.sentencias, **etiquetas)
+    # El scrape lo atiende un solo worker: cada uno publica su pool también al terminar sus requests
+    _actualizar_metricas_pool()
+    response.headers['Server-Timing'] = (
+        f'db;dur={medicion.segundos_db * 1000:.1f};desc="{medicion.sentencias} sentencias SQL", '
+        f'ser;dur={medicion.segundos_serializacion * 1000:.1f};desc="JSON", '
+        f'total;dur={total * 1000:.1f}'
+    )
+    if response.status_code >= 500:
+        detalle = response.get_json(silent=True) if response.is_json else None
+        app.logger.error('%s %s respondió %s: %s', request.method, request.path, response.status_code,
+                         (detalle or {}).get('error') or (detalle or {}).get('msg'))
+    return response
+
+
+@app.teardown_request
+def terminar_medicion_request(exc):
+    _medicion_hilo.valor = None
+
+
+def registrar_metricas_trabajo(ejecucion, medicion):
+    """Publica en /metrics una ejecución de trabajo programado ya registrada en EjecucionProgramada."""
+    metrica_trabajo_ejecuciones.inc(trabajo=ejecucion.nombre, motivo=ejecucion.motivo, resultado='ejecutado')
+    metrica_trabajo_duracion.observe(ejecucion.duracion_ms / 1000, trabajo=ejecucion.nombre)
+    metrica_trabajo_db.observe(medicion.segundos_db, trabajo=ejecucion.nombre)
+    metrica_trabajo_sentencias.observe(medicion.sentencias, trabajo=ejecucion.nombre)
+    metrica_trabajo_filas.set(ejecucion.filas_actualizadas or 0, trabajo=ejecucion.nombre)
+    metrica_trabajo_ultima.set(ejecucion.ultima_ejecucion.timestamp(), trabajo=ejecucion.nombre)
+
+
+@METRICAS.al_exponer
+def _actualizar_metricas_pool():
+    pool = db.engine.pool
+    if hasattr(pool, 'checkedout'):
+        metrica_pool.set(pool.checkedout(), estado='en_uso')
+        metrica_pool.set(pool.checkedin(), estado='libres')
+        metrica_pool.set(max(0, pool.overflow()), estado='overflow')
+
+
+@app.route('/metrics', methods=['GET'])
+def api_metricas():
+    """Métricas de todos los workers en formato de texto de Prometheus (requiere METRICAS_TOKEN)."""
+    token = app.config['METRICAS_TOKEN']
+    if not token and not app.config['METRICAS_PUBLICAS']:
+        return jsonify({'msg': 'Métricas deshabilitadas: defina METRICAS_TOKEN'}), 404
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'msg': 'No autorizado'}), 401
+    return app.response_class(METRICAS.exponer(), content_type=TIPO_CONTENIDO)
+
+
 # ---------------- FUNCIONES AUXILIARES ----------------
 def calcular_monto_total(monto_principal, interes):
     monto_principal = Decimal(str(monto_principal))
@@ -348,27 +899,1139 @@ def calcular_fecha_fin(fecha_inicio, tipo_frecuencia, monto_total, cuota_diaria)
     return fecha_fin
 
 def calcular_dias_habiles(fecha_inicio, fecha_fin):
-    """Calcula los días hábiles (lunes a viernes) entre dos fechas, hasta un máximo de 22 días."""
-    dias = 0
-    current_date = fecha_inicio
-    while current_date <= fecha_fin and dias < 22:
-        if current_date.weekday() < 6:  # Lunes a viernes (0 a 4)
-            dias += 1
-        current_date += timedelta(days=1)
-    return dias
+    """Calcula los días hábiles (según DIAS_LABORABLES y feriados) entre dos fechas, hasta un máximo de 22 días."""
+    return min(MAXIMO_DIAS_HABILES, CALENDARIO.contar(fecha_inicio, fecha_fin))
+
+
+def bloquear_prestamos(*prestamo_ids):
+    """
+    Carga los préstamos con SELECT ... FOR UPDATE (releyendo la fila aunque ya esté en la sesión).
+    Se bloquean en orden de id, igual que el recálculo y la conciliación, para no provocar
+    deadlocks. Devuelve {id: Prestamo}.
+    """
+    ids = sorted({prestamo_id for prestamo_id in prestamo_ids if prestamo_id is not None})
+    if not ids:
+        return {}
+    prestamos = Prestamo.query.filter(Prestamo.id.in_(ids)).order_by(Prestamo.id) \
+        .with_for_update().populate_existing().all()
+    return {prestamo.id: prestamo for prestamo in prestamos}
+
+
+def registrar_pago_prestamo(prestamo, monto_cuota, fecha_pago=None):
+    """
+    Aplica un pago al préstamo: primero a la deuda base vencida y luego a la mora.
+    Agrega la Cuota a la sesión (sin hacer commit) y devuelve un dict con la cuota, el reparto
+    y si el préstamo quedó pagado. Lanza ValueError si el préstamo ya está pagado.
+    El préstamo debe estar bloqueado con bloquear_prestamos() para no perder pagos concurrentes.
+
+    Un pago con fecha pasada se reparte con la deuda base y la mora que había ese día. Solo se
+    acepta desde la fecha del último pago: así ningún pago posterior cambia lo pagado hasta esa
+    fecha y el reparto no depende de reconstruir la historia del préstamo.
+    """
+    fecha_pago = fecha_pago or get_current_date()
+    if prestamo.ultima_fecha_pago is not None and fecha_pago < prestamo.ultima_fecha_pago:
+        raise ValueError(f'La fecha de pago no puede ser anterior al último pago '
+                         f'({prestamo.ultima_fecha_pago.isoformat()})')
+    prestamo.calcular_dias_transcurridos()
+
+    # Saldo y estado a hoy; deuda vencida y mora a la fecha del pago, antes de aplicarlo
+    prestamo.calcular_deuda_vencida()
+    if prestamo.saldo <= 0:
+        raise ValueError('El préstamo ya está completamente pagado')
+    derivado = prestamo.calcular_estado_derivado(fecha_pago)
+    deuda_vencida_base, mora_pendiente = derivado['deuda_vencida_base'], derivado['mora_pendiente']
+
+    # Distribuir el pago: primero a la deuda base, luego a la mora
+    monto_a_deuda_base = min(monto_cuota, Decimal(str(deuda_vencida_base)))
+    monto_a_mora = min(monto_cuota - monto_a_deuda_base, Decimal(str(mora_pendiente)))
+    monto_real_cuota = monto_a_deuda_base + monto_a_mora
+
+    # Actualizar saldo
+    saldo_completado = False
+    if prestamo.saldo <= monto_real_cuota:
+        monto_real_cuota = prestamo.saldo
+        prestamo.saldo = Decimal('0.0')
+        prestamo.estado = 'pagado'
+        prestamo.fecha_pago_completo = fecha_pago
+        saldo_completado = True
+    else:
+        prestamo.saldo -= monto_real_cuota
+
+    # Registrar la cuota y sumarla a los totales del préstamo. La puntualidad cuenta la propia cuota;
+    # un pago en una fecha que ya tiene pagos cambia las sumas acumuladas de otras cuotas y se
+    # reclasifica todo el préstamo.
+    reclasificar = prestamo.ultima_fecha_pago is not None and fecha_pago <= prestamo.ultima_fecha_pago
+    prestamo.aplicar_pago(monto_real_cuota, fecha_pago)
+    nueva_cuota = Cuota(
+        prestamo_id=prestamo.id,
+        monto=monto_real_cuota,
+        fecha_pago=fecha_pago,
+        descripcion=f'Cuota diaria (deuda: {monto_a_deuda_base}, mora: {monto_a_mora})',
+        estado_pago=None if reclasificar else prestamo.calcular_estado_pago_cuota(fecha_pago)
+    )
+    db.session.add(nueva_cuota)
+    if reclasificar:
+        db.session.flush()
+        clasificar_puntualidad(prestamo.id - 1, prestamo.id)
+        db.session.expire(nueva_cuota, ['estado_pago'])
+
+    # Recalcular deuda vencida
+    deuda_vencida, deuda_vencida_base, mora_pendiente = prestamo.calcular_deuda_vencida()
+    return {
+        'cuota': nueva_cuota,
+        'monto_a_deuda_base': monto_a_deuda_base,
+        'monto_a_mora': monto_a_mora,
+        'saldo_completado': saldo_completado,
+        'mora_pendiente': mora_pendiente
+    }
+
+
+_calendario_sql_hasta = None
+
+
+def sincronizar_calendario_sql():
+    """Escribe el calendario laboral completo en la tabla calendario_laboral (sin hacer commit)."""
+    global _calendario_sql_hasta
+    filas = [
+        {'fecha': fecha, 'es_habil': es_habil, 'habiles_antes': antes, 'habiles_hasta': hasta}
+        for fecha, es_habil, antes, hasta in CALENDARIO.filas()
+    ]
+    db.session.execute(text("""
+        INSERT INTO calendario_laboral (fecha, es_habil, habiles_antes, habiles_hasta)
+        VALUES (:fecha, :es_habil, :habiles_antes, :habiles_hasta)
+        ON CONFLICT (fecha) DO UPDATE
+        SET es_habil = EXCLUDED.es_habil,
+            habiles_antes = EXCLUDED.habiles_antes,
+            habiles_hasta = EXCLUDED.habiles_hasta
+    """), filas)
+    db.session.execute(
+        text("DELETE FROM calendario_laboral WHERE fecha < :inicio OR fecha > :fin"),
+        {'inicio': CALENDARIO.inicio, 'fin': CALENDARIO.fin}
+    )
+    _calendario_sql_hasta = CALENDARIO.fin
+    return len(filas)
+
+
+def asegurar_calendario_sql(hoy):
+    """Materializa el calendario en SQL si la tabla no cubre la fecha indicada."""
+    global _calendario_sql_hasta
+    if _calendario_sql_hasta is None or _calendario_sql_hasta < hoy:
+        _calendario_sql_hasta = db.session.query(func.max(DiaCalendario.fecha)).scalar()
+    if _calendario_sql_hasta is None or _calendario_sql_hasta < hoy:
+        CALENDARIO.contar(hoy, hoy)  # Amplía el calendario en memoria si hace falta
+        sincronizar_calendario_sql()
+
+# Estado derivado de toda la cartera activa a la fecha :hoy, por conjuntos. Reproduce exactamente
+# Prestamo.calcular_estado_derivado() (benchmarks/recalculo_cartera.py lo verifica al céntimo):
+#   - los días hábiles (máximo 22) salen de la tabla calendario_laboral restando
+#     habiles_hasta(fin) - habiles_antes(inicio), igual que calcular_dias_habiles();
+#   - la mora solo corre si el préstamo ya venció y el saldo almacenado es positivo.
+# Lo usan el recálculo programado (que guarda el resultado) y los reportes (que lo leen).
+# _CTE_CALCULO_DERIVADO parte de un CTE `base` con una fila por préstamo; la foto de saldos lo
+# combina con su propia base, reconstruida a la fecha de la foto.
+_CTE_BASE_VIGENTE = """
+    base AS (
+        SELECT p.id,
+               p.fecha_inicio,
+               p.monto_total,
+               p.cuota_diaria,
+               p.total_pagado,
+               p.estado,
+               p.fecha_pago_completo,
+               COALESCE(p.fecha_fin, p.fecha_inicio + 30) AS fecha_fin_efectiva,
+               (CAST(:hoy AS date) > COALESCE(p.fecha_fin, p.fecha_inicio + 30) AND p.saldo > 0) AS corre_mora
+        FROM prestamos p
+        WHERE p.estado IN ('activo', 'vencido') {filtro}
+        {bloqueo}
+    ),"""
+
+_CTE_CALCULO_DERIVADO = """
+    dias AS (
+        SELECT b.*,
+               CASE WHEN b.fecha_inicio > CAST(:hoy AS date) THEN 0
+                    ELSE LEAST(22, GREATEST(0, ct.habiles_hasta - ci.habiles_antes))
+               END AS dias_transcurridos,
+               CASE WHEN b.corre_mora
+                    THEN LEAST(22, GREATEST(0, ch.habiles_hasta - cf.habiles_antes))
+                    ELSE 0
+               END AS dias_vencidos
+        FROM base b
+        LEFT JOIN calendario_laboral ci ON ci.fecha = b.fecha_inicio
+        LEFT JOIN calendario_laboral ct ON ct.fecha = LEAST(CAST(:hoy AS date), b.fecha_fin_efectiva)
+        LEFT JOIN calendario_laboral cf ON cf.fecha = b.fecha_fin_efectiva
+        LEFT JOIN calendario_laboral ch ON ch.fecha = CAST(:hoy AS date)
+    ),
+    montos AS (
+        SELECT d.*,
+               d.dias_transcurridos * d.cuota_diaria AS deuda_esperada,
+               CASE WHEN d.corre_mora THEN 0.005 * d.monto_total * d.dias_vencidos ELSE 0 END AS mora_total
+        FROM dias d
+    ),
+    saldos AS (
+        SELECT m.*,
+               m.monto_total - m.total_pagado + m.mora_total AS nuevo_saldo,
+               GREATEST(0, m.deuda_esperada - m.total_pagado) AS deuda_vencida_base,
+               GREATEST(0, m.mora_total - GREATEST(0, m.total_pagado - m.deuda_esperada)) AS mora_pendiente
+        FROM montos m
+    ),
+    calculo AS (
+        SELECT s.id,
+               CAST(:hoy AS date) - s.fecha_inicio AS dt,
+               s.deuda_esperada,
+               s.nuevo_saldo,
+               s.deuda_vencida_base + s.mora_pendiente AS nueva_deuda_vencida,
+               s.mora_pendiente,
+               CASE
+                   WHEN CAST(:hoy AS date) > s.fecha_fin_efectiva AND s.nuevo_saldo > 0 THEN 'vencido'
+                   WHEN s.estado = 'vencido' AND s.nuevo_saldo <= 0 THEN 'pagado'
+                   ELSE s.estado
+               END AS nuevo_estado,
+               CASE
+                   WHEN CAST(:hoy AS date) > s.fecha_fin_efectiva AND s.nuevo_saldo > 0 THEN s.fecha_pago_completo
+                   WHEN s.estado = 'vencido' AND s.nuevo_saldo <= 0 THEN CAST(:hoy AS date)
+                   ELSE s.fecha_pago_completo
+               END AS nueva_fecha_pago_completo
+        FROM saldos s
+    )
+"""
+
+_CTE_ESTADO_DERIVADO = _CTE_BASE_VIGENTE + _CTE_CALCULO_DERIVADO
+
+# Solo lectura, redondeado a céntimos como al guardarlo en las columnas Numeric(10, 2)
+SQL_ESTADO_DERIVADO = text("WITH " + _CTE_ESTADO_DERIVADO.format(filtro='', bloqueo='') + """
+    SELECT c.id,
+           c.dt,
+           ROUND(c.nuevo_saldo, 2) AS saldo,
+           ROUND(c.nueva_deuda_vencida, 2) AS deuda_vencida,
+           ROUND(c.mora_pendiente, 2) AS mora_pendiente,
+           c.nuevo_estado AS estado,
+           c.nueva_fecha_pago_completo AS fecha_pago_completo
+    FROM calculo c
+""").columns(
+    db.column('id', db.Integer), db.column('dt', db.Integer), db.column('saldo', db.Numeric(10, 2)),
+    db.column('deuda_vencida', db.Numeric(10, 2)), db.column('mora_pendiente', db.Numeric(10, 2)),
+    db.column('estado', db.String(50)), db.column('fecha_pago_completo', db.Date)
+)
+
+# Recalculo de toda la cartera activa en una sola sentencia. Las filas se bloquean (FOR UPDATE,
+# en orden de id) antes de leerlas, así un pago que se confirma mientras tanto se ve en el
+# cálculo en lugar de quedar pisado por un saldo viejo.
+SQL_RECALCULAR_CARTERA = text(
+    "WITH " + _CTE_ESTADO_DERIVADO.format(filtro='', bloqueo='ORDER BY p.id FOR UPDATE OF p') + """
+    UPDATE prestamos p
+    SET dt = c.dt,
+        saldo = c.nuevo_saldo,
+        deuda_vencida = c.nueva_deuda_vencida,
+        estado = c.nuevo_estado,
+        fecha_pago_completo = c.nueva_fecha_pago_completo
+    FROM calculo c
+    WHERE p.id = c.id
+""")
+
+# Ruta de cobro de un trabajador: el mismo cálculo, solo para los préstamos de sus clientes
+# (ix_clientes_trabajador_id), con los datos de contacto del cliente
+SQL_RUTA_COBRO = text("WITH " + _CTE_ESTADO_DERIVADO.format(
+    filtro='AND p.cliente_id IN (SELECT id FROM clientes WHERE trabajador_id = :trabajador_id)', bloqueo=''
+) + """
+    SELECT p.id, p.cliente_id, cl.nombre, cl.dni, cl.direccion, cl.telefono,
+           p.tipo_prestamo, p.tipo_frecuencia, p.monto_principal, p.monto_total, p.cuota_diaria,
+           p.fecha_inicio, p.fecha_fin, p.num_cuotas, p.total_pagado, p.ultima_fecha_pago,
+           c.dt,
+           c.nuevo_estado AS estado,
+           ROUND(c.nuevo_saldo, 2) AS saldo,
+           ROUND(c.deuda_esperada, 2) AS esperado_hoy,
+           ROUND(c.nueva_deuda_vencida, 2) AS faltante,
+           ROUND(c.mora_pendiente, 2) AS mora_pendiente
+    FROM calculo c
+    JOIN prestamos p ON p.id = c.id
+    JOIN clientes cl ON cl.id = p.cliente_id
+    WHERE c.nuevo_estado IN ('activo', 'vencido')
+    ORDER BY cl.nombre, cl.id, p.id
+""")
+
+
+def recalcular_cartera(hoy=None):
+    """
+    Recalcula saldo, deuda vencida, dt y estado de todos los préstamos activos/vencidos
+    con SQL por conjuntos. Devuelve el número de préstamos actualizados (sin hacer commit).
+    """
+    hoy = hoy or get_current_date()
+    asegurar_calendario_sql(hoy)
+    resultado = db.session.execute(SQL_RECALCULAR_CARTERA, {'hoy': hoy})
+    return resultado.rowcount
+
 
 def actualizar_prestamos_activos():
     """Actualiza días transcurridos y deuda vencida para todos los préstamos activos"""
-    prestamos_activos = Prestamo.query.filter(Prestamo.estado.in_(['activo', 'vencido'])).all()
-    
-    for prestamo in prestamos_activos:
-        prestamo.calcular_dias_transcurridos()
-        prestamo.calcular_deuda_vencida()
-    
+    recalcular_cartera()
+    db.session.commit()
+    registrar_cambio_cartera()
+
+
+# Foto de saldos al cierre de :hoy, reconstruida a esa fecha para poder tomarla a cualquier hora o
+# recuperar días atrasados: entran los préstamos ya iniciados que seguían abiertos al terminar el día
+# (activos/vencidos, o cerrados después: pagados con fecha_pago_completo posterior, refinanciados por
+# un préstamo que empezó después), con lo pagado hasta ese día según las cuotas
+# (ix_cuotas_prestamo_id_fecha_pago). El estado y la mora salen de la fecha: un préstamo abierto tiene
+# saldo, así que vence y corre mora si ya pasó su fecha de fin. Luego el mismo cálculo que el
+# recálculo, y una fila con los totales del día (solo activos/vencidos, como el resumen de créditos).
+# Un día que ya tiene foto no se reescribe (ON CONFLICT DO NOTHING).
+_CTE_BASE_A_FECHA = """
+    base AS (
+        SELECT p.id,
+               p.fecha_inicio,
+               p.monto_total,
+               p.cuota_diaria,
+               COALESCE(pagado.total, 0) AS total_pagado,
+               CASE WHEN CAST(:hoy AS date) > COALESCE(p.fecha_fin, p.fecha_inicio + 30)
+                    THEN 'vencido' ELSE 'activo' END AS estado,
+               CAST(NULL AS date) AS fecha_pago_completo,
+               COALESCE(p.fecha_fin, p.fecha_inicio + 30) AS fecha_fin_efectiva,
+               CAST(:hoy AS date) > COALESCE(p.fecha_fin, p.fecha_inicio + 30) AS corre_mora
+        FROM prestamos p
+        LEFT JOIN LATERAL (
+            SELECT SUM(cu.monto) AS total
+            FROM cuotas cu
+            WHERE cu.prestamo_id = p.id AND cu.fecha_pago <= CAST(:hoy AS date)
+        ) pagado ON true
+        WHERE p.fecha_inicio <= CAST(:hoy AS date)
+          AND (p.estado IN ('activo', 'vencido')
+               OR (p.estado = 'pagado'
+                   AND COALESCE(p.fecha_pago_completo, p.ultima_fecha_pago) > CAST(:hoy AS date))
+               OR (p.estado = 'refinanciado'
+                   AND EXISTS (SELECT 1 FROM prestamos r
+                               WHERE r.prestamo_refinanciado_id = p.id
+                                 AND r.fecha_inicio > CAST(:hoy AS date))))
+    ),"""
+
+SQL_FOTO_SALDOS = text("WITH " + _CTE_BASE_A_FECHA + _CTE_CALCULO_DERIVADO + """,
+    foto AS (
+        INSERT INTO saldos_diarios (fecha, prestamo_id, cliente_id, trabajador_id, estado, saldo,
+                                    deuda_vencida, mora_pendiente)
+        SELECT CAST(:hoy AS date), c.id, p.cliente_id, cl.trabajador_id, c.nuevo_estado,
+               ROUND(c.nuevo_saldo, 2), ROUND(c.nueva_deuda_vencida, 2), ROUND(c.mora_pendiente, 2)
+        FROM calculo c
+        JOIN prestamos p ON p.id = c.id
+        JOIN clientes cl ON cl.id = p.cliente_id
+        ON CONFLICT (fecha, prestamo_id) DO NOTHING
+        RETURNING estado, saldo, deuda_vencida, mora_pendiente
+    )
+    INSERT INTO resumen_saldos_diarios (fecha, prestamos, vigentes, vencidos, saldo_total,
+                                        deuda_vencida_total, mora_total)
+    SELECT CAST(:hoy AS date),
+           COUNT(*),
+           COUNT(*) FILTER (WHERE estado = 'activo'),
+           COUNT(*) FILTER (WHERE estado = 'vencido'),
+           COALESCE(SUM(saldo) FILTER (WHERE estado IN ('activo', 'vencido')), 0),
+           COALESCE(SUM(deuda_vencida) FILTER (WHERE estado IN ('activo', 'vencido')), 0),
+           COALESCE(SUM(mora_pendiente) FILTER (WHERE estado IN ('activo', 'vencido')), 0)
+    FROM foto
+    ON CONFLICT (fecha) DO NOTHING
+    RETURNING prestamos
+""")
+
+
+def tomar_foto_saldos(fecha):
+    """
+    Guarda la foto de saldos al cierre de `fecha` si ese día todavía no tiene una.
+    Devuelve el número de préstamos guardados (0 si ya existía). Sin hacer commit.
+    """
+    asegurar_calendario_sql(fecha)
+    return db.session.execute(SQL_FOTO_SALDOS, {'hoy': fecha}).scalar() or 0
+
+
+# Caché en memoria del resumen de créditos: {'fecha', 'version', 'expira', 'datos'}
+_resumen_cache = {}
+
+
+def invalidar_resumen_creditos():
+    """Descarta el resumen de créditos en caché de este worker."""
+    _resumen_cache.clear()
+
+
+def registrar_cambio_cartera():
+    """
+    Llamar después del commit de cada escritura en clientes, préstamos, cuotas o trabajadores:
+    descarta el resumen en caché y avanza la versión de la cartera, lo que invalida los ETag en todos los workers.
+    """
+    invalidar_resumen_creditos()
+    db.session.execute(text("SELECT nextval('version_cartera')"))
+    g.pop('version_cartera', None)
+
+
+def version_cartera():
+    """Versión actual de la cartera (se lee una vez por petición)."""
+    if 'version_cartera' not in g:
+        # Antes del primer nextval, last_value ya vale 1 pero is_called es falso
+        g.version_cartera = db.session.execute(text(
+            'SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM version_cartera'
+        )).scalar()
+    return g.version_cartera
+
+
+def calcular_resumen_creditos():
+    """Calcula todas las cifras del resumen de créditos en una sola consulta agregada (archivados incluidos)."""
+    activos = PrestamoHistorial.estado.in_(['activo', 'vencido'])
+    # Gastos administrativos: 1 sol por cada 50 de monto principal, solo con interés de 10%
+    # (misma regla que Prestamo.calcular_gastos_administrativos)
+    gastos = case(
+        (and_(PrestamoHistorial.interes == 10, PrestamoHistorial.monto_principal > 0),
+         func.floor(PrestamoHistorial.monto_principal / 50)),
+        else_=0
+    )
+    fila = db.session.query(
+        func.count(PrestamoHistorial.id),
+        func.count(PrestamoHistorial.id).filter(PrestamoHistorial.estado == 'activo'),
+        func.count(PrestamoHistorial.id).filter(PrestamoHistorial.estado == 'vencido'),
+        func.count(PrestamoHistorial.id).filter(PrestamoHistorial.estado == 'pagado'),
+        func.count(PrestamoHistorial.id).filter(PrestamoHistorial.estado == 'refinanciado'),
+        func.coalesce(func.sum(PrestamoHistorial.saldo).filter(activos), 0),
+        func.coalesce(func.sum(PrestamoHistorial.deuda_vencida).filter(activos), 0),
+        func.coalesce(func.sum(gastos), 0)
+    ).one()
+
+    total, vigentes, vencidos, pagados, refinanciados, deuda_total, deuda_vencida_total, gastos_total = fila
+    return {
+        'totalCreditos': total,
+        'creditosVigentes': vigentes,  # Créditos vigentes = activos (no vencidos)
+        'creditosVencidos': vencidos,
+        'creditosPagados': pagados,
+        'creditosRefinanciados': refinanciados,
+        'deudaTotal': float(deuda_total),
+        'deudaVencidaTotal': float(deuda_vencida_total),
+        'gastosAdministrativosTotal': float(gastos_total)
+    }
+
+
+def opciones_carga_cliente(filtro_prestamos=None, incluir_cuotas=True):
+    """
+    Opciones de carga ansiosa para serializar clientes con su trabajador, préstamos y
+    cuotas en un número fijo de consultas (sin N+1 por cliente o por préstamo).
+    Si se indica filtro_prestamos, solo se cargan los préstamos que lo cumplen.
+    """
+    prestamos = Cliente.prestamos
+    if filtro_prestamos is not None:
+        prestamos = prestamos.and_(filtro_prestamos)
+    carga_prestamos = subqueryload(prestamos)
+    if incluir_cuotas:
+        carga_prestamos = carga_prestamos.subqueryload(Prestamo.cuotas)
+    return [joinedload(Cliente.trabajador), carga_prestamos]
+
+
+def proyeccion_prestamos(args, vista_por_defecto='list'):
+    """
+    Lee ?view=list|detail|collector, ?fields=a,b,c e ?include=cuotas y devuelve
+    (campos, incluir_cuotas) para Prestamo.to_dict(). Lanza ValueError si algo no es válido.
+    """
+    vista = args.get('view', vista_por_defecto)
+    if vista not in VISTAS_PRESTAMO:
+        raise ValueError(f"view debe ser uno de: {', '.join(VISTAS_PRESTAMO)}")
+    campos = VISTAS_PRESTAMO[vista]
+
+    if args.get('fields'):
+        campos = [campo.strip() for campo in args['fields'].split(',') if campo.strip()]
+        desconocidos = [campo for campo in campos if campo not in CAMPOS_PRESTAMO]
+        if desconocidos:
+            raise ValueError(f"Campos desconocidos: {', '.join(desconocidos)}")
+
+    incluidos = {valor.strip() for valor in args.get('include', '').split(',') if valor.strip()}
+    if incluidos - {'cuotas'}:
+        raise ValueError('include solo admite: cuotas')
+    return campos, vista == 'detail' or 'cuotas' in incluidos
+
+
+# ---------------- RECÁLCULO PROGRAMADO ----------------
+TRABAJO_RECALCULO = 'recalculo_cartera'
+TRABAJO_CONCILIACION = 'conciliacion_pagos'
+TRABAJO_FOTO_SALDOS = 'foto_saldos_diarios'
+TRABAJO_ARCHIVO = 'archivo_prestamos'
+# Claves de los advisory locks de PostgreSQL de cada trabajo (720003 es de migraciones/)
+CLAVE_BLOQUEO_RECALCULO = 720001
+CLAVE_BLOQUEO_CONCILIACION = 720002
+CLAVE_BLOQUEO_FOTO_SALDOS = 720004
+CLAVE_BLOQUEO_ARCHIVO = 720005
+
+_programador_iniciado = False
+_programador_lock = threading.Lock()
+
+# Totales reales por préstamo a partir de la tabla cuotas, y condición de descuadre
+_SQL_TOTALES_REALES = """
+    SELECT p.id,
+           COALESCE(SUM(c.monto), 0) AS total_pagado,
+           COUNT(c.id) AS num_cuotas,
+           MAX(c.fecha_pago) AS ultima_fecha_pago
+    FROM prestamos p
+    LEFT JOIN cuotas c ON c.prestamo_id = p.id
+    {filtro}
+    GROUP BY p.id
+"""
+_CONDICION_DESCUADRE = """
+    (p.total_pagado, p.num_cuotas) IS DISTINCT FROM (r.total_pagado, r.num_cuotas)
+    OR p.ultima_fecha_pago IS DISTINCT FROM r.ultima_fecha_pago
+"""
+SQL_VERIFICAR_TOTALES = text(f"""
+    SELECT p.id FROM prestamos p JOIN ({_SQL_TOTALES_REALES.format(filtro='')}) r ON r.id = p.id
+    WHERE {_CONDICION_DESCUADRE}
+    ORDER BY p.id
+""")
+SQL_BLOQUEAR_IDS = text("SELECT id FROM prestamos WHERE id = ANY(:ids) ORDER BY id FOR UPDATE")
+# Solo los :ids ya bloqueados; la condición se vuelve a evaluar con los datos vigentes tras el bloqueo
+SQL_CORREGIR_TOTALES = text(f"""
+    UPDATE prestamos p
+    SET total_pagado = r.total_pagado,
+        num_cuotas = r.num_cuotas,
+        ultima_fecha_pago = r.ultima_fecha_pago
+    FROM ({_SQL_TOTALES_REALES.format(filtro='WHERE p.id = ANY(:ids)')}) r
+    WHERE r.id = p.id AND ({_CONDICION_DESCUADRE})
+    RETURNING p.id
+""")
+
+
+def conciliar_totales_pagos(corregir=False):
+    """
+    Compara total_pagado, num_cuotas y ultima_fecha_pago de cada préstamo con la tabla cuotas.
+    Devuelve los ids descuadrados; con corregir=True además los corrige (sin hacer commit).
+    La comparación no bloquea nada; para corregir se bloquean solo los descuadrados, por lotes, y se
+    vuelven a comparar: los pagos insertan la cuota con el préstamo bloqueado, así un pago confirmado
+    entre la comparación y el bloqueo no se pisa (y el préstamo ya no se corrige si quedó cuadrado).
+    """
+    descuadrados = db.session.execute(SQL_VERIFICAR_TOTALES).scalars().all()
+    if not corregir:
+        return descuadrados
+    corregidos = []
+    for inicio in range(0, len(descuadrados), TAMANO_LOTE):
+        ids = descuadrados[inicio:inicio + TAMANO_LOTE]
+        db.session.execute(SQL_BLOQUEAR_IDS, {'ids': ids})
+        corregidos.extend(db.session.execute(SQL_CORREGIR_TOTALES, {'ids': ids}).scalars())
+    return sorted(corregidos)
+
+
+# Puntualidad de todas las cuotas de los préstamos con :desde < id <= :hasta, en una pasada por
+# préstamo (ix_cuotas_prestamo_id_fecha_pago): la suma acumulada de lo pagado hasta la fecha de cada
+# cuota, incluidas las demás del mismo día (marco RANGE por defecto), contra lo esperado hasta ese día.
+# Es la regla de Prestamo.calcular_estado_pago_cuota(). Solo escribe las cuotas cuya etiqueta cambia.
+SQL_CLASIFICAR_PUNTUALIDAD = text("""
+    UPDATE cuotas c
+    SET estado_pago = x.estado_pago
+    FROM (
+        SELECT c.id,
+               CASE
+                   WHEN c.fecha_pago < p.fecha_inicio THEN 'anticipado'
+                   WHEN c.fecha_pago = p.fecha_inicio THEN 'a_tiempo'
+                   WHEN SUM(c.monto) OVER (PARTITION BY c.prestamo_id ORDER BY c.fecha_pago)
+                        >= (c.fecha_pago - p.fecha_inicio + 1) * p.cuota_diaria THEN 'a_tiempo'
+                   ELSE 'con_retraso'
+               END AS estado_pago
+        FROM cuotas c
+        JOIN prestamos p ON p.id = c.prestamo_id
+        WHERE c.prestamo_id > :desde AND c.prestamo_id <= :hasta AND p.id > :desde AND p.id <= :hasta
+    ) x
+    WHERE c.id = x.id AND c.prestamo_id > :desde AND c.prestamo_id <= :hasta
+      AND c.estado_pago IS DISTINCT FROM x.estado_pago
+""")
+
+
+def clasificar_puntualidad(desde, hasta):
+    """Reclasifica la puntualidad de las cuotas de los préstamos con desde < id <= hasta. Sin commit."""
+    return db.session.execute(SQL_CLASIFICAR_PUNTUALIDAD, {'desde': desde, 'hasta': hasta}).rowcount
+
+
+# Préstamos por lote en los procesos que recorren toda la cartera. Cada lote es una transacción
+# corta: si el proceso se corta solo se pierde el lote en curso, y como las sentencias solo tocan
+# filas que todavía difieren del resultado, volver a ejecutarlo retoma donde quedó.
+TAMANO_LOTE = 10000
+
+# Bloquea el siguiente lote de préstamos en orden de id (el mismo orden que usan los pagos)
+SQL_BLOQUEAR_LOTE = text("SELECT id FROM prestamos WHERE id > :desde ORDER BY id LIMIT :lote FOR UPDATE")
+
+
+def aplicar_tiempos_de_trabajo():
+    """
+    Cambia statement_timeout y lock_timeout de la transacción en curso (SET LOCAL) a los de los
+    trabajos largos; los límites de los requests volverían a cortarlos con una cartera grande.
+    """
+    db.session.execute(
+        text("SELECT set_config('statement_timeout', :sentencia, true), set_config('lock_timeout', :bloqueo, true)"),
+        {'sentencia': str(DB_TRABAJOS_STATEMENT_TIMEOUT_MS), 'bloqueo': str(DB_TRABAJOS_LOCK_TIMEOUT_MS)}
+    )
+
+
+def actualizar_por_lotes(descripcion, sentencia, tamano_lote=TAMANO_LOTE):
+    """
+    Ejecuta `sentencia` (acotada a los préstamos con :desde < id <= :hasta) sobre lotes
+    consecutivos de préstamos, con un commit por lote e informando el avance. Los préstamos
+    del lote se bloquean antes, así un pago que se confirma a la mitad no queda fuera del cálculo.
+    Devuelve el número de filas actualizadas.
+    """
+    total = db.session.execute(text("SELECT COUNT(*) FROM prestamos")).scalar()
+    desde, revisados, actualizados = 0, 0, 0
+    inicio = time.perf_counter()
+    while True:
+        aplicar_tiempos_de_trabajo()  # Cada commit termina la transacción y con ella el SET LOCAL
+        ids = db.session.execute(SQL_BLOQUEAR_LOTE, {'desde': desde, 'lote': tamano_lote}).scalars().all()
+        if not ids:
+            break
+        actualizados += db.session.execute(sentencia, {'desde': desde, 'hasta': ids[-1]}).rowcount
+        db.session.commit()
+        desde = ids[-1]
+        revisados += len(ids)
+        print(f"   {descripcion}: {revisados}/{total} préstamos revisados, {actualizados} actualizados "
+              f"({time.perf_counter() - inicio:.1f} s)")
     db.session.commit()
+    return actualizados
+
+
+# Préstamos que se pueden archivar: cerrados (pagados o refinanciados) hace más de la antigüedad
+# configurada. La fecha de cierre es la del pago completo o, si no la tiene, la del último pago.
+_CONDICION_ARCHIVABLE = """
+    p.estado IN ('pagado', 'refinanciado')
+    AND COALESCE(p.fecha_pago_completo, p.ultima_fecha_pago, p.fecha_inicio) <= CAST(:limite AS date)
+"""
+
+# Siguiente lote de préstamos archivables, bloqueados. Un préstamo refinanciado se queda mientras
+# lo referencie (prestamo_refinanciado_id) uno que se queda, a lo largo de toda la cadena. Los lotes
+# van de los ids más altos a los más bajos: el préstamo REF (creado después) sale antes o junto con
+# el que refinanció. Sin SKIP LOCKED: saltar un REF bloqueado (por un pago, pagado_manual o la
+# conciliación) dejaría elegir igual al préstamo que refinanció y borrarlo con el REF todavía
+# apuntándole. El lote espera esos bloqueos, que son cortos; dos archivos a la vez ya los impide el
+# advisory lock del trabajo (CLAVE_BLOQUEO_ARCHIVO).
+SQL_ELEGIR_LOTE_ARCHIVO = text(f"""
+    WITH RECURSIVE retenidos AS (
+        SELECT p.prestamo_refinanciado_id AS id
+        FROM prestamos p
+        WHERE p.prestamo_refinanciado_id IS NOT NULL AND NOT ({_CONDICION_ARCHIVABLE})
+        UNION
+        SELECT p.prestamo_refinanciado_id
+        FROM prestamos p
+        JOIN retenidos r ON r.id = p.id
+        WHERE p.prestamo_refinanciado_id IS NOT NULL
+    )
+    SELECT p.id
+    FROM prestamos p
+    WHERE {_CONDICION_ARCHIVABLE}
+      AND NOT EXISTS (SELECT 1 FROM retenidos r WHERE r.id = p.id)
+    ORDER BY p.id DESC
+    LIMIT :lote
+    FOR UPDATE OF p
+""")
+
+_COLUMNAS_PRESTAMO, _COLUMNAS_CUOTA, _COLUMNAS_PAGO = (
+    ', '.join(c.name for c in modelo.__table__.columns) for modelo in (Prestamo, Cuota, Pago)
+)
+
+# Mueve los préstamos :ids con sus cuotas y pagos a las tablas de archivo en una sola sentencia
+# (las claves foráneas se verifican al final de la sentencia, con todo ya movido)
+SQL_ARCHIVAR_LOTE = text(f"""
+    WITH cuotas_movidas AS (
+        DELETE FROM cuotas WHERE prestamo_id = ANY(:ids) RETURNING {_COLUMNAS_CUOTA}
+    ), pagos_movidos AS (
+        DELETE FROM pagos WHERE prestamo_id = ANY(:ids) RETURNING {_COLUMNAS_PAGO}
+    ), prestamos_movidos AS (
+        DELETE FROM prestamos WHERE id = ANY(:ids) RETURNING {_COLUMNAS_PRESTAMO}
+    ), cuotas_copiadas AS (
+        INSERT INTO cuotas_archivadas ({_COLUMNAS_CUOTA})
+        SELECT {_COLUMNAS_CUOTA} FROM cuotas_movidas
+    ), pagos_copiados AS (
+        INSERT INTO pagos_archivados ({_COLUMNAS_PAGO})
+        SELECT {_COLUMNAS_PAGO} FROM pagos_movidos
+    ), prestamos_copiados AS (
+        INSERT INTO prestamos_archivados ({_COLUMNAS_PRESTAMO})
+        SELECT {_COLUMNAS_PRESTAMO} FROM prestamos_movidos
+        RETURNING id
+    )
+    SELECT COUNT(*) FROM prestamos_copiados
+""")
+
+
+def archivar_prestamos(hoy, antiguedad_dias=None, confirmar_por_lote=False, tamano_lote=TAMANO_LOTE):
+    """
+    Mueve a las tablas de archivo los préstamos cerrados hace más de `antiguedad_dias` días (por
+    defecto ARCHIVO_ANTIGUEDAD_DIAS), con sus cuotas y pagos, en lotes de préstamos. Con
+    confirmar_por_lote=True hace commit después de cada lote informando el avance (primer archivo
+    de una base grande); si no, todo queda en la transacción en curso.
+    Devuelve el número de préstamos archivados.
+    """
+    if antiguedad_dias is None:
+        antiguedad_dias = app.config['ARCHIVO_ANTIGUEDAD_DIAS']
+    if antiguedad_dias <= 0:
+        return 0
+    limite = hoy - timedelta(days=antiguedad_dias)
+    archivados = 0
+    inicio = time.perf_counter()
+    while True:
+        aplicar_tiempos_de_trabajo()
+        ids = db.session.execute(SQL_ELEGIR_LOTE_ARCHIVO, {'limite': limite, 'lote': tamano_lote}).scalars().all()
+        if not ids:
+            break
+        archivados += db.session.execute(SQL_ARCHIVAR_LOTE, {'ids': ids}).scalar()
+        if confirmar_por_lote:
+            db.session.commit()
+            print(f"   Archivo: {archivados} préstamos archivados ({time.perf_counter() - inicio:.1f} s)")
+    return archivados
+
+
+def ejecutar_trabajo_programado(nombre, clave_bloqueo, trabajo, intervalo, motivo='intervalo', forzar=False):
+    """
+    Ejecuta trabajo(hoy) si ningún otro worker/contenedor lo está haciendo (advisory lock de
+    transacción) y si no se hizo ya hoy dentro del intervalo, salvo que forzar=True.
+    trabajo devuelve el número de filas actualizadas. Devuelve True si se ejecutó.
+    """
+    with app.app_context(), medir_sql() as medicion:
+        try:
+            aplicar_tiempos_de_trabajo()
+            bloqueado = db.session.execute(
+                text('SELECT pg_try_advisory_xact_lock(:clave)'), {'clave': clave_bloqueo}
+            ).scalar()
+            if not bloqueado:
+                db.session.rollback()
+                metrica_trabajo_ejecuciones.inc(trabajo=nombre, motivo=motivo, resultado='en_curso')
+                return False
+
+            hoy = get_current_date()
+            ahora = get_current_datetime()
+            ejecucion = db.session.get(EjecucionProgramada, nombre)
+            if (not forzar and ejecucion and ejecucion.fecha_calculo == hoy
+                    and ejecucion.ultima_ejecucion > ahora - intervalo):
+                db.session.rollback()
+                metrica_trabajo_ejecuciones.inc(trabajo=nombre, motivo=motivo, resultado='al_dia')
+                return False
+
+            inicio = time.perf_counter()
+            filas = trabajo(hoy)
+            if not ejecucion:
+                ejecucion = EjecucionProgramada(nombre=nombre)
+                db.session.add(ejecucion)
+            if ejecucion.fecha_calculo != hoy and motivo == 'intervalo':
+                motivo = 'cambio_de_dia'
+            ejecucion.ultima_ejecucion = ahora
+            ejecucion.fecha_calculo = hoy
+            ejecucion.duracion_ms = int((time.perf_counter() - inicio) * 1000)
+            ejecucion.filas_actualizadas = filas
+            ejecucion.motivo = motivo
+            db.session.commit()  # Libera el advisory lock
+            registrar_cambio_cartera()
+            registrar_metricas_trabajo(ejecucion, medicion)
+            return True
+        except Exception:
+            db.session.rollback()
+            metrica_trabajo_ejecuciones.inc(trabajo=nombre, motivo=motivo, resultado='error')
+            raise
+
+
+def ejecutar_recalculo_programado(motivo='intervalo', forzar=False):
+    """Recalcula la cartera como máximo una vez por intervalo configurado (y al cambiar el día)."""
+    return ejecutar_trabajo_programado(
+        TRABAJO_RECALCULO, CLAVE_BLOQUEO_RECALCULO, recalcular_cartera,
+        timedelta(minutes=app.config['RECALCULO_INTERVALO_MINUTOS']), motivo, forzar
+    )
+
+
+def _corregir_totales_pagos(hoy):
+    descuadrados = conciliar_totales_pagos(corregir=True)
+    if descuadrados:
+        app.logger.warning('Conciliación: %s préstamos con totales descuadrados corregidos: %s',
+                           len(descuadrados), descuadrados[:20])
+    return len(descuadrados)
+
+
+def ejecutar_conciliacion_programada(motivo='intervalo', forzar=False):
+    """Concilia los totales de pagos contra las cuotas una vez al día."""
+    return ejecutar_trabajo_programado(
+        TRABAJO_CONCILIACION, CLAVE_BLOQUEO_CONCILIACION, _corregir_totales_pagos,
+        timedelta(days=1), motivo, forzar
+    )
+
+
+def dias_sin_foto_saldos(hoy):
+    """
+    Días cerrados que faltan fotografiar: desde el siguiente a la última foto hasta ayer, como máximo
+    FOTO_SALDOS_DIAS_RECUPERAR (los préstamos archivados ya no entran en una foto reconstruida).
+    Sin fotos previas, solo ayer.
+    """
+    ayer = hoy - timedelta(days=1)
+    ultima = db.session.query(func.max(ResumenSaldosDiario.fecha)).scalar()
+    desde = max(ultima + timedelta(days=1) if ultima else ayer,
+                hoy - timedelta(days=app.config['FOTO_SALDOS_DIAS_RECUPERAR']))
+    return [desde + timedelta(days=n) for n in range((ayer - desde).days + 1)]
+
+
+def _fotografiar_dias_cerrados(hoy):
+    # La foto se reconstruye a su fecha, así que da igual a qué hora del día corra; si el proceso
+    # estuvo detenido se recuperan también los días que quedaron sin foto
+    return sum(tomar_foto_saldos(fecha) for fecha in dias_sin_foto_saldos(hoy))
+
+
+def ejecutar_foto_saldos_programada(motivo='intervalo', forzar=False):
+    """Guarda una vez al día la foto de saldos del día anterior (y de los días cerrados que falten)."""
+    return ejecutar_trabajo_programado(
+        TRABAJO_FOTO_SALDOS, CLAVE_BLOQUEO_FOTO_SALDOS, _fotografiar_dias_cerrados,
+        timedelta(days=1), motivo, forzar
+    )
+
+
+def ejecutar_archivo_programado(motivo='intervalo', forzar=False):
+    """Archiva una vez al día los préstamos cerrados que ya superaron la antigüedad configurada."""
+    return ejecutar_trabajo_programado(
+        TRABAJO_ARCHIVO, CLAVE_BLOQUEO_ARCHIVO, archivar_prestamos, timedelta(days=1), motivo, forzar
+    )
+
+
+def segundos_hasta_proxima_ejecucion():
+    """Segundos hasta el siguiente intervalo o hasta la medianoche de Lima, lo que ocurra primero."""
+    ahora = get_current_datetime()
+    manana = datetime.combine(ahora.date() + timedelta(days=1), datetime.min.time())
+    hasta_medianoche = (TIMEZONE.localize(manana) - ahora).total_seconds() + 1
+    return max(1, min(app.config['RECALCULO_INTERVALO_MINUTOS'] * 60, hasta_medianoche))
+
+
+def _bucle_recalculo_programado():
+    while True:
+        try:
+            # La conciliación va primero: el recálculo usa los totales acumulados.
+            # La foto se reconstruye desde las cuotas y no depende del orden; el archivo va al final
+            # para que la foto del día anterior todavía vea los préstamos que cerraron hace poco.
+            ejecutar_conciliacion_programada()
+            ejecutar_foto_saldos_programada()
+            ejecutar_recalculo_programado()
+            ejecutar_archivo_programado()
+        except Exception:
+            app.logger.exception('Error en recálculo programado')
+        time.sleep(segundos_hasta_proxima_ejecucion())
+
+
+@app.before_request
+def iniciar_programador_recalculo():
+    """Arranca el hilo del recálculo programado en el primer request de cada worker."""
+    global _programador_iniciado
+    if _programador_iniciado or not app.config['RECALCULO_PROGRAMADO']:
+        return
+    with _programador_lock:
+        if not _programador_iniciado:
+            threading.Thread(target=_bucle_recalculo_programado, name='recalculo-cartera', daemon=True).start()
+            _programador_iniciado = True
+
+
+@app.cli.command('recalcular-cartera')
+def comando_recalcular_cartera():
+    """Recalcula la cartera activa (uso: flask --app app recalcular-cartera)."""
+    if ejecutar_recalculo_programado(motivo='cli', forzar=True):
+        ejecucion = db.session.get(EjecucionProgramada, TRABAJO_RECALCULO)
+        print(f"Cartera recalculada: {ejecucion.filas_actualizadas} préstamos en {ejecucion.duracion_ms} ms.")
+    else:
+        print("Otro proceso está recalculando la cartera en este momento.")
+
+
+@app.cli.command('conciliar-pagos')
+@click.option('--corregir', is_flag=True, help='Corrige los totales descuadrados.')
+def comando_conciliar_pagos(corregir):
+    """Verifica los totales de pagos de cada préstamo contra las cuotas (uso: flask --app app conciliar-pagos)."""
+    if corregir:
+        if not ejecutar_conciliacion_programada(motivo='cli', forzar=True):
+            print("Otro proceso está conciliando los pagos en este momento.")
+            return
+        ejecucion = db.session.get(EjecucionProgramada, TRABAJO_CONCILIACION)
+        print(f"Préstamos corregidos: {ejecucion.filas_actualizadas}.")
+        return
+
+    descuadrados = conciliar_totales_pagos()
+    db.session.rollback()
+    if descuadrados:
+        print(f"{len(descuadrados)} préstamos descuadrados: {descuadrados[:50]}")
+        sys.exit(1)
+    print("Todos los totales de pagos cuadran con las cuotas.")
+
+
+@app.cli.command('clasificar-puntualidad')
+def comando_clasificar_puntualidad():
+    """Reclasifica la puntualidad de todas las cuotas de la cartera (uso: flask --app app clasificar-puntualidad)."""
+    actualizadas = actualizar_por_lotes("Puntualidad", SQL_CLASIFICAR_PUNTUALIDAD)
+    registrar_cambio_cartera()
+    print(f"Cuotas reclasificadas: {actualizadas}.")
+
+
+@app.cli.command('foto-saldos')
+@click.option('--fecha', type=click.DateTime(formats=['%Y-%m-%d']),
+              help='Día cerrado a fotografiar (por defecto, los que falten hasta ayer).')
+def comando_foto_saldos(fecha):
+    """Guarda las fotos de saldos que todavía no existen (uso: flask --app app foto-saldos)."""
+    if fecha:
+        fecha = fecha.date()
+        if fecha >= get_current_date():
+            raise click.ClickException('Solo se puede fotografiar un día ya cerrado.')
+        guardados = tomar_foto_saldos(fecha)
+        db.session.commit()
+        print(f"Foto de saldos del {fecha.isoformat()}: {guardados} préstamos."
+              if guardados else f"La foto de saldos del {fecha.isoformat()} ya existía.")
+        return
+    if not ejecutar_foto_saldos_programada(motivo='cli', forzar=True):
+        print("Otro proceso está guardando la foto de saldos en este momento.")
+        return
+    ejecucion = db.session.get(EjecucionProgramada, TRABAJO_FOTO_SALDOS)
+    if ejecucion.filas_actualizadas:
+        print(f"Foto de saldos guardada: {ejecucion.filas_actualizadas} préstamos en {ejecucion.duracion_ms} ms.")
+    else:
+        print("Las fotos de saldos hasta ayer ya existían.")
+
+
+@app.cli.command('archivar-prestamos')
+@click.option('--dias', type=int, help='Antigüedad mínima en días (por defecto, ARCHIVO_ANTIGUEDAD_DIAS).')
+def comando_archivar_prestamos(dias):
+    """Archiva los préstamos cerrados antiguos con sus cuotas y pagos (uso: flask --app app archivar-prestamos)."""
+    archivados = archivar_prestamos(get_current_date(), dias, confirmar_por_lote=True)
+    db.session.commit()
+    registrar_cambio_cartera()
+    print(f"Préstamos archivados: {archivados}.")
+
+
+@app.cli.command('migrar')
+@click.option('--hasta', help='Última revisión a aplicar (por defecto, todas).')
+def comando_migrar(hasta):
+    """Aplica las migraciones pendientes del esquema (uso: flask --app app migrar)."""
+    try:
+        aplicadas = migraciones.actualizar(db.engine, hasta)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Revisiones aplicadas: {', '.join(aplicadas)}." if aplicadas else "El esquema ya está al día.")
+
+
+@app.cli.command('revertir-migracion')
+@click.argument('hasta')
+def comando_revertir_migracion(hasta):
+    """Revierte las migraciones posteriores a HASTA ('base' = todas) (uso: flask --app app revertir-migracion 0001)."""
+    try:
+        revertidas = migraciones.revertir(db.engine, hasta)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    print(f"Revisiones revertidas: {', '.join(revertidas)}." if revertidas else "No había nada que revertir.")
+
+
+@app.cli.command('marcar-migracion')
+@click.argument('revision')
+def comando_marcar_migracion(revision):
+    """Registra el esquema en REVISION sin ejecutar nada (uso: flask --app app marcar-migracion 0002)."""
+    try:
+        migraciones.marcar(db.engine, revision)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Esquema marcado en la revisión {revision}.")
+
+
+@app.cli.command('estado-migraciones')
+def comando_estado_migraciones():
+    """Muestra las revisiones del esquema aplicadas y pendientes (uso: flask --app app estado-migraciones)."""
+    for revision, descripcion, aplicada_en in migraciones.estado(db.engine):
+        print(f"{revision}  {aplicada_en.isoformat() if aplicada_en else 'pendiente':<32}  {descripcion}")
+
+
+# ---------------- BÚSQUEDA ----------------
+LIMITE_BUSQUEDA_POR_DEFECTO = 20
+LIMITE_BUSQUEDA_MAXIMO = 50
+
+# Extensiones e índices de la búsqueda de clientes. unaccent() no es IMMUTABLE, por eso se
+# envuelve en normalizar_texto() para poder indexar la expresión con un índice trigram.
+# migraciones/v0006_busqueda_de_clientes.py crea lo mismo en las bases existentes.
+SQL_INDICES_BUSQUEDA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """
+    CREATE OR REPLACE FUNCTION normalizar_texto(texto text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto)) $$
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_clientes_nombre_trgm ON clientes USING gin (normalizar_texto(nombre) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_clientes_dni_prefijo ON clientes (dni varchar_pattern_ops)",
+]
+
+# Sin la función se vuelve a consultar cada BUSQUEDA_REVISION_SEGUNDOS: una migración o init_db.py
+# pueden crearla con los workers ya en marcha
+BUSQUEDA_REVISION_SEGUNDOS = 300
+_busqueda_indexada = {'disponible': False, 'revisar_en': 0.0}
+
+
+def crear_indices_busqueda():
+    """Instala pg_trgm/unaccent y crea los índices de búsqueda (sin hacer commit)."""
+    for sentencia in SQL_INDICES_BUSQUEDA:
+        db.session.execute(text(sentencia))
+    _busqueda_indexada['disponible'] = True
+
+
+def busqueda_indexada_disponible():
+    """Indica si la base de datos tiene la función normalizar_texto() (y por tanto los índices trigram)."""
+    if not _busqueda_indexada['disponible'] and time.monotonic() >= _busqueda_indexada['revisar_en']:
+        _busqueda_indexada['disponible'] = db.session.execute(
+            text("SELECT to_regprocedure('normalizar_texto(text)') IS NOT NULL")
+        ).scalar()
+        _busqueda_indexada['revisar_en'] = time.monotonic() + BUSQUEDA_REVISION_SEGUNDOS
+    return _busqueda_indexada['disponible']
+
+
+# Sin unaccent, las vocales con tilde y la ñ del español se reemplazan con translate()
+LETRAS_CON_TILDE = 'áàäâãéèëêíìïîóòöôõúùüûñç'
+LETRAS_SIN_TILDE = 'aaaaaeeeeiiiiooooouuuunc'
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes (á -> a, ñ -> n), igual que normalizar_texto() en SQL."""
+    descompuesto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def buscar_clientes(termino, limite=LIMITE_BUSQUEDA_POR_DEFECTO):
+    """
+    Busca clientes por prefijo de DNI (solo eso si el término es numérico) o por nombre sin
+    distinguir tildes ni mayúsculas, tolerando errores de tipeo (similitud trigram). Devuelve filas
+    livianas ordenadas por relevancia: primero los DNI y nombres que empiezan con el término.
+    """
+    total_prestamos = select(func.count(Prestamo.id)).where(Prestamo.cliente_id == Cliente.id).scalar_subquery()
+    tiene_prestamo_activo = exists().where(
+        Prestamo.cliente_id == Cliente.id, Prestamo.estado.in_(['activo', 'vencido'])
+    )
+    consulta = db.session.query(
+        Cliente.id, Cliente.nombre, Cliente.dni, Cliente.telefono, Cliente.trabajador_id,
+        total_prestamos.label('total_prestamos'),
+        tiene_prestamo_activo.label('tiene_prestamo_activo')
+    )
+
+    if termino.isdigit():
+        relevancia = literal(1.0)
+        consulta = consulta.filter(Cliente.dni.startswith(termino, autoescape=True)).order_by(Cliente.dni)
+    else:
+        # Documentos no numéricos (carné de extranjería, pasaporte): prefijo tal cual y en mayúsculas,
+        # ambos atendidos por ix_clientes_dni_prefijo
+        dni = or_(*(Cliente.dni.startswith(prefijo, autoescape=True) for prefijo in sorted({termino, termino.upper()})))
+        termino = normalizar_texto(termino)
+        if busqueda_indexada_disponible():
+            nombre = func.normalizar_texto(Cliente.nombre)
+            relevancia = func.similarity(nombre, termino)
+            filtro = or_(nombre.contains(termino, autoescape=True), nombre.op('%')(termino))
+            orden = [relevancia.desc()]
+        else:
+            # Sin pg_trgm: coincidencia parcial sin índice ni tolerancia a errores
+            nombre = func.translate(func.lower(Cliente.nombre), LETRAS_CON_TILDE, LETRAS_SIN_TILDE)
+            relevancia = literal(1.0)
+            filtro = nombre.contains(termino, autoescape=True)
+            orden = []
+        consulta = consulta.filter(or_(filtro, dni)).order_by(
+            case((or_(dni, nombre.startswith(termino, autoescape=True)), 0), else_=1),
+            *orden,
+            Cliente.nombre,
+            Cliente.id
+        )
+
+    return [{
+        'id': fila.id,
+        'nombre': fila.nombre,
+        'dni': fila.dni,
+        'telefono': fila.telefono,
+        'trabajador_id': fila.trabajador_id,
+        'total_prestamos': fila.total_prestamos,
+        'tiene_prestamo_activo': fila.tiene_prestamo_activo,
+        'relevancia': round(float(fila.relevancia), 3)
+    } for fila in consulta.add_columns(relevancia.label('relevancia')).limit(limite)]
+
+
+# ---------------- PAGINACIÓN ----------------
+LIMITE_PAGINA_POR_DEFECTO = 50
+LIMITE_PAGINA_MAXIMO = 200
+
+# Claves de orden permitidas para los listados de clientes (todas NOT NULL)
+CLAVES_ORDEN_CLIENTES = {
+    'id': Cliente.id,
+    'nombre': Cliente.nombre,
+    'dni': Cliente.dni
+}
+
+
+def codificar_cursor(valores):
+    """Codifica la última clave de una página como un cursor opaco."""
+    return base64.urlsafe_b64encode(json.dumps(valores).encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    """Decodifica un cursor generado por codificar_cursor(). Lanza ValueError si no es válido."""
+    try:
+        valor, ultimo_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return valor, int(ultimo_id)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+
+def filtrar_clientes(consulta, args):
+    """Aplica los filtros comunes de clientes: trabajador_id y prefijo de nombre/DNI (q)."""
+    trabajador_id = args.get('trabajador_id')
+    if trabajador_id:
+        consulta = consulta.filter(Cliente.trabajador_id == int(trabajador_id))
+
+    prefijo = args.get('q', '').strip()
+    if prefijo:
+        consulta = consulta.filter(or_(
+            Cliente.nombre.istartswith(prefijo, autoescape=True),
+            Cliente.dni.startswith(prefijo, autoescape=True)
+        ))
+    return consulta
+
+
+def paginar_clientes(consulta, args):
+    """
+    Pagina una consulta de clientes por clave (keyset) ordenando por (orden, id).
+    Devuelve (clientes, siguiente_cursor). Lanza ValueError si los parámetros no son válidos.
+    """
+    orden = args.get('orden', 'id')
+    if orden not in CLAVES_ORDEN_CLIENTES:
+        raise ValueError(f'Orden no soportado: {orden}')
+    columna = CLAVES_ORDEN_CLIENTES[orden]
+    descendente = args.get('direccion', 'asc') == 'desc'
+    limite = min(max(int(args.get('limite', LIMITE_PAGINA_POR_DEFECTO)), 1), LIMITE_PAGINA_MAXIMO)
+
+    cursor = args.get('cursor')
+    if cursor:
+        valor, ultimo_id = decodificar_cursor(cursor)
+        clave = tuple_(columna, Cliente.id)
+        consulta = consulta.filter(
+            clave < tuple_(valor, ultimo_id) if descendente else clave > tuple_(valor, ultimo_id)
+        )
+
+    if descendente:
+        consulta = consulta.order_by(columna.desc(), Cliente.id.desc())
+    else:
+        consulta = consulta.order_by(columna.asc(), Cliente.id.asc())
+
+    clientes = consulta.limit(limite + 1).all()
+    siguiente_cursor = None
+    if len(clientes) > limite:
+        clientes = clientes[:limite]
+        ultimo = clientes[-1]
+        siguiente_cursor = codificar_cursor([getattr(ultimo, orden), ultimo.id])
+    return clientes, siguiente_cursor
+
+
+# ---------------- GET CONDICIONAL ----------------
+def respuesta_condicional(vista):
+    """
+    Decorador para listados y resúmenes: agrega un ETag que depende de la versión de la cartera,
+    la fecha (los valores derivados cambian cada día), el usuario y la URL con sus parámetros.
+    Si el cliente envía If-None-Match con ese ETag, responde 304 sin ejecutar la vista.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = f'{version_cartera()}|{get_current_date()}|{get_jwt_identity()}|{request.full_path}'
+        etag = hashlib.sha1(clave.encode('utf-8')).hexdigest()[:20]
+        if request.if_none_match.contains_weak(etag):
+            respuesta = app.response_class(status=304)
+        else:
+            respuesta = make_response(vista(*args, **kwargs))
+            if respuesta.status_code != 200:
+                return respuesta
+        respuesta.set_etag(etag, weak=True)
+        # El navegador debe revalidar siempre: la versión puede cambiar en cualquier momento
+        respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta
+    return envoltura
 
 
 # ---------------- API ENDPOINTS ----------------
+LIMITE_LOTE_PAGOS = 1000  # Pagos por lote en /api/cuotas/lote
+
 
 @app.route('/api/usuario', methods=['GET'])
 @jwt_required()
@@ -458,6 +2121,7 @@ def crear_cliente_con_prestamo():
         )
         db.session.add(nuevo_prestamo)
         db.session.commit()
+        registrar_cambio_cartera()
 
         return jsonify({'msg': 'Cliente y préstamo creados', 'cliente': nuevo_cliente.to_dict()}), 201
     except Exception as e:
@@ -476,6 +2140,8 @@ def marcar_prestamo_pagado(prestamo_id):
         prestamo = db.session.get(Prestamo, prestamo_id)
         if not prestamo:
             return jsonify({'msg': 'Préstamo no encontrado'}), 404
+        # Bloquear el préstamo (y el refinanciado, si lo hay) frente a pagos y recálculos concurrentes
+        bloquear_prestamos(prestamo_id, prestamo.prestamo_refinanciado_id if prestamo.tipo_prestamo == 'REF' else None)
 
         prestamo.estado = 'pagado'
         prestamo.saldo = Decimal('0.0')
@@ -491,6 +2157,7 @@ def marcar_prestamo_pagado(prestamo_id):
                 prestamo_original.fecha_pago_completo = get_current_date()
 
         db.session.commit()
+        registrar_cambio_cartera()
         return jsonify({'msg': 'Préstamo marcado como pagado exitosamente'}), 200
 
     except Exception as e:
@@ -510,7 +2177,8 @@ def api_create_prestamo():
     if not all(k in data for k in required):
         return jsonify({'msg': 'Faltan campos requeridos'}), 400
     
-    cliente = db.session.get(Cliente, data['cliente_id'])
+    # Bloquear el cliente para que dos solicitudes simultáneas no le creen dos préstamos activos
+    cliente = db.session.get(Cliente, data['cliente_id'], with_for_update=True)
     if not cliente:
         return jsonify({'msg': 'Cliente no existe'}), 404
     
@@ -543,6 +2211,7 @@ def api_create_prestamo():
         )
         db.session.add(p)
         db.session.commit()
+        registrar_cambio_cartera()
         return jsonify(p.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -551,6 +2220,7 @@ def api_create_prestamo():
 
 @app.route('/api/trabajadores', methods=['GET'])
 @jwt_required()
+@respuesta_condicional
 def api_trabajadores():
     """Obtiene la lista de todos los trabajadores (solo para administradores)."""
     claims = get_jwt()
@@ -592,7 +2262,10 @@ def api_crear_trabajador():
     if Usuario.query.filter_by(dni=dni).first():
         return jsonify({'msg': 'DNI ya registrado'}), 400
 
-    pw_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        pw_hash = generar_hash_password(password)
+    except ServidorOcupado:
+        return respuesta_servidor_ocupado()
     trabajador = Usuario(
         username=username, 
         password_hash=pw_hash, 
@@ -603,6 +2276,7 @@ def api_crear_trabajador():
     )
     db.session.add(trabajador)
     db.session.commit()
+    registrar_cambio_cartera()
 
     return jsonify({
         'id': trabajador.id, 
@@ -634,9 +2308,14 @@ def api_editar_trabajador(id):
 
     nueva_password = data.get('password')
     if nueva_password:
-        trabajador.password_hash = bcrypt.generate_password_hash(nueva_password).decode('utf-8')
+        try:
+            trabajador.password_hash = generar_hash_password(nueva_password)
+        except ServidorOcupado:
+            db.session.rollback()
+            return respuesta_servidor_ocupado()
 
     db.session.commit()
+    registrar_cambio_cartera()
     return jsonify({
         'id': trabajador.id,
         'username': trabajador.username,
@@ -660,58 +2339,131 @@ def api_eliminar_trabajador(id):
         return jsonify({'msg': 'Trabajador no encontrado'}), 404
     db.session.delete(trabajador)
     db.session.commit()
+    registrar_cambio_cartera()
 
     return jsonify({'msg': 'Trabajador eliminado con éxito'}), 200
 
 
 @app.route('/api/resumen_creditos', methods=['GET'])
 @jwt_required()
+@respuesta_condicional
 def resumen_creditos():
     """
     Proporciona un resumen estadístico mejorado de los créditos.
+    Se sirve desde caché mientras sea del mismo día, no haya expirado y la versión de la cartera
+    no haya cambiado (en ningún worker).
+    Solo lee: los saldos y estados los mantiene el recálculo programado y los endpoints de escritura.
     """
-    actualizar_prestamos_activos()
-    
-    # Conteos básicos
-    total_creditos = Prestamo.query.count()
-    creditos_activos = Prestamo.query.filter_by(estado='activo').count()
-    creditos_vencidos = Prestamo.query.filter_by(estado='vencido').count()
-    creditos_pagados = Prestamo.query.filter_by(estado='pagado').count()
-    creditos_refinanciados = Prestamo.query.filter_by(estado='refinanciado').count()
-
-    # Créditos vigentes = activos (no vencidos)
-    creditos_vigentes = creditos_activos
-
-    # Deuda total (solo préstamos activos y vencidos)
-    deuda_total = db.session.query(func.sum(Prestamo.saldo)).filter(
-        Prestamo.estado.in_(['activo', 'vencido'])
-    ).scalar()
-    if deuda_total is None:
-        deuda_total = 0.0
-
-    # Deuda vencida total
-    deuda_vencida_total = db.session.query(func.sum(Prestamo.deuda_vencida)).filter(
-        Prestamo.estado.in_(['activo', 'vencido'])
-    ).scalar()
-    if deuda_vencida_total is None:
-        deuda_vencida_total = 0.0
-
-    # Total de gastos administrativos (solo préstamos activos y vencidos)
-    gastos_administrativos_total = sum(
-        prestamo.calcular_gastos_administrativos() 
-        for prestamo in Prestamo.query.all() 
-    )
+    hoy = get_current_date()
+    version = version_cartera()
+    if (_resumen_cache.get('fecha') == hoy and _resumen_cache.get('version') == version
+            and _resumen_cache.get('expira', 0) > time.monotonic()):
+        return jsonify(_resumen_cache['datos'])
+
+    datos = calcular_resumen_creditos()
+    _resumen_cache.update({
+        'fecha': hoy, 'version': version, 'expira': time.monotonic() + RESUMEN_CACHE_TTL, 'datos': datos
+    })
+    return jsonify(datos)
+
+
+DIAS_HISTORIAL_POR_DEFECTO = 30
+DIAS_HISTORIAL_MAXIMO = 366
 
+
+def rango_historial(args):
+    """
+    Lee desde y hasta (fechas ISO) de las consultas históricas. Por defecto, los últimos 30 días
+    cerrados (hasta ayer). Devuelve (desde, hasta); lanza ValueError.
+    """
+    hasta = date.fromisoformat(args['hasta']) if args.get('hasta') else get_current_date() - timedelta(days=1)
+    desde = (date.fromisoformat(args['desde']) if args.get('desde')
+             else hasta - timedelta(days=DIAS_HISTORIAL_POR_DEFECTO - 1))
+    if hasta < desde:
+        raise ValueError('hasta no puede ser anterior a desde')
+    if (hasta - desde).days >= DIAS_HISTORIAL_MAXIMO:
+        raise ValueError(f'El rango no puede superar {DIAS_HISTORIAL_MAXIMO} días')
+    return desde, hasta
+
+
+@app.route('/api/saldos_diarios', methods=['GET'])
+@jwt_required()
+@respuesta_condicional
+def api_saldos_diarios():
+    """
+    Saldo, deuda vencida y mora de la cartera al cierre de cada día entre desde y hasta, leídos de
+    las fotos diarias (sin recalcular la historia). Con trabajador_id, solo los préstamos de los
+    clientes que ese trabajador tenía asignados cada día. Los días sin foto no aparecen.
+    """
+    claims = get_jwt()
+    if claims.get('rol') != 'admin':
+        return jsonify({'msg': 'No autorizado'}), 403
+    try:
+        desde, hasta = rango_historial(request.args)
+        trabajador_id = int(request.args['trabajador_id']) if request.args.get('trabajador_id') else None
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
+    if trabajador_id is None:
+        dias = [
+            resumen.to_dict() for resumen in ResumenSaldosDiario.query.filter(
+                ResumenSaldosDiario.fecha.between(desde, hasta)
+            ).order_by(ResumenSaldosDiario.fecha)
+        ]
+    else:
+        activos = SaldoDiario.estado.in_(['activo', 'vencido'])
+        filas = db.session.query(
+            SaldoDiario.fecha,
+            func.count(),
+            func.count().filter(SaldoDiario.estado == 'activo'),
+            func.count().filter(SaldoDiario.estado == 'vencido'),
+            func.coalesce(func.sum(SaldoDiario.saldo).filter(activos), 0),
+            func.coalesce(func.sum(SaldoDiario.deuda_vencida).filter(activos), 0),
+            func.coalesce(func.sum(SaldoDiario.mora_pendiente).filter(activos), 0)
+        ).filter(
+            SaldoDiario.trabajador_id == trabajador_id, SaldoDiario.fecha.between(desde, hasta)
+        ).group_by(SaldoDiario.fecha).order_by(SaldoDiario.fecha).all()
+        dias = [
+            {
+                'fecha': fecha.isoformat(),
+                'prestamos': prestamos,
+                'vigentes': vigentes,
+                'vencidos': vencidos,
+                'saldo_total': float(saldo),
+                'deuda_vencida_total': float(deuda_vencida),
+                'mora_total': float(mora)
+            } for fecha, prestamos, vigentes, vencidos, saldo, deuda_vencida, mora in filas
+        ]
     return jsonify({
-        'totalCreditos': total_creditos,
-        'creditosVigentes': creditos_vigentes,
-        'creditosVencidos': creditos_vencidos,
-        'creditosPagados': creditos_pagados,
-        'creditosRefinanciados': creditos_refinanciados,
-        'deudaTotal': float(deuda_total),
-        'deudaVencidaTotal': float(deuda_vencida_total),
-        'gastosAdministrativosTotal': float(gastos_administrativos_total)  # Nuevo campo
-    })
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'trabajador_id': trabajador_id,
+        'dias': dias
+    }), 200
+
+
+@app.route('/api/prestamos/<int:prestamo_id>/saldos_diarios', methods=['GET'])
+@jwt_required()
+@respuesta_condicional
+def api_saldos_diarios_prestamo(prestamo_id):
+    """Historial de saldo, deuda vencida, mora y estado de un préstamo al cierre de cada día."""
+    claims = get_jwt()
+    if claims.get('rol') not in ['admin', 'trabajador']:
+        return jsonify({'msg': 'No autorizado'}), 403
+    try:
+        desde, hasta = rango_historial(request.args)
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
+    fotos = SaldoDiario.query.filter(
+        SaldoDiario.prestamo_id == prestamo_id, SaldoDiario.fecha.between(desde, hasta)
+    ).order_by(SaldoDiario.fecha).all()
+    return jsonify({
+        'prestamo_id': prestamo_id,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'dias': [foto.to_dict() for foto in fotos]
+    }), 200
 
 
 @app.route('/api/prestamos/<int:prestamo_id>/cuotas', methods=['GET'])
@@ -721,40 +2473,117 @@ def obtener_cuotas_prestamo(prestamo_id):
     if claims.get('rol') not in ['admin', 'trabajador']:
         return jsonify({'msg': 'No autorizado'}), 403
 
-    prestamo = Prestamo.query.get_or_404(prestamo_id)
-    cuotas = Cuota.query.filter_by(prestamo_id=prestamo_id).order_by(Cuota.fecha_pago.desc()).all()
-    
-    # Calcular deuda vencida y mora
-    deuda_vencida, deuda_vencida_base, mora_pendiente = prestamo.calcular_deuda_vencida()
+    # También préstamos archivados
+    prestamo = db.session.query(PrestamoHistorial).filter(PrestamoHistorial.id == prestamo_id).first_or_404()
+    cuotas = db.session.query(CuotaHistorial).filter(
+        CuotaHistorial.prestamo_id == prestamo_id
+    ).order_by(CuotaHistorial.fecha_pago.desc()).all()
     
+    # Calcular deuda vencida y mora (sin escribir en la base de datos)
+    derivado = prestamo.calcular_estado_derivado()
+
     return jsonify({
         'prestamo_id': prestamo_id,
         'prestamo_info': {
             'cliente_nombre': prestamo.cliente.nombre,
             'monto_total': float(prestamo.monto_total),
-            'saldo_actual': float(prestamo.saldo),
-            'mora_total': float(mora_pendiente),
-            'estado': prestamo.estado
+            'saldo_actual': float(derivado['saldo']),
+            'mora_total': float(derivado['mora_pendiente']),
+            'estado': derivado['estado']
         },
         'cuotas': [c.to_dict() for c in cuotas],
-        'total_cuotas': len(cuotas),
-        'total_pagado': sum(float(c.monto) for c in cuotas)
+        'total_cuotas': prestamo.num_cuotas,
+        'total_pagado': float(prestamo.total_pagado or 0)
     }), 200
 
 
-@app.route('/api/actualizar_prestamos', methods=['POST'])
+@app.route('/api/puntualidad', methods=['GET'])
+@jwt_required()
+@respuesta_condicional
+def api_puntualidad():
+    """
+    Estadísticas de puntualidad por préstamo (cuotas a tiempo, con retraso y anticipadas) a partir
+    de la clasificación guardada en cada cuota. Filtra por prestamo_id, cliente_id o trabajador_id
+    (al menos uno) y devuelve los préstamos ordenados por id, archivados incluidos.
+    Un trabajador solo ve los préstamos de sus propios clientes.
+    """
+    claims = get_jwt()
+    if claims.get('rol') not in ['admin', 'trabajador']:
+        return jsonify({'msg': 'No autorizado'}), 403
+
+    args = request.args.to_dict()
+    if claims.get('rol') == 'trabajador':
+        usuario = Usuario.query.filter_by(username=get_jwt_identity()).first()
+        if not usuario:
+            return jsonify({'msg': 'Usuario no encontrado'}), 404
+        args['trabajador_id'] = usuario.id
+
+    filtros = {'prestamo_id': PrestamoHistorial.id, 'cliente_id': PrestamoHistorial.cliente_id,
+               'trabajador_id': Cliente.trabajador_id}
+    try:
+        condiciones = [columna == int(args[nombre]) for nombre, columna in filtros.items() if args.get(nombre)]
+        if not condiciones:
+            raise ValueError('Indique prestamo_id, cliente_id o trabajador_id')
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
+    filas = db.session.query(
+        PrestamoHistorial.id,
+        PrestamoHistorial.cliente_id,
+        PrestamoHistorial.estado,
+        func.count(CuotaHistorial.id),
+        func.count(CuotaHistorial.id).filter(CuotaHistorial.estado_pago == 'a_tiempo'),
+        func.count(CuotaHistorial.id).filter(CuotaHistorial.estado_pago == 'con_retraso'),
+        func.count(CuotaHistorial.id).filter(CuotaHistorial.estado_pago == 'anticipado'),
+        func.min(CuotaHistorial.fecha_pago),
+        func.max(CuotaHistorial.fecha_pago)
+    ).join(Cliente, Cliente.id == PrestamoHistorial.cliente_id).outerjoin(
+        CuotaHistorial, CuotaHistorial.prestamo_id == PrestamoHistorial.id
+    ).filter(*condiciones).group_by(
+        PrestamoHistorial.id, PrestamoHistorial.cliente_id, PrestamoHistorial.estado
+    ).order_by(PrestamoHistorial.id).all()
+
+    prestamos = [
+        {
+            'prestamo_id': prestamo_id,
+            'cliente_id': cliente_id,
+            'estado': estado,
+            'cuotas': cuotas,
+            'a_tiempo': a_tiempo,
+            'con_retraso': con_retraso,
+            'anticipado': anticipado,
+            'porcentaje_a_tiempo': round(100 * a_tiempo / cuotas, 1) if cuotas else None,
+            'primera_fecha_pago': _fecha_iso(primera),
+            'ultima_fecha_pago': _fecha_iso(ultima)
+        } for prestamo_id, cliente_id, estado, cuotas, a_tiempo, con_retraso, anticipado, primera, ultima in filas
+    ]
+    return jsonify({'prestamos': prestamos}), 200
+
+
+@app.route('/api/actualizar_prestamos', methods=['GET', 'POST'])
 @jwt_required()
 def api_actualizar_prestamos():
-    """Endpoint manual para actualizar días transcurridos y deuda vencida."""
+    """
+    Informa qué tan actualizado está el recálculo de la cartera, que corre en el servidor.
+    Un admin puede forzar un recálculo inmediato con POST ?forzar=1.
+    """
     claims = get_jwt()
     if claims.get('rol') not in ['admin', 'trabajador']:
         return jsonify({'msg': 'No autorizado'}), 403
 
     try:
-        actualizar_prestamos_activos()
-        return jsonify({'msg': 'Préstamos actualizados correctamente'}), 200
+        if request.method == 'POST' and request.args.get('forzar') == '1':
+            if claims.get('rol') != 'admin':
+                return jsonify({'msg': 'No autorizado'}), 403
+            ejecutar_recalculo_programado(motivo='manual', forzar=True)
+
+        ejecucion = db.session.get(EjecucionProgramada, TRABAJO_RECALCULO)
+        datos = ejecucion.to_dict() if ejecucion else {'nombre': TRABAJO_RECALCULO, 'ultima_ejecucion': None}
+        datos['al_dia'] = bool(ejecucion and ejecucion.fecha_calculo == get_current_date())
+        datos['intervalo_minutos'] = app.config['RECALCULO_INTERVALO_MINUTOS']
+        return jsonify(datos), 200
     except Exception as e:
-        return jsonify({'msg': 'Error al actualizar préstamos', 'error': str(e)}), 500
+        return jsonify({'msg': 'Error al consultar la actualización de préstamos', 'error': str(e)}), 500
 
 
 # Mantener compatibilidad
@@ -808,14 +2637,35 @@ def trabajador_page():
 
 @app.route('/api/clientes', methods=['GET'])
 @jwt_required()
+@respuesta_condicional
 def api_clientes():
-    actualizar_prestamos_activos()
-    
-    clientes_bd = Cliente.query.all()
+    """
+    Lista paginada (keyset) de clientes con préstamos activos o vencidos.
+    Parámetros: limite, cursor, orden (id|nombre|dni), direccion (asc|desc),
+    estado (activo|vencido), trabajador_id, solo_vencidos=1 (con deuda vencida), q (prefijo de nombre o DNI).
+    Proyección de los préstamos: view (list|detail|collector, por defecto list), fields, include=cuotas.
+    """
+    estado = request.args.get('estado')
+    if estado and estado not in ['activo', 'vencido']:
+        return jsonify({'msg': 'Estado no válido'}), 400
+
+    filtro_prestamos = Prestamo.estado.in_([estado] if estado else ['activo', 'vencido'])
+    if request.args.get('solo_vencidos') == '1':
+        filtro_prestamos = and_(filtro_prestamos, Prestamo.deuda_vencida > 0)
+
+    try:
+        campos, incluir_cuotas = proyeccion_prestamos(request.args)
+        consulta = filtrar_clientes(Cliente.query.filter(Cliente.prestamos.any(filtro_prestamos)), request.args)
+        consulta = consulta.options(*opciones_carga_cliente(filtro_prestamos, incluir_cuotas))
+        clientes_bd, siguiente_cursor = paginar_clientes(consulta, request.args)
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
     clientes_con_prestamos_activos = []
+    hoy = get_current_date()
 
     for cliente in clientes_bd:
-        prestamos_activos = [p for p in cliente.prestamos if p.estado in ['activo', 'vencido']]
+        prestamos_activos = list(cliente.prestamos)
 
         if prestamos_activos:
             cliente_data = {
@@ -825,7 +2675,7 @@ def api_clientes():
                 'direccion': cliente.direccion,
                 'telefono': cliente.telefono,
                 'fecha_registro': cliente.fecha_registro.isoformat() if cliente.fecha_registro else None,
-                'prestamos': [p.to_dict() for p in prestamos_activos],
+                'prestamos': [p.to_dict(hoy, campos, incluir_cuotas) for p in prestamos_activos],
                 'tiene_prestamo_activo': cliente.tiene_prestamo_activo(),
                 'trabajador_id': cliente.trabajador_id,
                 'trabajador_nombre': (
@@ -836,88 +2686,351 @@ def api_clientes():
             }
             clientes_con_prestamos_activos.append(cliente_data)
 
-    return jsonify(clientes_con_prestamos_activos), 200
+    return jsonify({
+        'clientes': clientes_con_prestamos_activos,
+        'siguiente_cursor': siguiente_cursor
+    }), 200
+
+
+@app.route('/api/ruta', methods=['GET'])
+@jwt_required()
+@respuesta_condicional
+def api_ruta_cobro():
+    """
+    Ruta de cobro: los préstamos activos o vencidos de los clientes asignados a un trabajador, con
+    lo que debería estar pagado a hoy (esperado_hoy) y lo que falta cobrar (faltante, con la mora).
+    Se calcula en SQL solo para esos préstamos, no para toda la cartera.
+    Un trabajador ve su propia ruta; un administrador indica trabajador_id.
+    """
+    claims = get_jwt()
+    if claims.get('rol') == 'trabajador':
+        trabajador = Usuario.query.filter_by(username=get_jwt_identity()).first()
+    elif claims.get('rol') == 'admin':
+        try:
+            trabajador_id = int(request.args['trabajador_id'])
+        except (KeyError, ValueError):
+            return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': 'trabajador_id es obligatorio'}), 400
+        trabajador = Usuario.query.filter_by(id=trabajador_id, rol='trabajador').first()
+    else:
+        return jsonify({'msg': 'No autorizado'}), 403
+    if not trabajador:
+        return jsonify({'msg': 'Trabajador no encontrado'}), 404
+
+    hoy = get_current_date()
+    asegurar_calendario_sql(hoy)
+    filas = db.session.execute(SQL_RUTA_COBRO, {'hoy': hoy, 'trabajador_id': trabajador.id}).mappings().all()
+
+    prestamos = [
+        {
+            'id': fila['id'],
+            'cliente_id': fila['cliente_id'],
+            'nombre': fila['nombre'],
+            'dni': fila['dni'],
+            'direccion': fila['direccion'],
+            'telefono': fila['telefono'],
+            'tipo_prestamo': fila['tipo_prestamo'],
+            'tipo_frecuencia': fila['tipo_frecuencia'],
+            'monto_principal': float(fila['monto_principal']),
+            'monto_total': float(fila['monto_total']),
+            'cuota_diaria': float(fila['cuota_diaria']),
+            'fecha_inicio': _fecha_iso(fila['fecha_inicio']),
+            'fecha_fin': _fecha_iso(fila['fecha_fin']),
+            'total_cuotas': fila['num_cuotas'],
+            'total_pagado': float(fila['total_pagado']),
+            'ultima_fecha_pago': _fecha_iso(fila['ultima_fecha_pago']),
+            'pagado_hoy': fila['ultima_fecha_pago'] == hoy,
+            'dt': fila['dt'],
+            'estado': fila['estado'],
+            'saldo': float(fila['saldo']),
+            'esperado_hoy': float(fila['esperado_hoy']),
+            'faltante': float(fila['faltante']),
+            'mora_pendiente': float(fila['mora_pendiente']),
+        } for fila in filas
+    ]
+    return jsonify({
+        'fecha': hoy.isoformat(),
+        'trabajador': {'id': trabajador.id, 'nombre': trabajador.nombre or trabajador.username},
+        'prestamos': prestamos,
+        'totales': {
+            'prestamos': len(prestamos),
+            'esperado_hoy': float(sum(fila['esperado_hoy'] for fila in filas)),
+            'faltante': float(sum(fila['faltante'] for fila in filas)),
+        }
+    }), 200
 
 
 @app.route('/api/clientes_sin_prestamo', methods=['GET'])
 @jwt_required()
+@respuesta_condicional
 def api_clientes_sin_prestamo():
-    """Obtiene clientes que no tienen préstamos activos para poder crear nuevos préstamos"""
+    """
+    Obtiene clientes que no tienen préstamos activos para poder crear nuevos préstamos.
+    Lista paginada (keyset) con los mismos parámetros de paginación y filtros (q, trabajador_id) que /api/clientes.
+    """
     claims = get_jwt()
     if claims.get('rol') != 'admin':
         return jsonify({'msg': 'No autorizado'}), 403
 
-    clientes_bd = Cliente.query.all()
+    try:
+        consulta = Cliente.query.filter(
+            ~Cliente.prestamos.any(Prestamo.estado.in_(['activo', 'vencido']))
+        )
+        clientes_bd, siguiente_cursor = paginar_clientes(filtrar_clientes(consulta, request.args), request.args)
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
     clientes_sin_prestamo_activo = []
 
     for cliente in clientes_bd:
-        if not cliente.tiene_prestamo_activo():
-            clientes_sin_prestamo_activo.append({
-                'id': cliente.id,
-                'nombre': cliente.nombre,
-                'dni': cliente.dni,
-                'direccion': cliente.direccion,
-                'telefono': cliente.telefono
-            })
+        clientes_sin_prestamo_activo.append({
+            'id': cliente.id,
+            'nombre': cliente.nombre,
+            'dni': cliente.dni,
+            'direccion': cliente.direccion,
+            'telefono': cliente.telefono
+        })
+
+    return jsonify({
+        'clientes': clientes_sin_prestamo_activo,
+        'siguiente_cursor': siguiente_cursor
+    }), 200
+
+
+# Exportación de la cartera: filas leídas con un cursor del lado del servidor, de a bloques
+FILAS_POR_LECTURA_EXPORTACION = 2000
+ESTADOS_PRESTAMO = ('activo', 'vencido', 'pagado', 'refinanciado')
+
+# Los saldos, la deuda y el estado de los préstamos activos se exportan calculados a la fecha
+# (parámetro hoy) con las mismas reglas que el recálculo programado, no como quedaron guardados.
+# Se leen préstamos y cuotas vigentes y archivados (PrestamoHistorial, CuotaHistorial).
+DERIVADO_EXPORTACION = SQL_ESTADO_DERIVADO.subquery('derivado')
+ESTADO_EXPORTADO = func.coalesce(DERIVADO_EXPORTACION.c.estado, PrestamoHistorial.estado)
+SALDO_EXPORTADO = func.coalesce(DERIVADO_EXPORTACION.c.saldo, PrestamoHistorial.saldo)
+DEUDA_VENCIDA_EXPORTADA = func.coalesce(DERIVADO_EXPORTACION.c.deuda_vencida, PrestamoHistorial.deuda_vencida)
+
+COLUMNAS_EXPORTACION_PRESTAMOS = [
+    ('prestamo_id', PrestamoHistorial.id), ('cliente_id', Cliente.id), ('dni', Cliente.dni),
+    ('nombre', Cliente.nombre),
+    ('telefono', Cliente.telefono), ('direccion', Cliente.direccion),
+    ('asesor', func.coalesce(Usuario.nombre, Usuario.username)),
+    ('tipo_prestamo', PrestamoHistorial.tipo_prestamo), ('estado', ESTADO_EXPORTADO),
+    ('fecha_inicio', PrestamoHistorial.fecha_inicio), ('fecha_fin', PrestamoHistorial.fecha_fin),
+    ('monto_principal', PrestamoHistorial.monto_principal), ('interes', PrestamoHistorial.interes),
+    ('monto_total', PrestamoHistorial.monto_total), ('cuota_diaria', PrestamoHistorial.cuota_diaria),
+    ('total_pagado', PrestamoHistorial.total_pagado), ('num_cuotas', PrestamoHistorial.num_cuotas),
+    ('ultima_fecha_pago', PrestamoHistorial.ultima_fecha_pago), ('saldo', SALDO_EXPORTADO),
+    ('deuda_vencida', DEUDA_VENCIDA_EXPORTADA),
+    ('dias_transcurridos', func.coalesce(DERIVADO_EXPORTACION.c.dt, PrestamoHistorial.dt)),
+    ('fecha_pago_completo', case(
+        (DERIVADO_EXPORTACION.c.id.isnot(None), DERIVADO_EXPORTACION.c.fecha_pago_completo),
+        else_=PrestamoHistorial.fecha_pago_completo
+    )),
+    ('prestamo_refinanciado_id', PrestamoHistorial.prestamo_refinanciado_id),
+]
+COLUMNAS_EXPORTACION_CLIENTES = [
+    ('cliente_id', Cliente.id), ('dni', Cliente.dni), ('nombre', Cliente.nombre),
+    ('telefono', Cliente.telefono), ('direccion', Cliente.direccion),
+    ('asesor', func.coalesce(Usuario.nombre, Usuario.username)), ('fecha_registro', Cliente.fecha_registro),
+    ('prestamos', func.count(PrestamoHistorial.id)), ('saldo_total', func.sum(SALDO_EXPORTADO)),
+    ('deuda_vencida_total', func.sum(DEUDA_VENCIDA_EXPORTADA)),
+]
+COLUMNAS_EXPORTACION_CUOTAS = [
+    ('cuota_id', CuotaHistorial.id), ('prestamo_id', CuotaHistorial.prestamo_id), ('dni', Cliente.dni),
+    ('nombre', Cliente.nombre), ('fecha_pago', CuotaHistorial.fecha_pago), ('monto', CuotaHistorial.monto),
+    ('estado_pago', CuotaHistorial.estado_pago), ('descripcion', CuotaHistorial.descripcion),
+]
+
+
+def filtros_exportacion(args):
+    """
+    Lee estado (lista separada por comas), trabajador_id, desde y hasta (fechas ISO).
+    Devuelve (condiciones sobre préstamos, condiciones sobre cuotas). Lanza ValueError.
+    El rango de fechas se aplica a la fecha de inicio del préstamo, y en las cuotas a la fecha de pago.
+    """
+    condiciones = []
+    estados = [e.strip() for e in args.get('estado', '').split(',') if e.strip()]
+    if estados:
+        invalidos = set(estados) - set(ESTADOS_PRESTAMO)
+        if invalidos:
+            raise ValueError(f"estado no válido: {', '.join(sorted(invalidos))}")
+        condiciones.append(ESTADO_EXPORTADO.in_(estados))
+    if args.get('trabajador_id'):
+        condiciones.append(Cliente.trabajador_id == int(args['trabajador_id']))
+
+    desde = date.fromisoformat(args['desde']) if args.get('desde') else None
+    hasta = date.fromisoformat(args['hasta']) if args.get('hasta') else None
+    if desde and hasta and hasta < desde:
+        raise ValueError('hasta no puede ser anterior a desde')
+
+    condiciones_prestamos = list(condiciones)
+    condiciones_cuotas = list(condiciones)
+    if desde:
+        condiciones_prestamos.append(PrestamoHistorial.fecha_inicio >= desde)
+        condiciones_cuotas.append(CuotaHistorial.fecha_pago >= desde)
+    if hasta:
+        condiciones_prestamos.append(PrestamoHistorial.fecha_inicio <= hasta)
+        condiciones_cuotas.append(CuotaHistorial.fecha_pago <= hasta)
+    return condiciones_prestamos, condiciones_cuotas
+
+
+def consultas_exportacion(condiciones_prestamos, condiciones_cuotas, hoy):
+    """{tabla: (nombre de hoja, columnas, consulta)} para la exportación a la fecha hoy, ordenadas por id."""
+    def columnas(definicion):
+        return [expresion.label(nombre) for nombre, expresion in definicion]
+
+    derivado = DERIVADO_EXPORTACION
+    prestamos = (
+        select(*columnas(COLUMNAS_EXPORTACION_PRESTAMOS))
+        .join(Cliente, Cliente.id == PrestamoHistorial.cliente_id)
+        .outerjoin(Usuario, Usuario.id == Cliente.trabajador_id)
+        .outerjoin(derivado, derivado.c.id == PrestamoHistorial.id)
+        .where(*condiciones_prestamos)
+        .order_by(PrestamoHistorial.id)
+        .params(hoy=hoy)
+    )
+    clientes = (
+        select(*columnas(COLUMNAS_EXPORTACION_CLIENTES))
+        .select_from(Cliente)
+        .join(PrestamoHistorial, PrestamoHistorial.cliente_id == Cliente.id)
+        .outerjoin(Usuario, Usuario.id == Cliente.trabajador_id)
+        .outerjoin(derivado, derivado.c.id == PrestamoHistorial.id)
+        .where(*condiciones_prestamos)
+        .group_by(Cliente.id, Usuario.id)
+        .order_by(Cliente.id)
+        .params(hoy=hoy)
+    )
+    cuotas = (
+        select(*columnas(COLUMNAS_EXPORTACION_CUOTAS))
+        .join(PrestamoHistorial, PrestamoHistorial.id == CuotaHistorial.prestamo_id)
+        .join(Cliente, Cliente.id == PrestamoHistorial.cliente_id)
+        .outerjoin(derivado, derivado.c.id == PrestamoHistorial.id)
+        .where(*condiciones_cuotas)
+        .order_by(CuotaHistorial.id)
+        .params(hoy=hoy)
+    )
+    return {
+        'clientes': ('Clientes', [n for n, _ in COLUMNAS_EXPORTACION_CLIENTES], clientes),
+        'prestamos': ('Préstamos', [n for n, _ in COLUMNAS_EXPORTACION_PRESTAMOS], prestamos),
+        'cuotas': ('Cuotas', [n for n, _ in COLUMNAS_EXPORTACION_CUOTAS], cuotas),
+    }
+
+
+def leer_en_bloques(consulta):
+    """Recorre el resultado con un cursor del lado del servidor, sin cargarlo completo en memoria."""
+    resultado = db.session.execute(consulta.execution_options(yield_per=FILAS_POR_LECTURA_EXPORTACION))
+    for bloque in resultado.partitions():
+        for fila in bloque:
+            yield tuple(fila)
+
+
+@app.route('/api/exportar', methods=['GET'])
+@jwt_required()
+def api_exportar_cartera():
+    """
+    Exporta la cartera en streaming, sin cargarla en memoria ni en el navegador.
+    Parámetros: formato (xlsx|csv, por defecto xlsx), tabla (prestamos|clientes|cuotas, solo para csv;
+    el xlsx trae las tres hojas), estado (lista separada por comas), trabajador_id, desde, hasta.
+    Un trabajador solo exporta sus propios clientes.
+    """
+    claims = get_jwt()
+    if claims.get('rol') not in ['admin', 'trabajador']:
+        return jsonify({'msg': 'No autorizado'}), 403
+
+    formato = request.args.get('formato', 'xlsx')
+    tabla = request.args.get('tabla', 'prestamos')
+    if formato not in ['xlsx', 'csv']:
+        return jsonify({'msg': 'Formato no válido'}), 400
+
+    args = request.args.to_dict()
+    if claims.get('rol') == 'trabajador':
+        usuario = Usuario.query.filter_by(username=get_jwt_identity()).first()
+        if not usuario:
+            return jsonify({'msg': 'Usuario no encontrado'}), 404
+        args['trabajador_id'] = usuario.id
 
-    return jsonify(clientes_sin_prestamo_activo), 200
+    hoy = get_current_date()
+    asegurar_calendario_sql(hoy)
+    try:
+        consultas = consultas_exportacion(*filtros_exportacion(args), hoy)
+        if tabla not in consultas:
+            raise ValueError('tabla no válida')
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
+    def generar():
+        # Todas las hojas salen de la misma foto de la base de datos
+        db.session.close()
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ', 'postgresql_readonly': True})
+        if formato == 'csv':
+            _, encabezados, consulta = consultas[tabla]
+            yield from generar_csv(encabezados, leer_en_bloques(consulta))
+        else:
+            yield from generar_xlsx([
+                (hoja, encabezados, leer_en_bloques(consulta))
+                for hoja, encabezados, consulta in (consultas['clientes'], consultas['prestamos'], consultas['cuotas'])
+            ])
+
+    nombre_archivo = f"{'cartera' if formato == 'xlsx' else tabla}_{hoy.isoformat()}.{formato}"
+    return app.response_class(
+        stream_with_context(generar()),
+        content_type=TIPO_XLSX if formato == 'xlsx' else TIPO_CSV,
+        headers={
+            'Content-Disposition': f'attachment; filename="{nombre_archivo}"',
+            'X-Accel-Buffering': 'no'  # Que un proxy (nginx) no acumule la respuesta completa
+        }
+    )
 
 
 @app.route('/api/clientes/search', methods=['GET'])
 @jwt_required()
 def api_search_clientes():
-    """Busca clientes por nombre o DNI y devuelve TODOS sus préstamos."""
+    """
+    Busca clientes por nombre (sin tildes, tolerante a errores) o por prefijo de DNI.
+    Devuelve resultados livianos ordenados por relevancia; los préstamos de un cliente
+    se piden al abrirlo con /api/prestamos/historial/<cliente_id>.
+    Parámetros: q, limite (máximo LIMITE_BUSQUEDA_MAXIMO).
+    """
     search_term = request.args.get('q', '').strip()
     if not search_term:
         return jsonify([]), 200
-    
-    clientes_encontrados = Cliente.query.filter(or_(
-        Cliente.nombre.ilike(f'%{search_term}%'),
-        Cliente.dni.ilike(f'%{search_term}%')
-    )).all()
-
-    resultados_busqueda = []
-    for cliente in clientes_encontrados:
-        # Actualizar todos los préstamos del cliente
-        for prestamo in cliente.prestamos:
-            prestamo.calcular_dias_transcurridos()
-            prestamo.calcular_deuda_vencida()
-        
-        cliente_data = {
-            'id': cliente.id,
-            'nombre': cliente.nombre,
-            'dni': cliente.dni,
-            'direccion': cliente.direccion,
-            'telefono': cliente.telefono,
-            'fecha_registro': cliente.fecha_registro.isoformat() if cliente.fecha_registro else None,
-            'prestamos': [p.to_dict() for p in cliente.prestamos]
-        }
-        resultados_busqueda.append(cliente_data)
 
-    db.session.commit()  # Guardar actualizaciones
-    return jsonify(resultados_busqueda), 200
+    try:
+        limite = int(request.args.get('limite', LIMITE_BUSQUEDA_POR_DEFECTO))
+        if limite < 1:
+            raise ValueError('limite debe ser mayor que cero')
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
+    return jsonify(buscar_clientes(search_term, min(limite, LIMITE_BUSQUEDA_MAXIMO))), 200
 
 
 @app.route('/api/prestamos/historial/<int:cliente_id>', methods=['GET'])
 @jwt_required()
 def api_historial_prestamos(cliente_id):
-    """Obtiene el historial completo de préstamos de un cliente específico."""
+    """
+    Obtiene el historial completo de préstamos de un cliente específico, archivados incluidos.
+    Proyección: view (list|detail|collector, por defecto list), fields, include=cuotas.
+    """
     claims = get_jwt()
     if claims.get('rol') not in ['admin', 'trabajador']:
         return jsonify({'msg': 'No autorizado'}), 403
 
+    try:
+        campos, incluir_cuotas = proyeccion_prestamos(request.args)
+    except ValueError as e:
+        return jsonify({'msg': 'Parámetros de consulta inválidos', 'error': str(e)}), 400
+
     cliente = db.session.get(Cliente, cliente_id)
     if not cliente:
         return jsonify({'msg': 'Cliente no encontrado'}), 404
-    prestamos = Prestamo.query.filter_by(cliente_id=cliente_id).order_by(Prestamo.fecha_inicio.desc()).all()
-    
-    # Actualizar información de préstamos
-    for prestamo in prestamos:
-        prestamo.calcular_dias_transcurridos()
-        prestamo.calcular_deuda_vencida()
-    
-    db.session.commit()
-    return jsonify([p.to_dict() for p in prestamos]), 200
+    consulta = db.session.query(PrestamoHistorial).filter(
+        PrestamoHistorial.cliente_id == cliente_id
+    ).order_by(PrestamoHistorial.fecha_inicio.desc())
+    if incluir_cuotas:
+        consulta = consulta.options(selectinload(PrestamoHistorial.cuotas.of_type(CuotaHistorial)))
+
+    hoy = get_current_date()
+    return jsonify([p.to_dict(hoy, campos, incluir_cuotas) for p in consulta.all()]), 200
 
 
 @app.route('/api/clientes/<int:id>', methods=['PUT'])
@@ -928,7 +3041,7 @@ def api_update_cliente(id):
     if claims.get('rol') != 'admin':
         return jsonify({'msg': 'No autorizado'}), 403
     
-    cliente = db.session.get(Cliente, id)
+    cliente = db.session.get(Cliente, id, options=opciones_carga_cliente())
     if not cliente:
         return jsonify({'msg': 'Cliente no encontrado'}), 404
     data = request.get_json() or {}
@@ -943,30 +3056,42 @@ def api_update_cliente(id):
         cliente.trabajador_id = trabajador_id
         
     db.session.commit()
+    registrar_cambio_cartera()
     return jsonify(cliente.to_dict()), 200
 
 
+# Borra el cliente con sus préstamos, cuotas y pagos en una sola sentencia, por conjuntos. Los préstamos
+# se bloquean en orden de id, como en los pagos. Las tablas de archivo se vacían por ON DELETE CASCADE.
+SQL_ELIMINAR_CLIENTE = text("""
+    WITH prestamos_cliente AS (
+        SELECT id FROM prestamos WHERE cliente_id = :cliente_id ORDER BY id FOR UPDATE
+    ), cuotas_borradas AS (
+        DELETE FROM cuotas WHERE prestamo_id IN (SELECT id FROM prestamos_cliente)
+    ), pagos_borrados AS (
+        DELETE FROM pagos WHERE prestamo_id IN (SELECT id FROM prestamos_cliente)
+    ), prestamos_borrados AS (
+        DELETE FROM prestamos WHERE id IN (SELECT id FROM prestamos_cliente)
+    )
+    DELETE FROM clientes WHERE id = :cliente_id
+    RETURNING id
+""")
+
+
 @app.route('/api/clientes/<int:cliente_id>', methods=['DELETE'])
 @jwt_required()
 def eliminar_cliente(cliente_id):
-    """Elimina un cliente y todos sus préstamos asociados."""
+    """Elimina un cliente y todos sus préstamos asociados, archivados incluidos."""
     claims = get_jwt()
     if claims.get('rol') != 'admin':
         return jsonify({'msg': 'No autorizado'}), 403
 
-    cliente = db.session.get(Cliente, cliente_id)
-    if not cliente:
-        return jsonify({'msg': 'Cliente no encontrado'}), 404
-
     try:
-        prestamos_del_cliente = Prestamo.query.filter_by(cliente_id=cliente_id).all()
-        for prestamo in prestamos_del_cliente:
-            Cuota.query.filter_by(prestamo_id=prestamo.id).delete()
-            Pago.query.filter_by(prestamo_id=prestamo.id).delete()
-            db.session.delete(prestamo)
-
-        db.session.delete(cliente)
+        eliminado = db.session.execute(SQL_ELIMINAR_CLIENTE, {'cliente_id': cliente_id}).scalar()
+        if eliminado is None:
+            db.session.rollback()
+            return jsonify({'msg': 'Cliente no encontrado'}), 404
         db.session.commit()
+        registrar_cambio_cartera()
         return jsonify({'msg': 'Cliente eliminado correctamente'}), 200
     except Exception as e:
         db.session.rollback()
@@ -980,7 +3105,7 @@ def registrar_cuota(prestamo_id):
     if claims.get('rol') not in ['admin', 'trabajador']:
         return jsonify({'msg': 'No autorizado'}), 403
 
-    prestamo = db.session.get(Prestamo, prestamo_id)
+    prestamo = bloquear_prestamos(prestamo_id).get(prestamo_id)
     if not prestamo:
         return jsonify({'msg': 'Préstamo no encontrado'}), 404
     data = request.get_json() or {}
@@ -990,59 +3115,24 @@ def registrar_cuota(prestamo_id):
         return jsonify({'msg': 'Monto de cuota inválido'}), 400
 
     try:
-        monto_cuota = Decimal(str(monto_cuota))
-        prestamo.calcular_dias_transcurridos()
-        hoy = get_current_date()
-        fecha_fin = prestamo.fecha_fin or (prestamo.fecha_inicio + timedelta(days=30))
-        
-        # Calcular deuda vencida y mora antes del pago
-        deuda_vencida, deuda_vencida_base, mora_pendiente = prestamo.calcular_deuda_vencida()
-
-        if prestamo.saldo <= 0:
-            return jsonify({'msg': 'El préstamo ya está completamente pagado'}), 400
-
-        # Distribuir el pago: primero a la deuda base, luego a la mora
-        monto_a_deuda_base = min(monto_cuota, Decimal(str(deuda_vencida_base)))
-        monto_a_mora = min(monto_cuota - monto_a_deuda_base, Decimal(str(mora_pendiente)))
-        monto_real_cuota = monto_a_deuda_base + monto_a_mora
-
-        # Actualizar saldo
-        saldo_completado = False
-        if prestamo.saldo <= monto_real_cuota:
-            monto_real_cuota = prestamo.saldo
-            prestamo.saldo = Decimal('0.0')
-            prestamo.estado = 'pagado'
-            prestamo.fecha_pago_completo = get_current_date()
-            saldo_completado = True
-        else:
-            prestamo.saldo -= monto_real_cuota
-
-        # Registrar la cuota
-        fecha_pago = get_current_date()
-        estado_pago = prestamo.calcular_estado_pago_cuota(fecha_pago)
-        nueva_cuota = Cuota(
-            prestamo_id=prestamo_id,
-            monto=monto_real_cuota,
-            fecha_pago=fecha_pago,
-            descripcion=f'Cuota diaria (deuda: {monto_a_deuda_base}, mora: {monto_a_mora})',
-            estado_pago=estado_pago
-        )
-        db.session.add(nueva_cuota)
-        
-        # Recalcular deuda vencida
-        deuda_vencida, deuda_vencida_base, mora_pendiente = prestamo.calcular_deuda_vencida()
+        try:
+            pago = registrar_pago_prestamo(prestamo, Decimal(str(monto_cuota)))
+        except ValueError as e:
+            return jsonify({'msg': str(e)}), 400
         db.session.commit()
+        registrar_cambio_cartera()
 
+        monto_a_deuda_base, monto_a_mora = pago['monto_a_deuda_base'], pago['monto_a_mora']
         message = f'Cuota registrada exitosamente (deuda base: {monto_a_deuda_base}, mora: {monto_a_mora})'
-        if saldo_completado:
+        if pago['saldo_completado']:
             message = '¡PRÉSTAMO PAGADO COMPLETAMENTE! La cuota ha liquidado el saldo pendiente.'
 
         return jsonify({
             'msg': message,
-            'prestamo_completado': saldo_completado,
+            'prestamo_completado': pago['saldo_completado'],
             'prestamo': prestamo.to_dict(),
-            'cuota': nueva_cuota.to_dict(),
-            'mora_pendiente': float(mora_pendiente)
+            'cuota': pago['cuota'].to_dict(),
+            'mora_pendiente': float(pago['mora_pendiente'])
         }), 200
 
     except Exception as e:
@@ -1050,6 +3140,88 @@ def registrar_cuota(prestamo_id):
         return jsonify({'msg': 'Error al registrar la cuota', 'error': str(e)}), 500
 
 
+@app.route('/api/cuotas/lote', methods=['POST'])
+@jwt_required()
+def registrar_cuotas_lote():
+    """
+    Registra en una sola transacción los pagos de toda una ruta de cobranza.
+    Cuerpo: {"pagos": [{"prestamo_id": 1, "monto": 25.0, "fecha": "2024-05-01"}, ...]} (fecha opcional, por defecto hoy).
+    Cada pago se reparte igual que en /api/prestamos/<id>/cuota, con la deuda y la mora del día de
+    su fecha; no se aceptan fechas anteriores al último pago del préstamo (registrar_pago_prestamo).
+    Los pagos inválidos se rechazan individualmente; el resto se confirma junto. Devuelve un
+    resultado compacto por pago.
+    """
+    claims = get_jwt()
+    if claims.get('rol') not in ['admin', 'trabajador']:
+        return jsonify({'msg': 'No autorizado'}), 403
+
+    pagos = (request.get_json() or {}).get('pagos')
+    if not isinstance(pagos, list) or not pagos:
+        return jsonify({'msg': 'Falta la lista de pagos'}), 400
+    if len(pagos) > LIMITE_LOTE_PAGOS:
+        return jsonify({'msg': f'Máximo {LIMITE_LOTE_PAGOS} pagos por lote'}), 400
+
+    hoy = get_current_date()
+    ids = {pago['prestamo_id'] for pago in pagos
+           if isinstance(pago, dict) and type(pago.get('prestamo_id')) is int}
+    prestamos = bloquear_prestamos(*ids)
+
+    resultados = []
+    registrados = 0
+    try:
+        for indice, pago in enumerate(pagos):
+            resultado = {'indice': indice, 'prestamo_id': pago.get('prestamo_id') if isinstance(pago, dict) else None}
+            try:
+                if not isinstance(pago, dict):
+                    raise ValueError('Formato de pago inválido')
+                if type(pago.get('prestamo_id')) is not int:
+                    raise ValueError('prestamo_id inválido')
+                prestamo = prestamos.get(pago['prestamo_id'])
+                if not prestamo:
+                    raise ValueError('Préstamo no encontrado')
+                try:
+                    monto = Decimal(str(pago.get('monto')))
+                except ArithmeticError:
+                    monto = None
+                if monto is None or not monto.is_finite() or monto <= 0:
+                    raise ValueError('Monto de cuota inválido')
+                fecha = date.fromisoformat(pago['fecha']) if pago.get('fecha') else hoy
+                if fecha > hoy:
+                    raise ValueError('La fecha de pago no puede ser futura')
+
+                registro = registrar_pago_prestamo(prestamo, monto, fecha)
+                resultado.update({
+                    'ok': True,
+                    'cuota': registro['cuota'],
+                    'monto_aplicado': float(registro['cuota'].monto),
+                    'a_deuda_base': float(registro['monto_a_deuda_base']),
+                    'a_mora': float(registro['monto_a_mora']),
+                    'saldo': float(prestamo.saldo),
+                    'estado': prestamo.estado
+                })
+                registrados += 1
+            except (ValueError, TypeError) as e:
+                resultado.update({'ok': False, 'error': str(e)})
+            resultados.append(resultado)
+
+        db.session.flush()  # Asigna los ids de las cuotas
+        for resultado in resultados:
+            if resultado['ok']:
+                resultado['cuota_id'] = resultado.pop('cuota').id
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': 'Error al registrar el lote de cuotas', 'error': str(e)}), 500
+
+    if registrados:
+        registrar_cambio_cartera()
+    return jsonify({
+        'registrados': registrados,
+        'rechazados': len(pagos) - registrados,
+        'resultados': resultados
+    }), 200
+
+
 @app.route('/api/prestamos/<int:prestamo_id>/refinanciar', methods=['POST'])
 @jwt_required()
 def refinanciar_prestamo(prestamo_id):
@@ -1057,7 +3229,7 @@ def refinanciar_prestamo(prestamo_id):
     if claims.get('rol') != 'admin':
         return jsonify({'msg': 'No autorizado'}), 403
 
-    prestamo_original = db.session.get(Prestamo, prestamo_id)
+    prestamo_original = bloquear_prestamos(prestamo_id).get(prestamo_id)
     if not prestamo_original:
         return jsonify({'msg': 'Préstamo no encontrado'}), 404
     
@@ -1106,6 +3278,7 @@ def refinanciar_prestamo(prestamo_id):
         
         db.session.add(prestamo_refinanciado)
         db.session.commit()
+        registrar_cambio_cartera()
 
         return jsonify({
             'msg': 'Préstamo refinanciado exitosamente',
@@ -1118,4 +3291,5 @@ def refinanciar_prestamo(prestamo_id):
         return jsonify({'msg': 'Error al crear el cliente y el préstamo', 'error': str(e)}), 500
                         
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Solo para desarrollo; en producción se usa gunicorn con gunicorn.conf.py
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=os.getenv('FLASK_DEBUG', '0') == '1')
@@ -0,0 +1,4 @@
+import os
+
+# Sembrar y limpiar carteras grandes supera el límite por sentencia de la API (DB_STATEMENT_TIMEOUT_MS)
+os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', '0')
@@ -0,0 +1,152 @@
+"""
+Benchmark y verificación del archivo de préstamos cerrados (archivar_prestamos()).
+
+Sobre una cartera sintética mide el tamaño de las tablas vigentes y lo que tardan los trabajos que
+las recorren completas (conciliación de pagos, clasificación de puntualidad) antes y después de
+archivar. También verifica que las lecturas de historial no cambian: historial de préstamos con
+cuotas, cuotas de cada préstamo, puntualidad, resumen de créditos y exportación CSV de préstamos y
+cuotas devuelven exactamente lo mismo con los préstamos ya archivados. Al final borra por la API
+un cliente con préstamos archivados y comprueba que no queda nada suyo.
+
+Uso:
+    python -m benchmarks.archivo_prestamos                  # 10k clientes, archiva lo cerrado hace 30 días
+    python -m benchmarks.archivo_prestamos 100000 --dias 60
+
+Requiere el usuario admin por defecto (init_db.py). Al terminar se eliminan los datos sintéticos
+(benchmarks.conteo_consultas.limpiar_cartera(); el archivo se borra en cascada con los clientes).
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app import (app, db, get_current_date, archivar_prestamos, conciliar_totales_pagos,
+                 invalidar_resumen_creditos, SQL_CLASIFICAR_PUNTUALIDAD)
+from benchmarks.cartera_sintetica import generar_cartera, SEMILLA_POR_DEFECTO
+from benchmarks.conteo_consultas import limpiar_cartera
+
+CLIENTES_MUESTRA = 200
+TABLAS = ('prestamos', 'cuotas', 'prestamos_archivados', 'cuotas_archivadas')
+
+
+def elegir_clientes():
+    """Clientes sintéticos con algún préstamo cerrado (parte de ellos con cadenas que siguen activas)."""
+    return db.session.execute(text("""
+        SELECT DISTINCT c.id FROM clientes c JOIN prestamos p ON p.cliente_id = c.id
+        WHERE c.dni LIKE 'BENCHS%' AND p.estado IN ('pagado', 'refinanciado')
+        ORDER BY c.id LIMIT :limite
+    """), {'limite': CLIENTES_MUESTRA}).scalars().all()
+
+
+def leer_historial(cliente_http, clientes):
+    """Respuestas de todos los endpoints de historial para los clientes de muestra."""
+    invalidar_resumen_creditos()
+    respuestas = {'resumen': cliente_http.get('/api/resumen_creditos').get_json()}
+    for tabla in ('prestamos', 'cuotas'):
+        respuestas[f'exportar {tabla}'] = cliente_http.get(f'/api/exportar?formato=csv&tabla={tabla}').get_data()
+    for cliente_id in clientes:
+        historial = cliente_http.get(f'/api/prestamos/historial/{cliente_id}?view=detail&include=cuotas').get_json()
+        respuestas[f'historial {cliente_id}'] = historial
+        puntualidad = cliente_http.get(f'/api/puntualidad?cliente_id={cliente_id}')
+        respuestas[f'puntualidad {cliente_id}'] = puntualidad.get_json()
+        for prestamo in historial:
+            url = f"/api/prestamos/{prestamo['id']}/cuotas"
+            respuestas[url] = cliente_http.get(url).get_json()
+    return respuestas
+
+
+def contar_filas():
+    return {tabla: db.session.execute(text(f'SELECT COUNT(*) FROM {tabla}')).scalar() for tabla in TABLAS}
+
+
+def medir_trabajos():
+    """Segundos de la conciliación y de una clasificación de puntualidad completa (ambas se revierten)."""
+    inicio = time.perf_counter()
+    conciliar_totales_pagos()
+    conciliacion = time.perf_counter() - inicio
+    db.session.rollback()
+    inicio = time.perf_counter()
+    db.session.execute(SQL_CLASIFICAR_PUNTUALIDAD, {'desde': 0, 'hasta': 2 ** 31 - 1})
+    puntualidad = time.perf_counter() - inicio
+    db.session.rollback()
+    return conciliacion, puntualidad
+
+
+def verificar_borrado(cliente_http):
+    """
+    Borra por la API el cliente con más préstamos archivados (y alguno vigente, si hay);
+    devuelve las filas suyas que quedaron.
+    """
+    cliente_id = db.session.execute(text("""
+        SELECT pa.cliente_id FROM prestamos_archivados pa JOIN clientes c ON c.id = pa.cliente_id
+        WHERE c.dni LIKE 'BENCHS%'
+        GROUP BY pa.cliente_id
+        ORDER BY EXISTS (SELECT 1 FROM prestamos p WHERE p.cliente_id = pa.cliente_id) DESC,
+                 COUNT(*) DESC, pa.cliente_id
+        LIMIT 1
+    """)).scalar()
+    prestamos = db.session.execute(text("""
+        SELECT id FROM prestamos WHERE cliente_id = :id
+        UNION ALL
+        SELECT id FROM prestamos_archivados WHERE cliente_id = :id
+    """), {'id': cliente_id}).scalars().all()
+    db.session.commit()
+    respuesta = cliente_http.delete(f'/api/clientes/{cliente_id}')
+    assert respuesta.status_code == 200, respuesta.get_json()
+    restantes = db.session.execute(text("""
+        SELECT (SELECT COUNT(*) FROM clientes WHERE id = :id)
+             + (SELECT COUNT(*) FROM prestamos WHERE id = ANY(:prestamos))
+             + (SELECT COUNT(*) FROM cuotas WHERE prestamo_id = ANY(:prestamos))
+             + (SELECT COUNT(*) FROM prestamos_archivados WHERE id = ANY(:prestamos))
+             + (SELECT COUNT(*) FROM cuotas_archivadas WHERE prestamo_id = ANY(:prestamos))
+    """), {'id': cliente_id, 'prestamos': prestamos}).scalar()
+    db.session.commit()
+    return cliente_id, len(prestamos), restantes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archivo de préstamos cerrados: tamaño, tiempos y lecturas.')
+    parser.add_argument('clientes', type=int, nargs='?', default=10000)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--dias', type=int, default=30, help='Antigüedad mínima de los préstamos a archivar')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    with app.app_context():
+        limpiar_cartera()
+        conteos = generar_cartera(args.clientes, args.semilla)
+        try:
+            cliente_http = app.test_client()
+            login = cliente_http.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+            assert login.status_code == 200, 'No se pudo iniciar sesión como admin'
+
+            clientes = elegir_clientes()
+            antes = leer_historial(cliente_http, clientes)
+            filas_antes = contar_filas()
+            trabajos_antes = medir_trabajos()
+            print(f"{conteos['prestamos']} préstamos sintéticos; filas: {filas_antes}")
+
+            inicio = time.perf_counter()
+            archivados = archivar_prestamos(get_current_date(), args.dias)
+            db.session.commit()
+            print(f'Archivados {archivados} préstamos cerrados hace más de {args.dias} días '
+                  f'en {time.perf_counter() - inicio:.2f} s')
+            print(f'Filas: {contar_filas()}')
+
+            trabajos_despues = medir_trabajos()
+            for nombre, t_antes, t_despues in zip(('Conciliación', 'Puntualidad'), trabajos_antes, trabajos_despues):
+                print(f'{nombre}: {t_antes:.2f} s -> {t_despues:.2f} s')
+
+            despues = leer_historial(cliente_http, clientes)
+            distintas = [clave for clave in antes if antes[clave] != despues.get(clave)]
+            print(f'{len(antes)} lecturas de historial de {len(clientes)} clientes, '
+                  f'{len(distintas)} distintas tras archivar')
+            if distintas:
+                print(f'   ❌ Primeras 10: {distintas[:10]}')
+
+            cliente_id, prestamos, restantes = verificar_borrado(cliente_http)
+            print(f'Cliente {cliente_id} eliminado con {prestamos} préstamos (vigentes y archivados): '
+                  f'{"sin filas restantes" if not restantes else f"❌ quedan {restantes} filas"}')
+        finally:
+            db.session.rollback()
+            limpiar_cartera()
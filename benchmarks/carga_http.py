@@ -0,0 +1,125 @@
+"""
+Prueba de carga HTTP contra un servidor en marcha (gunicorn o flask run).
+
+Cada cliente inicia sesión una vez y repite una mezcla de peticiones de lectura
+(listado de clientes, búsqueda, resumen, verificación de sesión) durante los segundos
+indicados, mientras otros clientes inician sesión en bucle (bcrypt, la petición más lenta).
+Se informa la latencia de la mezcla de lectura. Sirve para comparar perfiles de servidor:
+
+    gunicorn -c /dev/null -b :8080 app:app &                      # workers sync por defecto
+    python -m benchmarks.carga_http http://localhost:8080 16 20 2
+
+    gunicorn -c gunicorn.conf.py app:app &                        # perfil de producción
+    python -m benchmarks.carga_http http://localhost:8080 16 20 2
+
+Argumentos: URL base, clientes de lectura (16), segundos (20) y clientes de login (2).
+Requiere el usuario admin por defecto (init_db.py). Solo usa la biblioteca estándar.
+"""
+import http.cookiejar
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+URL_POR_DEFECTO = 'http://localhost:8080'
+CLIENTES_POR_DEFECTO = 16
+SEGUNDOS_POR_DEFECTO = 20
+CLIENTES_LOGIN_POR_DEFECTO = 2
+CREDENCIALES = {'username': 'admin', 'password': 'admin123'}
+
+MEZCLA = [
+    '/auth/check',
+    '/api/clientes',
+    '/api/clientes/search?q=Cli',
+    '/api/resumen_creditos',
+    '/auth/check',
+    '/api/clientes_sin_prestamo',
+]
+
+
+def percentil(valores, p):
+    if not valores:
+        return float('nan')
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def abrir_sesion(base):
+    """Devuelve un opener con la cookie JWT del admin."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    peticion = urllib.request.Request(base + '/auth/login', data=json.dumps(CREDENCIALES).encode(),
+                                      headers={'Content-Type': 'application/json'})
+    with opener.open(peticion, timeout=30) as respuesta:
+        respuesta.read()
+    return opener
+
+
+def cliente(base, fin, latencias, errores):
+    opener = abrir_sesion(base)
+    i = 0
+    while time.monotonic() < fin:
+        url = base + MEZCLA[i % len(MEZCLA)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            with opener.open(url, timeout=30) as respuesta:
+                respuesta.read()
+            latencias.append(time.perf_counter() - inicio)
+        except (urllib.error.URLError, OSError) as e:
+            errores.append(str(e))
+
+
+def cliente_login(base, fin, logins, errores):
+    while time.monotonic() < fin:
+        try:
+            abrir_sesion(base)
+            logins.append(1)
+        except (urllib.error.URLError, OSError) as e:
+            # 503 = pool de bcrypt saturado: rechazo esperado, no un error del servidor
+            if getattr(e, 'code', None) != 503:
+                errores.append(str(e))
+
+
+def medir(base, clientes, segundos, clientes_login):
+    latencias, logins, errores = [], [], []
+    fin = time.monotonic() + segundos
+    hilos = [threading.Thread(target=cliente, args=(base, fin, latencias, errores)) for _ in range(clientes)]
+    hilos += [threading.Thread(target=cliente_login, args=(base, fin, logins, errores))
+              for _ in range(clientes_login)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    return {
+        'peticiones': len(latencias),
+        'req_s': len(latencias) / duracion,
+        'p50': statistics.median(latencias) * 1000 if latencias else float('nan'),
+        'p95': percentil(latencias, 0.95) * 1000,
+        'p99': percentil(latencias, 0.99) * 1000,
+        'logins': len(logins),
+        'errores': errores,
+    }
+
+
+if __name__ == '__main__':
+    base = (sys.argv[1] if len(sys.argv) > 1 else URL_POR_DEFECTO).rstrip('/')
+    clientes = int(sys.argv[2]) if len(sys.argv) > 2 else CLIENTES_POR_DEFECTO
+    segundos = int(sys.argv[3]) if len(sys.argv) > 3 else SEGUNDOS_POR_DEFECTO
+    clientes_login = int(sys.argv[4]) if len(sys.argv) > 4 else CLIENTES_LOGIN_POR_DEFECTO
+
+    r = medir(base, clientes, segundos, clientes_login)
+    print(f'{base}: {clientes} clientes de lectura y {clientes_login} de login durante {segundos} s')
+    print(f"{'Peticiones':>10} | {'req/s':>7} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'p99 (ms)':>8} | "
+          f"{'Logins':>6} | Errores")
+    print('-' * 75)
+    print(f"{r['peticiones']:>10} | {r['req_s']:>7.1f} | {r['p50']:>8.1f} | {r['p95']:>8.1f} | "
+          f"{r['p99']:>8.1f} | {r['logins']:>6} | {len(r['errores'])}")
+    for error in r['errores'][:5]:
+        print('Error:', error)
+    if r['errores']:
+        sys.exit(1)
@@ -0,0 +1,246 @@
+"""
+Generador de carteras sintéticas grandes y reproducibles.
+
+Cada cliente tiene una cadena de 1 a 3 préstamos: los anteriores quedan 'refinanciado'
+(el siguiente es un REF por el saldo pendiente) y el último termina pagado, activo o
+vencido. Los pagos son cuotas diarias en días hábiles (tabla calendario_laboral), con una
+puntualidad distinta por préstamo, así que hay meses de historial por cliente.
+
+Todo se inserta con SQL por conjuntos (sin objetos ORM) en una sola transacción. Los valores
+"aleatorios" se derivan de md5(semilla, cliente, campo): la misma semilla y el mismo día
+producen exactamente la misma cartera, sin depender de los ids asignados.
+
+Uso:
+    python -m benchmarks.cartera_sintetica 100000              # 100k clientes, semilla 42
+    python -m benchmarks.cartera_sintetica 500000 --semilla 7
+    python -m benchmarks.cartera_sintetica --limpiar
+
+Los clientes sintéticos usan DNI 'BENCHS...' y se eliminan con --limpiar
+(o con benchmarks.conteo_consultas.limpiar_cartera()).
+"""
+import argparse
+import time
+
+from app import app, db, get_current_date, recalcular_cartera, asegurar_calendario_sql, registrar_cambio_cartera
+from sqlalchemy import text
+from benchmarks.conteo_consultas import limpiar_cartera
+
+SEMILLA_POR_DEFECTO = 42
+MAXIMO_PRESTAMOS_POR_CLIENTE = 3
+DIAS_HISTORIAL = 150
+
+NOMBRES = ['Juan', 'María', 'José', 'Rosa', 'Luis', 'Carmen', 'Carlos', 'Ana', 'Jorge', 'Elena',
+           'Víctor', 'Luz', 'Pedro', 'Julia', 'Miguel', 'Gladys', 'César', 'Flor', 'Raúl', 'Norma']
+APELLIDOS = ['Quispe', 'Flores', 'Sánchez', 'Rodríguez', 'García', 'Mamani', 'Huamán', 'Chávez',
+             'Ramírez', 'Torres', 'Mendoza', 'Vásquez', 'Castillo', 'Rojas', 'Díaz', 'Gutiérrez',
+             'Cárdenas', 'Ccama', 'Espinoza', 'Ñahui']
+DISTRITOS = ['San Juan de Lurigancho', 'Comas', 'Ate', 'Villa El Salvador', 'Los Olivos',
+             'San Martín de Porres', 'Carabayllo', 'Puente Piedra', 'Chorrillos', 'Independencia']
+
+
+def azar(clave, campo):
+    """Expresión SQL con un número pseudoaleatorio en [0, 1) determinado por (semilla, clave, campo)."""
+    return f"(('x' || substr(md5(:semilla || ':{campo}:' || ({clave})::text), 1, 8))::bit(32)::bigint / 4294967296.0)"
+
+
+def elegir(lista, clave, campo):
+    """Expresión SQL que elige un elemento de la lista de forma determinista."""
+    valores = ', '.join("'" + valor.replace("'", "''") + "'" for valor in lista)
+    return f"(ARRAY[{valores}])[1 + floor({azar(clave, campo)} * {len(lista)})::int]"
+
+
+def crear_plan(n, hoy, semilla):
+    """
+    Tabla temporal con un préstamo por fila: cliente, posición en la cadena, destino final,
+    fechas, interés y puntualidad. Los ids se reservan de la secuencia para enlazar las cadenas.
+    """
+    db.session.execute(text("""
+        CREATE TEMP TABLE plan_cartera (
+            id integer PRIMARY KEY, g integer NOT NULL, pos integer NOT NULL, largo integer NOT NULL,
+            destino text NOT NULL, fecha_inicio date NOT NULL, limite_pagos date NOT NULL,
+            interes numeric(5, 2) NOT NULL, puntualidad numeric NOT NULL, cliente_id integer
+        ) ON COMMIT DROP
+    """))
+    db.session.execute(text(f"""
+        WITH clientes_plan AS (
+            SELECT g,
+                   CASE WHEN {azar('g', 'largo')} < 0.7 THEN 1 WHEN {azar('g', 'largo')} < 0.9 THEN 2 ELSE 3 END AS largo,
+                   CASE WHEN {azar('g', 'destino')} < 0.45 THEN 'activo'
+                        WHEN {azar('g', 'destino')} < 0.70 THEN 'vencido'
+                        ELSE 'pagado' END AS destino
+            FROM generate_series(1, :n) g
+        ),
+        ultimo AS (
+            SELECT g, largo, destino,
+                   CAST(:hoy AS date) - CASE destino
+                       WHEN 'activo' THEN floor({azar('g', 'inicio')} * 29)::int
+                       ELSE 31 + floor({azar('g', 'inicio')} * (:dias - {30 * MAXIMO_PRESTAMOS_POR_CLIENTE} - 31))::int
+                   END AS fecha_inicio
+            FROM clientes_plan
+        )
+        INSERT INTO plan_cartera (id, g, pos, largo, destino, fecha_inicio, limite_pagos, interes, puntualidad)
+        SELECT nextval(pg_get_serial_sequence('prestamos', 'id')), u.g, k.pos, u.largo,
+               CASE WHEN k.pos < u.largo THEN 'refinanciado' ELSE u.destino END,
+               -- Cada préstamo anterior de la cadena empezó entre 20 y 30 días antes que el siguiente
+               u.fecha_inicio - (u.largo - k.pos) * (20 + floor({azar("u.g || '-' || k.pos", 'tramo')} * 10)::int),
+               CAST(:hoy AS date),
+               CASE WHEN {azar("u.g || '-' || k.pos", 'interes')} < 0.6 THEN 20 ELSE 10 END,
+               0.55 + {azar("u.g || '-' || k.pos", 'puntualidad')} * 0.4
+        FROM ultimo u
+        CROSS JOIN LATERAL generate_series(1, u.largo) AS k(pos)
+        ORDER BY u.g, k.pos
+    """), {'n': n, 'hoy': hoy, 'dias': DIAS_HISTORIAL, 'semilla': str(semilla)})
+    # Un préstamo refinanciado deja de recibir pagos el día anterior al REF que lo reemplaza
+    db.session.execute(text("""
+        UPDATE plan_cartera p
+        SET limite_pagos = s.fecha_inicio - 1
+        FROM plan_cartera s
+        WHERE s.g = p.g AND s.pos = p.pos + 1
+    """))
+    db.session.execute(text('CREATE INDEX ON plan_cartera (g, pos)'))
+
+
+def insertar_clientes(n, semilla):
+    db.session.execute(text(f"""
+        INSERT INTO clientes (nombre, dni, direccion, telefono, trabajador_id)
+        SELECT {elegir(NOMBRES, 'g', 'nombre')} || ' ' || {elegir(APELLIDOS, 'g', 'apellido1')} || ' '
+                   || {elegir(APELLIDOS, 'g', 'apellido2')},
+               'BENCHS' || g,
+               'Mz. ' || chr(65 + (g % 20)) || ' Lt. ' || (1 + g % 40) || ', ' || {elegir(DISTRITOS, 'g', 'distrito')},
+               '9' || lpad((floor({azar('g', 'telefono')} * 100000000))::bigint::text, 8, '0'),
+               t.ids[1 + g % greatest(cardinality(t.ids), 1)]
+        FROM generate_series(1, :n) g
+        CROSS JOIN (SELECT array_agg(id ORDER BY id) AS ids FROM usuarios WHERE rol = 'trabajador') t
+    """), {'n': n, 'semilla': str(semilla)})
+    db.session.execute(text("""
+        UPDATE plan_cartera p
+        SET cliente_id = c.id
+        FROM clientes c
+        WHERE c.dni = 'BENCHS' || p.g
+    """))
+    # Las tablas temporales no pasan por autovacuum: sin estadísticas el planificador elige nested loops
+    db.session.execute(text('ANALYZE plan_cartera'))
+
+
+def insertar_prestamos(pos, semilla):
+    """
+    Inserta los préstamos de una posición de la cadena. Los de la posición 1 son créditos
+    nuevos; los siguientes refinancian el saldo del anterior (como refinanciar_prestamo()).
+    """
+    db.session.execute(text(f"""
+        INSERT INTO prestamos (id, cliente_id, monto_principal, interes, monto_total, fecha_inicio, fecha_fin,
+                               estado, saldo, tipo_prestamo, tipo_frecuencia, cuota_diaria, dt, deuda_vencida,
+                               prestamo_refinanciado_id)
+        SELECT x.id, x.cliente_id, x.principal, x.interes, ROUND(x.principal * (1 + x.interes / 100), 2),
+               x.fecha_inicio, x.fecha_inicio + 30, 'activo', ROUND(x.principal * (1 + x.interes / 100), 2),
+               CASE WHEN x.anterior_id IS NULL THEN 'CR' ELSE 'REF' END, 'Diario',
+               ROUND(x.principal * (1 + x.interes / 100) / 22, 2), 0, 0, x.anterior_id
+        FROM (
+            SELECT pl.id, pl.cliente_id, pl.interes, pl.fecha_inicio, a.id AS anterior_id,
+                   COALESCE(a.saldo, (200 + 50 * floor({azar('pl.g', 'monto')} * 37))::numeric) AS principal
+            FROM plan_cartera pl
+            LEFT JOIN plan_cartera pa ON pa.g = pl.g AND pa.pos = pl.pos - 1
+            LEFT JOIN prestamos a ON a.id = pa.id
+            WHERE pl.pos = :pos
+        ) x
+    """), {'pos': pos, 'semilla': str(semilla)})
+
+
+def insertar_cuotas(pos, semilla):
+    """
+    Cuotas diarias en días hábiles. Los préstamos que terminan pagados cobran las 22 cuotas
+    (la última ajusta el redondeo); el resto paga según su puntualidad y nunca completa el total.
+    """
+    db.session.execute(text(f"""
+        INSERT INTO cuotas (prestamo_id, monto, fecha_pago, descripcion, estado_pago)
+        SELECT x.id,
+               CASE WHEN x.destino = 'pagado' AND x.n = 22 THEN x.monto_total - 21 * x.cuota_diaria
+                    ELSE x.cuota_diaria END,
+               x.fecha, 'Cuota sintética',
+               CASE WHEN x.fecha > x.fecha_fin THEN 'con_retraso' ELSE 'a_tiempo' END
+        FROM (
+            SELECT pl.id, pl.destino, p.monto_total, p.cuota_diaria, p.fecha_fin, cal.fecha,
+                   row_number() OVER (PARTITION BY pl.id ORDER BY cal.fecha) AS n
+            FROM plan_cartera pl
+            JOIN prestamos p ON p.id = pl.id
+            JOIN calendario_laboral cal
+              ON cal.fecha > pl.fecha_inicio AND cal.fecha <= pl.limite_pagos AND cal.es_habil
+            WHERE pl.pos = :pos
+              AND (pl.destino = 'pagado' OR {azar("pl.g || '-' || pl.pos || '-' || cal.fecha", 'pago')} < pl.puntualidad)
+        ) x
+        WHERE x.n <= CASE WHEN x.destino = 'pagado' THEN 22 ELSE 21 END
+    """), {'pos': pos, 'semilla': str(semilla)})
+    db.session.execute(text('ANALYZE prestamos; ANALYZE cuotas'))  # Estadísticas con las filas recién insertadas
+    # Totales acumulados y estado final, como los dejan registrar_cuota() y refinanciar_prestamo()
+    db.session.execute(text("""
+        UPDATE prestamos p
+        SET total_pagado = COALESCE(t.total, 0),
+            num_cuotas = COALESCE(t.cantidad, 0),
+            ultima_fecha_pago = t.ultima,
+            saldo = p.monto_total - COALESCE(t.total, 0),
+            estado = CASE WHEN pl.destino IN ('pagado', 'refinanciado') THEN pl.destino ELSE p.estado END,
+            fecha_pago_completo = CASE WHEN pl.destino = 'pagado' THEN t.ultima END
+        FROM plan_cartera pl
+        LEFT JOIN (
+            SELECT prestamo_id, SUM(monto) AS total, COUNT(*) AS cantidad, MAX(fecha_pago) AS ultima
+            FROM cuotas
+            WHERE prestamo_id IN (SELECT id FROM plan_cartera WHERE pos = :pos)
+            GROUP BY prestamo_id
+        ) t ON t.prestamo_id = pl.id
+        WHERE p.id = pl.id AND pl.pos = :pos
+    """), {'pos': pos})
+
+
+def generar_cartera(n, semilla=SEMILLA_POR_DEFECTO, hoy=None):
+    """
+    Genera n clientes sintéticos con sus préstamos y cuotas, y recalcula la cartera.
+    Hace commit. Devuelve un dict con los conteos generados.
+    """
+    hoy = hoy or get_current_date()
+    try:
+        asegurar_calendario_sql(hoy)
+        crear_plan(n, hoy, semilla)
+        insertar_clientes(n, semilla)
+        for pos in range(1, MAXIMO_PRESTAMOS_POR_CLIENTE + 1):
+            insertar_prestamos(pos, semilla)
+            insertar_cuotas(pos, semilla)
+        recalcular_cartera(hoy)
+        conteos = db.session.execute(text("""
+            SELECT COUNT(DISTINCT c.id), COUNT(p.id),
+                   COUNT(p.id) FILTER (WHERE p.estado = 'activo'),
+                   COUNT(p.id) FILTER (WHERE p.estado = 'vencido'),
+                   COUNT(p.id) FILTER (WHERE p.estado = 'pagado'),
+                   COUNT(p.id) FILTER (WHERE p.estado = 'refinanciado'),
+                   COALESCE(SUM(p.num_cuotas), 0)
+            FROM clientes c JOIN prestamos p ON p.cliente_id = c.id
+            WHERE c.dni LIKE 'BENCHS%'
+        """)).fetchone()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    registrar_cambio_cartera()
+    db.session.execute(text('ANALYZE clientes; ANALYZE prestamos; ANALYZE cuotas'))
+    db.session.commit()
+    claves = ('clientes', 'prestamos', 'activos', 'vencidos', 'pagados', 'refinanciados', 'cuotas')
+    return dict(zip(claves, conteos))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera una cartera sintética reproducible.')
+    parser.add_argument('clientes', type=int, nargs='?', default=10000)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--limpiar', action='store_true', help='Solo elimina los datos sintéticos')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    with app.app_context():
+        limpiar_cartera()
+        if args.limpiar:
+            print('Datos sintéticos eliminados')
+        else:
+            inicio = time.perf_counter()
+            conteos = generar_cartera(args.clientes, args.semilla)
+            print(f'Cartera generada en {time.perf_counter() - inicio:.1f} s (semilla {args.semilla}):')
+            for clave, valor in conteos.items():
+                print(f'  {clave:<14} {valor:>10}')
@@ -0,0 +1,169 @@
+"""
+Prueba de estrés de concurrencia sobre las escrituras de préstamos.
+
+Muchos hilos registran pagos de S/ 1.00 sobre unos pocos préstamos "calientes"
+(por /api/prestamos/<id>/cuota y /api/cuotas/lote) mientras otro hilo fuerza el
+recálculo programado de la cartera. Al final se verifica que no se perdió
+ninguna actualización:
+  - total_pagado y num_cuotas coinciden con los pagos aceptados y con la tabla cuotas;
+  - el saldo guardado es monto_total - total_pagado (los préstamos no están vencidos).
+
+Uso:
+    python -m benchmarks.concurrencia_pagos                 # 32 hilos x 25 pagos sobre 4 préstamos
+    python -m benchmarks.concurrencia_pagos 64 50 2
+
+Requiere el usuario admin por defecto (init_db.py). Los datos sintéticos
+(DNI 'BENCH...') se eliminan al terminar. Sale con código 1 si hay pérdidas.
+"""
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from app import app, db, get_current_date, ejecutar_recalculo_programado
+from sqlalchemy import text
+from benchmarks.conteo_consultas import limpiar_cartera
+
+HILOS_POR_DEFECTO = 32
+PAGOS_POR_HILO_POR_DEFECTO = 25
+PRESTAMOS_POR_DEFECTO = 4
+PAGOS_POR_LOTE = 5
+
+
+def crear_prestamos_calientes(n, hoy):
+    """Crea n préstamos vigentes con deuda vencida de sobra para absorber todos los pagos."""
+    filas = db.session.execute(text("""
+        WITH nuevos AS (
+            INSERT INTO clientes (nombre, dni, direccion, telefono)
+            SELECT 'Cliente concurrencia ' || g, 'BENCHC' || g, 'Lima', '900000000'
+            FROM generate_series(1, :n) g
+            RETURNING id
+        )
+        INSERT INTO prestamos (cliente_id, monto_principal, interes, monto_total, fecha_inicio, fecha_fin,
+                               estado, saldo, tipo_prestamo, tipo_frecuencia, cuota_diaria, dt, deuda_vencida)
+        SELECT id, 100000, 10, 110000, CAST(:hoy AS date) - 20, CAST(:hoy AS date) + 10,
+               'activo', 110000, 'CR', 'Diario', 5000, 0, 0
+        FROM nuevos
+        RETURNING id
+    """), {'n': n, 'hoy': hoy}).fetchall()
+    db.session.commit()
+    return [fila[0] for fila in filas]
+
+
+def iniciar_sesion():
+    cliente_http = app.test_client()
+    respuesta = cliente_http.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+    assert respuesta.status_code == 200, 'No se pudo iniciar sesión como admin'
+    return cliente_http
+
+
+def trabajador_pagos(prestamo_ids, pagos, aceptados, errores, barrera):
+    """Registra pagos individuales y por lote; anota cuántos se aceptaron por préstamo."""
+    cliente_http = iniciar_sesion()
+    locales = Counter()
+    barrera.wait()
+    enviados = 0
+    while enviados < pagos:
+        if random.random() < 0.2 and pagos - enviados >= PAGOS_POR_LOTE:
+            lote = [{'prestamo_id': random.choice(prestamo_ids), 'monto': 1} for _ in range(PAGOS_POR_LOTE)]
+            respuesta = cliente_http.post('/api/cuotas/lote', json={'pagos': lote})
+            if respuesta.status_code == 200:
+                for resultado in respuesta.get_json()['resultados']:
+                    if resultado['ok']:
+                        locales[resultado['prestamo_id']] += 1
+            else:
+                errores.append(respuesta.get_json())
+            enviados += PAGOS_POR_LOTE
+        else:
+            prestamo_id = random.choice(prestamo_ids)
+            respuesta = cliente_http.post(f'/api/prestamos/{prestamo_id}/cuota', json={'monto': 1})
+            if respuesta.status_code == 200:
+                locales[prestamo_id] += 1
+            else:
+                errores.append(respuesta.get_json())
+            enviados += 1
+    aceptados.update(locales)
+
+
+def trabajador_recalculo(detener, ejecuciones, errores):
+    """Fuerza el recálculo de la cartera en bucle mientras llegan los pagos."""
+    while not detener.is_set():
+        try:
+            if ejecutar_recalculo_programado(motivo='manual', forzar=True):
+                ejecuciones.append(1)
+        except Exception as e:
+            errores.append({'recalculo': str(e).split('\n')[0]})
+        time.sleep(0.01)
+
+
+def verificar(prestamo_ids, aceptados):
+    """Devuelve la lista de préstamos con actualizaciones perdidas."""
+    filas = db.session.execute(text("""
+        SELECT p.id, p.total_pagado, p.num_cuotas, p.saldo, p.monto_total,
+               COALESCE(SUM(c.monto), 0), COUNT(c.id)
+        FROM prestamos p
+        LEFT JOIN cuotas c ON c.prestamo_id = p.id
+        WHERE p.id IN :ids
+        GROUP BY p.id
+        ORDER BY p.id
+    """).bindparams(db.bindparam('ids', expanding=True)), {'ids': prestamo_ids}).fetchall()
+
+    perdidas = []
+    for pid, total_pagado, num_cuotas, saldo, monto_total, suma_cuotas, cantidad_cuotas in filas:
+        esperado = Decimal(aceptados[pid])
+        ok = (total_pagado == esperado == suma_cuotas
+              and num_cuotas == aceptados[pid] == cantidad_cuotas
+              and saldo == monto_total - total_pagado)
+        print(f'{pid:>8} | {aceptados[pid]:>9} | {total_pagado:>12} | {num_cuotas:>10} | {suma_cuotas:>12} | '
+              f'{saldo:>10} | {"OK" if ok else "PÉRDIDA"}')
+        if not ok:
+            perdidas.append(pid)
+    return perdidas
+
+
+if __name__ == '__main__':
+    argumentos = [int(arg) for arg in sys.argv[1:]]
+    hilos, pagos, n_prestamos = (argumentos + [HILOS_POR_DEFECTO, PAGOS_POR_HILO_POR_DEFECTO,
+                                               PRESTAMOS_POR_DEFECTO][len(argumentos):])[:3]
+    app.config['RECALCULO_PROGRAMADO'] = False  # El recálculo lo fuerza el hilo de la prueba
+
+    with app.app_context():
+        prestamo_ids = crear_prestamos_calientes(n_prestamos, get_current_date())
+    try:
+        aceptados, errores, ejecuciones = Counter(), [], []
+        barrera = threading.Barrier(hilos)
+        detener = threading.Event()
+        trabajadores = [
+            threading.Thread(target=trabajador_pagos, args=(prestamo_ids, pagos, aceptados, errores, barrera))
+            for _ in range(hilos)
+        ]
+        recalculo = threading.Thread(target=trabajador_recalculo, args=(detener, ejecuciones, errores))
+
+        inicio = time.perf_counter()
+        recalculo.start()
+        for hilo in trabajadores:
+            hilo.start()
+        for hilo in trabajadores:
+            hilo.join()
+        detener.set()
+        recalculo.join()
+        segundos = time.perf_counter() - inicio
+
+        with app.app_context():
+            print(f'{hilos} hilos x {pagos} pagos sobre {n_prestamos} préstamos en {segundos:.1f} s '
+                  f'({sum(aceptados.values())} aceptados, {len(errores)} errores, {len(ejecuciones)} recálculos)')
+            print(f"{'Préstamo':>8} | {'Aceptados':>9} | {'total_pagado':>12} | {'num_cuotas':>10} | "
+                  f"{'SUM(cuotas)':>12} | {'saldo':>10} | Resultado")
+            perdidas = verificar(prestamo_ids, aceptados)
+    finally:
+        with app.app_context():
+            limpiar_cartera()
+
+    for error in errores[:5]:
+        print('Error:', error)
+    if perdidas or errores:
+        print('❌ Se perdieron actualizaciones' if perdidas else '❌ Hubo pagos con error')
+        sys.exit(1)
+    print('✅ Ninguna actualización perdida')
@@ -0,0 +1,123 @@
+"""
+Verifica que los endpoints de listado usen un número fijo de consultas SQL,
+sin importar cuántos clientes existan (sin N+1), y que no escriban en la base de datos.
+
+Uso:
+    python -m benchmarks.conteo_consultas             # 10, 100 y 1000 clientes
+    python -m benchmarks.conteo_consultas 50 500
+
+Requiere el usuario admin por defecto (init_db.py). Los clientes sintéticos
+(DNI 'BENCH...') se eliminan al terminar. Sale con código 1 si el número de
+consultas de algún endpoint cambia con el tamaño de la cartera o si alguno escribe.
+"""
+import sys
+
+from app import app, db, get_current_date, invalidar_resumen_creditos, registrar_cambio_cartera
+from sqlalchemy import event, text
+from benchmarks.recalculo_cartera import sembrar_cartera
+
+TAMANOS_POR_DEFECTO = [10, 100, 1000]
+
+ENDPOINTS = [
+    '/api/clientes',
+    '/api/clientes_sin_prestamo',
+    '/api/clientes/search?q=Cliente',
+    '/api/resumen_creditos',
+]
+
+SENTENCIAS_DE_ESCRITURA = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class ContadorConsultas:
+    """Cuenta las sentencias SQL (y cuántas son escrituras) enviadas a la base de datos mientras está activo."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.total = 0
+        self.escrituras = 0
+
+    def _contar(self, conn, cursor, statement, *args, **kwargs):
+        self.total += 1
+        if statement.lstrip().upper().startswith(SENTENCIAS_DE_ESCRITURA):
+            self.escrituras += 1
+
+    def __enter__(self):
+        self.total = 0
+        self.escrituras = 0
+        event.listen(self.engine, 'before_cursor_execute', self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._contar)
+
+
+def limpiar_cartera():
+    """Elimina los clientes sintéticos y todo lo que cuelga de ellos."""
+    db.session.execute(text("""
+        DELETE FROM cuotas WHERE prestamo_id IN (
+            SELECT p.id FROM prestamos p JOIN clientes c ON c.id = p.cliente_id
+            WHERE c.dni LIKE 'BENCH%'
+        )
+    """))
+    db.session.execute(text("""
+        DELETE FROM prestamos WHERE cliente_id IN (SELECT id FROM clientes WHERE dni LIKE 'BENCH%')
+    """))
+    db.session.execute(text("DELETE FROM clientes WHERE dni LIKE 'BENCH%'"))
+    db.session.commit()
+    registrar_cambio_cartera()
+
+
+def preparar_cartera(n):
+    """Crea n clientes sintéticos asignados al trabajador por defecto."""
+    sembrar_cartera(n, get_current_date())
+    db.session.execute(text("""
+        UPDATE clientes
+        SET trabajador_id = (SELECT id FROM usuarios WHERE rol = 'trabajador' ORDER BY id LIMIT 1)
+        WHERE dni LIKE 'BENCH%'
+    """))
+    db.session.commit()
+
+
+def contar_consultas_por_endpoint(cliente_http):
+    conteos = {}
+    for url in ENDPOINTS:
+        invalidar_resumen_creditos()  # Mide siempre el cálculo, no la caché
+        with ContadorConsultas(db.engine) as contador:
+            respuesta = cliente_http.get(url)
+        assert respuesta.status_code == 200, f'{url} respondió {respuesta.status_code}'
+        assert contador.escrituras == 0, f'{url} escribió en la base de datos ({contador.escrituras} sentencias)'
+        conteos[url] = contador.total
+    return conteos
+
+
+if __name__ == '__main__':
+    tamanos = [int(arg) for arg in sys.argv[1:]] or TAMANOS_POR_DEFECTO
+    resultados = {}
+
+    app.config['RECALCULO_PROGRAMADO'] = False  # Sin hilo en segundo plano durante la medición
+    with app.app_context():
+        cliente_http = app.test_client()
+        login = cliente_http.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+        assert login.status_code == 200, 'No se pudo iniciar sesión como admin'
+
+        for n in tamanos:
+            try:
+                preparar_cartera(n)
+                contar_consultas_por_endpoint(cliente_http)  # Calienta cachés (calendario, etc.)
+                resultados[n] = contar_consultas_por_endpoint(cliente_http)
+            finally:
+                db.session.rollback()
+                limpiar_cartera()
+
+    print(f"{'Endpoint':<36} | " + ' | '.join(f'{n:>7}' for n in tamanos))
+    print('-' * (39 + 10 * len(tamanos)))
+    constante = True
+    for url in ENDPOINTS:
+        conteos = [resultados[n][url] for n in tamanos]
+        constante &= len(set(conteos)) == 1
+        print(f'{url:<36} | ' + ' | '.join(f'{c:>7}' for c in conteos))
+
+    if not constante:
+        print('❌ El número de consultas depende del tamaño de la cartera')
+        sys.exit(1)
+    print('✅ Número de consultas constante')
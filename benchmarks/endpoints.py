@@ -0,0 +1,173 @@
+"""
+Suite de benchmarks de la API sobre una cartera sintética grande.
+
+Para cada endpoint registra la latencia p50/p95, el número de consultas SQL por petición
+y el pico de memoria de Python (tracemalloc) de una petición. Los resultados se pueden
+guardar en JSON y compararse con una corrida anterior para detectar regresiones.
+
+Uso:
+    python -m benchmarks.endpoints                              # 10k clientes, 20 repeticiones
+    python -m benchmarks.endpoints 100000 --salida base.json
+    python -m benchmarks.endpoints 100000 --referencia base.json  # sale con 1 si hay regresión
+    python -m benchmarks.endpoints 500000 --reusar --conservar    # no regenerar / no borrar la cartera
+
+La cartera se genera con benchmarks.cartera_sintetica (misma semilla = mismos datos).
+Requiere el usuario admin por defecto (init_db.py).
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from app import app, db, invalidar_resumen_creditos
+from sqlalchemy import text
+from benchmarks.cartera_sintetica import generar_cartera, SEMILLA_POR_DEFECTO
+from benchmarks.conteo_consultas import ContadorConsultas, limpiar_cartera
+from benchmarks.login import percentil
+
+CLIENTES_POR_DEFECTO = 10000
+REPETICIONES_POR_DEFECTO = 20
+# Una regresión es un p95 mayor a TOLERANCIA veces el de referencia (y al menos MARGEN_MS más lento)
+# o cualquier consulta SQL adicional
+TOLERANCIA = 1.5
+MARGEN_MS = 5.0
+
+
+def elegir_muestras():
+    """Ids representativos de la cartera sintética: el cliente con la cadena más larga y el préstamo con más cuotas."""
+    cliente_id = db.session.execute(text("""
+        SELECT c.id FROM clientes c JOIN prestamos p ON p.cliente_id = c.id
+        WHERE c.dni LIKE 'BENCHS%'
+        GROUP BY c.id ORDER BY COUNT(*) DESC, c.id LIMIT 1
+    """)).scalar()
+    prestamo_id = db.session.execute(text("""
+        SELECT p.id FROM prestamos p JOIN clientes c ON c.id = p.cliente_id
+        WHERE c.dni LIKE 'BENCHS%'
+        ORDER BY p.num_cuotas DESC, p.id LIMIT 1
+    """)).scalar()
+    return cliente_id, prestamo_id
+
+
+def casos(cliente_id, prestamo_id):
+    """(nombre, método, url, repeticiones relativas). El recálculo completo se repite menos."""
+    return [
+        ('clientes', 'GET', '/api/clientes', 1),
+        ('clientes orden=nombre limite=200', 'GET', '/api/clientes?orden=nombre&limite=200', 1),
+        ('clientes vencidos detalle+cuotas', 'GET', '/api/clientes?solo_vencidos=1&view=detail&include=cuotas', 1),
+        ('clientes_sin_prestamo', 'GET', '/api/clientes_sin_prestamo', 1),
+        ('clientes/search nombre', 'GET', '/api/clientes/search?q=quispe', 1),
+        ('clientes/search dni', 'GET', '/api/clientes/search?q=BENCHS12', 1),
+        ('historial cliente', 'GET', f'/api/prestamos/historial/{cliente_id}', 1),
+        ('cuotas préstamo', 'GET', f'/api/prestamos/{prestamo_id}/cuotas', 1),
+        ('resumen_creditos (sin caché)', 'GET', '/api/resumen_creditos', 1),
+        ('trabajadores', 'GET', '/api/trabajadores', 1),
+        ('actualizar_prestamos estado', 'GET', '/api/actualizar_prestamos', 1),
+        ('actualizar_prestamos forzar', 'POST', '/api/actualizar_prestamos?forzar=1', 0.25),
+    ]
+
+
+def ejecutar(cliente_http, metodo, url):
+    invalidar_resumen_creditos()  # El resumen se mide siempre calculado, no desde la caché
+    respuesta = cliente_http.open(url, method=metodo)
+    assert respuesta.status_code == 200, f'{metodo} {url} respondió {respuesta.status_code}'
+    return respuesta
+
+
+def medir_caso(cliente_http, metodo, url, repeticiones):
+    ejecutar(cliente_http, metodo, url)  # Calentamiento (calendario, planes de consulta)
+
+    latencias = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        ejecutar(cliente_http, metodo, url)
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+    with ContadorConsultas(db.engine) as contador:
+        respuesta = ejecutar(cliente_http, metodo, url)
+
+    # tracemalloc ralentiza la ejecución: el pico se mide en una corrida aparte
+    tracemalloc.start()
+    ejecutar(cliente_http, metodo, url)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'p50_ms': round(statistics.median(latencias), 2),
+        'p95_ms': round(percentil(latencias, 0.95), 2),
+        'consultas': contador.total,
+        'memoria_pico_kb': round(pico / 1024),
+        'respuesta_kb': round(len(respuesta.data) / 1024),
+    }
+
+
+def comparar(resultados, referencia):
+    """Devuelve la lista de regresiones (texto) respecto de una corrida anterior."""
+    regresiones = []
+    for nombre, actual in resultados.items():
+        anterior = referencia.get(nombre)
+        if not anterior:
+            continue
+        if actual['p95_ms'] > anterior['p95_ms'] * TOLERANCIA and actual['p95_ms'] - anterior['p95_ms'] > MARGEN_MS:
+            regresiones.append(f"{nombre}: p95 {anterior['p95_ms']} -> {actual['p95_ms']} ms")
+        if actual['consultas'] > anterior['consultas']:
+            regresiones.append(f"{nombre}: consultas {anterior['consultas']} -> {actual['consultas']}")
+    return regresiones
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks de la API sobre una cartera sintética.')
+    parser.add_argument('clientes', type=int, nargs='?', default=CLIENTES_POR_DEFECTO)
+    parser.add_argument('--repeticiones', type=int, default=REPETICIONES_POR_DEFECTO)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--salida', help='Guarda los resultados en este archivo JSON')
+    parser.add_argument('--referencia', help='Compara con los resultados JSON de una corrida anterior')
+    parser.add_argument('--reusar', action='store_true', help='Usa la cartera sintética existente')
+    parser.add_argument('--conservar', action='store_true', help='No elimina la cartera al terminar')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False  # Sin hilo en segundo plano durante la medición
+
+    resultados = {}
+    with app.app_context():
+        if not args.reusar:
+            limpiar_cartera()
+            inicio = time.perf_counter()
+            conteos = generar_cartera(args.clientes, args.semilla)
+            print(f"Cartera: {conteos['clientes']} clientes, {conteos['prestamos']} préstamos, "
+                  f"{conteos['cuotas']} cuotas (generada en {time.perf_counter() - inicio:.1f} s)")
+        try:
+            cliente_http = app.test_client()
+            login = cliente_http.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+            assert login.status_code == 200, 'No se pudo iniciar sesión como admin'
+
+            print(f"{'Endpoint':<36} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'Consultas':>9} | "
+                  f"{'Memoria (KB)':>12} | {'Respuesta (KB)':>14}")
+            print('-' * 104)
+            for nombre, metodo, url, relativo in casos(*elegir_muestras()):
+                r = medir_caso(cliente_http, metodo, url, max(1, int(args.repeticiones * relativo)))
+                resultados[nombre] = r
+                print(f"{nombre:<36} | {r['p50_ms']:>9.1f} | {r['p95_ms']:>9.1f} | {r['consultas']:>9} | "
+                      f"{r['memoria_pico_kb']:>12} | {r['respuesta_kb']:>14}")
+        finally:
+            db.session.rollback()
+            if not args.conservar:
+                inicio = time.perf_counter()
+                limpiar_cartera()
+                print(f'Cartera sintética eliminada en {time.perf_counter() - inicio:.1f} s')
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump({'clientes': args.clientes, 'semilla': args.semilla, 'resultados': resultados},
+                      archivo, ensure_ascii=False, indent=2)
+        print(f'Resultados guardados en {args.salida}')
+
+    if args.referencia:
+        with open(args.referencia, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, json.load(archivo)['resultados'])
+        if regresiones:
+            print('❌ Regresiones respecto de la referencia:')
+            for regresion in regresiones:
+                print('   ' + regresion)
+            sys.exit(1)
+        print('✅ Sin regresiones respecto de la referencia')
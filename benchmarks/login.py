@@ -0,0 +1,91 @@
+"""
+Benchmark de inicio de sesión: rendimiento de /auth/login bajo ráfagas concurrentes
+y latencia de una ruta liviana (/auth/check) mientras tanto.
+
+Uso:
+    python -m benchmarks.login                 # 1, 4, 16 y 64 logins concurrentes
+    python -m benchmarks.login 8 32
+    BCRYPT_HILOS=1 python -m benchmarks.login  # comparar tamaños de pool
+
+Requiere el usuario admin por defecto (init_db.py).
+"""
+import statistics
+import sys
+import threading
+import time
+
+from app import app
+
+CONCURRENCIAS_POR_DEFECTO = [1, 4, 16, 64]
+LOGINS_POR_HILO = 4
+CREDENCIALES = {'username': 'admin', 'password': 'admin123'}
+
+
+def percentil(valores, p):
+    if not valores:
+        return float('nan')
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+def hilo_login(latencias, estados, barrera):
+    cliente_http = app.test_client()
+    barrera.wait()
+    for _ in range(LOGINS_POR_HILO):
+        inicio = time.perf_counter()
+        respuesta = cliente_http.post('/auth/login', json=CREDENCIALES)
+        latencias.append(time.perf_counter() - inicio)
+        estados.append(respuesta.status_code)
+
+
+def hilo_ruta_liviana(latencias, detener):
+    """Mide /auth/check en bucle: muestra si la ráfaga de logins bloquea al resto de la API."""
+    cliente_http = app.test_client()
+    cliente_http.post('/auth/login', json=CREDENCIALES)
+    while not detener.is_set():
+        inicio = time.perf_counter()
+        cliente_http.get('/auth/check')
+        latencias.append(time.perf_counter() - inicio)
+        time.sleep(0.005)
+
+
+def medir(concurrencia):
+    latencias, estados, latencias_check = [], [], []
+    barrera = threading.Barrier(concurrencia)
+    detener = threading.Event()
+    monitor = threading.Thread(target=hilo_ruta_liviana, args=(latencias_check, detener))
+    hilos = [threading.Thread(target=hilo_login, args=(latencias, estados, barrera)) for _ in range(concurrencia)]
+
+    monitor.start()
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+    detener.set()
+    monitor.join()
+
+    exitosos = estados.count(200)
+    return {
+        'logins_s': exitosos / segundos,
+        'p50': statistics.median(latencias) * 1000,
+        'p95': percentil(latencias, 0.95) * 1000,
+        'rechazados': estados.count(503),
+        'check_p95': percentil(latencias_check, 0.95) * 1000,
+    }
+
+
+if __name__ == '__main__':
+    concurrencias = [int(arg) for arg in sys.argv[1:]] or CONCURRENCIAS_POR_DEFECTO
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    print(f"bcrypt: costo {app.config['BCRYPT_LOG_ROUNDS']}, {app.config['BCRYPT_HILOS']} hilos, "
+          f"cola {app.config['BCRYPT_COLA_MAXIMA']}")
+    print(f"{'Concurrencia':>12} | {'logins/s':>8} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'503':>5} | "
+          f"{'/auth/check p95 (ms)':>20}")
+    print('-' * 78)
+    for concurrencia in concurrencias:
+        r = medir(concurrencia)
+        print(f"{concurrencia:>12} | {r['logins_s']:>8.1f} | {r['p50']:>8.0f} | {r['p95']:>8.0f} | "
+              f"{r['rechazados']:>5} | {r['check_p95']:>20.1f}")
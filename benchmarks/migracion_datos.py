@@ -0,0 +1,160 @@
+"""
+Benchmark de las migraciones de datos de init_db.py: bucle original préstamo por préstamo
+(una conexión, una suma de cuotas y un commit por préstamo) vs. UPDATE por conjuntos en lotes.
+
+Sobre una cartera sintética se "desarma" una parte de los préstamos (sin monto total, sin tipo,
+saldos y estados desfasados), se guarda esa foto y se ejecutan ambas versiones a partir de ella,
+comparando el resultado fila por fila.
+
+Uso:
+    python -m benchmarks.migracion_datos                 # 10k clientes, con la versión original
+    python -m benchmarks.migracion_datos 100000 --sin-original
+
+Al terminar se eliminan los datos sintéticos (benchmarks.conteo_consultas.limpiar_cartera()).
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app import app, db
+from benchmarks.cartera_sintetica import generar_cartera, SEMILLA_POR_DEFECTO
+from benchmarks.conteo_consultas import limpiar_cartera
+from init_db import migrar_prestamos_al_nuevo_formato, actualizar_saldos_y_estados
+
+COLUMNAS = ('monto_principal', 'monto_total', 'tipo_prestamo', 'tipo_frecuencia', 'cuota_diaria', 'saldo', 'estado')
+NO_NULOS = ('monto_principal', 'monto_total')
+SINTETICOS = "cliente_id IN (SELECT id FROM clientes WHERE dni LIKE 'BENCH%')"
+
+
+def desarmar_cartera():
+    """Deja préstamos sintéticos como los de una base anterior al sistema de cuotas o con saldos desfasados."""
+    # En esas bases las columnas se agregaron con ALTER TABLE, sin NOT NULL
+    db.session.execute(text(f"ALTER TABLE prestamos {', '.join(f'ALTER COLUMN {c} DROP NOT NULL' for c in NO_NULOS)}"))
+    db.session.execute(text(f"""
+        UPDATE prestamos
+        SET monto_total = CASE WHEN id % 10 = 0 THEN NULL ELSE monto_total END,
+            monto_principal = CASE WHEN id % 40 = 0 THEN NULL ELSE monto_principal END,
+            tipo_prestamo = CASE WHEN id % 20 = 0 THEN NULL ELSE tipo_prestamo END,
+            tipo_frecuencia = CASE WHEN id % 20 = 0 THEN '' ELSE tipo_frecuencia END,
+            saldo = CASE WHEN id % 3 = 0 THEN saldo + 7 WHEN id % 30 = 1 THEN NULL ELSE saldo END,
+            estado = CASE WHEN id % 11 = 0 AND estado = 'activo' THEN 'pagado' ELSE estado END
+        WHERE {SINTETICOS}
+    """))
+    db.session.execute(text(f"""
+        CREATE TABLE foto_migracion AS SELECT id, {', '.join(COLUMNAS)} FROM prestamos WHERE {SINTETICOS}
+    """))
+    db.session.commit()
+
+
+def restaurar_foto():
+    db.session.execute(text(f"""
+        UPDATE prestamos p SET {', '.join(f'{columna} = f.{columna}' for columna in COLUMNAS)}
+        FROM foto_migracion f WHERE f.id = p.id
+    """))
+    db.session.commit()
+
+
+def leer_resultados():
+    filas = db.session.execute(text(
+        f"SELECT id, {', '.join(COLUMNAS)} FROM prestamos WHERE {SINTETICOS} ORDER BY id"
+    )).fetchall()
+    db.session.commit()
+    return {fila[0]: tuple(fila[1:]) for fila in filas}
+
+
+def migrar_prestamos_original():
+    """migrar_prestamos_al_nuevo_formato() antes de los lotes (sin la columna antigua 'monto')."""
+    with db.engine.connect() as connection:
+        prestamos = connection.execute(text("""
+            SELECT id, interes, monto_principal, monto_total, tipo_prestamo, tipo_frecuencia, cuota_diaria
+            FROM prestamos WHERE monto_principal IS NULL OR monto_total IS NULL
+        """)).fetchall()
+    for prestamo_id, interes, principal, total, tipo, frecuencia, cuota in prestamos:
+        interes = Decimal(str(interes)) if interes else Decimal('0')
+        monto_principal = Decimal('0') if principal is None else Decimal(str(principal))
+        monto_total = monto_principal + monto_principal * (interes / 100) if total is None else Decimal(str(total))
+        with db.engine.connect() as connection:
+            connection.execute(text("""
+                UPDATE prestamos
+                SET monto_principal = :monto_principal, monto_total = :monto_total, tipo_prestamo = :tipo_prestamo,
+                    tipo_frecuencia = :tipo_frecuencia, cuota_diaria = :cuota_diaria,
+                    saldo = COALESCE(saldo, :monto_total)
+                WHERE id = :prestamo_id
+            """), {'prestamo_id': prestamo_id, 'monto_principal': monto_principal, 'monto_total': monto_total,
+                   'tipo_prestamo': tipo or 'CR', 'tipo_frecuencia': frecuencia or 'Diario',
+                   'cuota_diaria': Decimal(str(cuota)) if cuota else Decimal('0')})
+            connection.commit()
+
+
+def actualizar_saldos_original():
+    """actualizar_saldos_y_estados() antes de los lotes: una suma de cuotas y un UPDATE por préstamo."""
+    with db.engine.connect() as connection:
+        prestamos = connection.execute(text(
+            "SELECT id, monto_total, estado FROM prestamos WHERE monto_total IS NOT NULL"
+        )).fetchall()
+    for prestamo_id, monto_total, estado in prestamos:
+        with db.engine.connect() as connection:
+            pagado = connection.execute(text(
+                "SELECT COALESCE(SUM(monto), 0) FROM cuotas WHERE prestamo_id = :prestamo_id"
+            ), {'prestamo_id': prestamo_id}).scalar()
+        saldo = max(Decimal('0'), Decimal(str(monto_total)) - Decimal(str(pagado)))
+        if saldo <= 0 and estado in ['activo', 'vencido']:
+            estado = 'pagado'
+        elif estado == 'pagado' and saldo > 0:
+            estado = 'activo'
+        with db.engine.connect() as connection:
+            connection.execute(text("UPDATE prestamos SET saldo = :saldo, estado = :estado WHERE id = :prestamo_id"),
+                               {'prestamo_id': prestamo_id, 'saldo': saldo, 'estado': estado})
+            connection.commit()
+
+
+def medir(*funciones):
+    inicio = time.perf_counter()
+    for funcion in funciones:
+        assert funcion() is not False, f'{funcion.__name__} falló'
+    return time.perf_counter() - inicio
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migraciones de datos de init_db: original vs. por lotes.')
+    parser.add_argument('clientes', type=int, nargs='?', default=10000)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--sin-original', action='store_true', help='Solo mide la versión por lotes')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    with app.app_context():
+        limpiar_cartera()
+        conteos = generar_cartera(args.clientes, args.semilla)
+        try:
+            desarmar_cartera()
+            cuotas = db.session.execute(text('SELECT COUNT(*) FROM cuotas')).scalar()
+            print(f"{conteos['prestamos']} préstamos sintéticos, {cuotas} cuotas en total\n")
+
+            t_lotes = medir(migrar_prestamos_al_nuevo_formato, actualizar_saldos_y_estados)
+            resultados_lotes = leer_resultados()
+            print(f'\nPor lotes: {t_lotes:.2f} s')
+
+            # Volver a ejecutarlo no cambia nada (así se retoma una migración interrumpida)
+            t_repetido = medir(migrar_prestamos_al_nuevo_formato, actualizar_saldos_y_estados)
+            print(f'Repetido sobre datos ya migrados: {t_repetido:.2f} s, '
+                  f'{"sin cambios" if leer_resultados() == resultados_lotes else "❌ CAMBIÓ"}')
+
+            if not args.sin_original:
+                restaurar_foto()
+                t_original = medir(migrar_prestamos_original, actualizar_saldos_original)
+                resultados_original = leer_resultados()
+                diferencias = [pid for pid in resultados_original
+                               if resultados_original[pid] != resultados_lotes.get(pid)]
+                print(f'Original:  {t_original:.2f} s ({t_original / t_lotes:.0f}x), '
+                      f'{len(diferencias)} préstamos con valores distintos')
+                if diferencias:
+                    print(f'   ❌ Primeros 10: {diferencias[:10]}')
+        finally:
+            db.session.rollback()
+            db.session.execute(text('DROP TABLE IF EXISTS foto_migracion'))
+            db.session.execute(text(f"ALTER TABLE prestamos {', '.join(f'ALTER COLUMN {c} SET NOT NULL' for c in NO_NULOS)}"))
+            db.session.commit()
+            limpiar_cartera()
@@ -0,0 +1,148 @@
+"""
+Planes de ejecución de las consultas de cada endpoint sobre una cartera sintética.
+
+Captura las sentencias SELECT que ejecuta cada endpoint, las vuelve a ejecutar con
+EXPLAIN (ANALYZE, FORMAT JSON) y resume por endpoint: tiempo total de ejecución en
+PostgreSQL, tablas recorridas completas (Seq Scan) e índices usados. Además mide el
+borrado en cascada de un cliente (dentro de una transacción que se revierte), donde
+las comprobaciones de claves foráneas sin índice recorren tablas enteras.
+
+Sirve para comparar el antes y el después de una migración de índices:
+    python -m benchmarks.planes_consulta 100000 --conservar    # antes
+    flask --app app migrar
+    python -m benchmarks.planes_consulta 100000 --reusar       # después
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import event, text
+
+from app import app, db
+from benchmarks.cartera_sintetica import generar_cartera, SEMILLA_POR_DEFECTO
+from benchmarks.conteo_consultas import limpiar_cartera
+from benchmarks.endpoints import casos, elegir_muestras
+
+CLIENTES_POR_DEFECTO = 100000
+
+
+class CapturaConsultas:
+    """Guarda las sentencias SELECT (con sus parámetros) que se ejecutan dentro del bloque with."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.sentencias = []
+
+    def _capturar(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')) and not executemany:
+            self.sentencias.append((statement, parameters))
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._capturar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._capturar)
+
+
+def recorrer_plan(nodo, recorridos, indices):
+    """Acumula las tablas con Seq Scan y los índices usados en un plan JSON."""
+    if nodo.get('Node Type') == 'Seq Scan':
+        recorridos.add(nodo['Relation Name'])
+    if nodo.get('Index Name'):
+        indices.add(nodo['Index Name'])
+    for hijo in nodo.get('Plans', []):
+        recorrer_plan(hijo, recorridos, indices)
+
+
+def explicar(conexion, sentencia, parametros):
+    """Ejecuta EXPLAIN ANALYZE y devuelve (ms de ejecución, tablas con Seq Scan, índices, ms en triggers)."""
+    cursor = conexion.cursor()
+    cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sentencia, parametros)
+    plan = cursor.fetchone()[0][0]
+    cursor.close()
+    recorridos, indices = set(), set()
+    recorrer_plan(plan['Plan'], recorridos, indices)
+    triggers = sum(trigger['Time'] for trigger in plan.get('Triggers', []))
+    return plan['Execution Time'], recorridos, indices, triggers
+
+
+def planes_endpoint(cliente_http, metodo, url, conexion):
+    with CapturaConsultas(db.engine) as captura:
+        respuesta = cliente_http.open(url, method=metodo)
+        assert respuesta.status_code == 200, f'{metodo} {url} respondió {respuesta.status_code}'
+    db.session.rollback()
+    total, recorridos, indices = 0.0, set(), set()
+    for sentencia, parametros in captura.sentencias:
+        ms, r, i, _ = explicar(conexion, sentencia, parametros)
+        total += ms
+        recorridos |= r
+        indices |= i
+    conexion.rollback()
+    return {
+        'consultas': len(captura.sentencias),
+        'ejecucion_ms': round(total, 2),
+        'seq_scan': sorted(recorridos),
+        'indices': sorted(indices),
+    }
+
+
+def plan_borrado_cliente(conexion, cliente_id):
+    """Borra un cliente con sus préstamos y cuotas (ON DELETE CASCADE) y revierte; devuelve ms totales y en triggers."""
+    ms, _, _, triggers = explicar(conexion, 'DELETE FROM clientes WHERE id = %(id)s', {'id': cliente_id})
+    conexion.rollback()
+    return {'ejecucion_ms': round(ms, 2), 'triggers_ms': round(triggers, 2)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='EXPLAIN ANALYZE de las consultas de cada endpoint.')
+    parser.add_argument('clientes', type=int, nargs='?', default=CLIENTES_POR_DEFECTO)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--salida', help='Guarda los resultados en este archivo JSON')
+    parser.add_argument('--reusar', action='store_true', help='Usa la cartera sintética existente')
+    parser.add_argument('--conservar', action='store_true', help='No elimina la cartera al terminar')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    resultados = {}
+    with app.app_context():
+        if not args.reusar:
+            limpiar_cartera()
+            generar_cartera(args.clientes, args.semilla)
+        conexion = db.engine.raw_connection()
+        try:
+            cliente_http = app.test_client()
+            login = cliente_http.post('/auth/login', json={'username': 'admin', 'password': 'admin123'})
+            assert login.status_code == 200, 'No se pudo iniciar sesión como admin'
+            cliente_id, prestamo_id = elegir_muestras()
+            trabajador_id = db.session.execute(text(
+                "SELECT trabajador_id FROM clientes WHERE id = :id"
+            ), {'id': cliente_id}).scalar()
+
+            lista = [(nombre, metodo, url) for nombre, metodo, url, _ in casos(cliente_id, prestamo_id) if metodo == 'GET']
+            lista.append(('ruta de cobro', 'GET', f'/api/ruta?trabajador_id={trabajador_id}'))
+
+            print(f"{'Endpoint':<36} | {'Consultas':>9} | {'PostgreSQL (ms)':>15} | Seq Scan / índices")
+            print('-' * 110)
+            for nombre, metodo, url in lista:
+                r = planes_endpoint(cliente_http, metodo, url, conexion)
+                resultados[nombre] = r
+                print(f"{nombre:<36} | {r['consultas']:>9} | {r['ejecucion_ms']:>15.1f} | "
+                      f"{', '.join(r['seq_scan']) or '-'} / {', '.join(r['indices']) or '-'}")
+
+            r = plan_borrado_cliente(conexion, cliente_id)
+            resultados['borrar cliente (cascada)'] = r
+            print(f"{'borrar cliente (cascada)':<36} | {'':>9} | {r['ejecucion_ms']:>15.1f} | "
+                  f"claves foráneas: {r['triggers_ms']:.1f} ms")
+        finally:
+            conexion.close()
+            db.session.rollback()
+            if not args.conservar:
+                inicio = time.perf_counter()
+                limpiar_cartera()
+                print(f'Cartera sintética eliminada en {time.perf_counter() - inicio:.1f} s')
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump({'clientes': args.clientes, 'resultados': resultados}, archivo, ensure_ascii=False, indent=2)
+        print(f'Resultados guardados en {args.salida}')
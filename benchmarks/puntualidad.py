@@ -0,0 +1,85 @@
+"""
+Benchmark de la clasificación de puntualidad de toda la historia de pagos: llamar a
+Prestamo.calcular_estado_pago_cuota() por cada cuota (filtra y suma las cuotas del préstamo en
+cada llamada: cuadrático por préstamo) vs. SQL_CLASIFICAR_PUNTUALIDAD (una suma acumulada por
+préstamo en una sola pasada).
+
+Uso:
+    python -m benchmarks.puntualidad              # 10k clientes
+    python -m benchmarks.puntualidad 100000 --sin-original
+
+La clasificación SQL se ejecuta dentro de un savepoint que se revierte; al terminar se eliminan
+los datos sintéticos. Además de los tiempos, verifica que ambas clasificaciones coincidan.
+"""
+import argparse
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+
+from app import app, db, Prestamo, Cliente, SQL_CLASIFICAR_PUNTUALIDAD
+from benchmarks.cartera_sintetica import generar_cartera, SEMILLA_POR_DEFECTO
+from benchmarks.conteo_consultas import limpiar_cartera
+
+SINTETICAS = "prestamo_id IN (SELECT p.id FROM prestamos p JOIN clientes c ON c.id = p.cliente_id WHERE c.dni LIKE 'BENCH%')"
+
+
+def clasificacion_original():
+    """Etiqueta de cada cuota sintética con calcular_estado_pago_cuota(), cuota por cuota."""
+    etiquetas = {}
+    prestamos = Prestamo.query.join(Cliente).filter(
+        Cliente.dni.like('BENCH%')
+    ).options(selectinload(Prestamo.cuotas)).all()
+    for prestamo in prestamos:
+        for cuota in prestamo.cuotas:
+            etiquetas[cuota.id] = prestamo.calcular_estado_pago_cuota(cuota.fecha_pago)
+    db.session.expunge_all()
+    return etiquetas
+
+
+def clasificacion_sql():
+    """
+    Ejecuta SQL_CLASIFICAR_PUNTUALIDAD sobre toda la cartera dos veces (la segunda ya no cambia nada:
+    es el costo de clasificar sin escribir) y lee las etiquetas. Todo se revierte.
+    """
+    savepoint = db.session.begin_nested()
+    segundos = []
+    for _ in range(2):
+        inicio = time.perf_counter()
+        actualizadas = db.session.execute(SQL_CLASIFICAR_PUNTUALIDAD, {'desde': 0, 'hasta': 2 ** 31 - 1}).rowcount
+        segundos.append((time.perf_counter() - inicio, actualizadas))
+    etiquetas = dict(db.session.execute(text(f'SELECT id, estado_pago FROM cuotas WHERE {SINTETICAS}')).fetchall())
+    savepoint.rollback()
+    return segundos, etiquetas
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Clasificación de puntualidad: por cuota vs. SQL en una pasada.')
+    parser.add_argument('clientes', type=int, nargs='?', default=10000)
+    parser.add_argument('--semilla', type=int, default=SEMILLA_POR_DEFECTO)
+    parser.add_argument('--sin-original', action='store_true', help='Solo mide la versión SQL')
+    args = parser.parse_args()
+    app.config['RECALCULO_PROGRAMADO'] = False
+
+    with app.app_context():
+        limpiar_cartera()
+        conteos = generar_cartera(args.clientes, args.semilla)
+        try:
+            print(f"{conteos['prestamos']} préstamos, {conteos['cuotas']} cuotas")
+            ((t_escritura, actualizadas), (t_sql, _)), etiquetas_sql = clasificacion_sql()
+            print(f'SQL en una pasada: {t_escritura:.2f} s escribiendo {actualizadas} etiquetas nuevas, '
+                  f'{t_sql:.2f} s sin cambios')
+
+            if not args.sin_original:
+                inicio = time.perf_counter()
+                etiquetas_original = clasificacion_original()
+                t_original = time.perf_counter() - inicio
+                diferencias = [cuota_id for cuota_id, estado in etiquetas_original.items()
+                               if etiquetas_sql.get(cuota_id) != estado]
+                print(f'Por cuota (original): {t_original:.2f} s ({t_original / t_sql:.0f}x), '
+                      f'{len(diferencias)} cuotas con etiqueta distinta')
+                if diferencias:
+                    print(f'   ❌ Primeras 10: {diferencias[:10]}')
+        finally:
+            db.session.rollback()
+            limpiar_cartera()
@@ -0,0 +1,160 @@
+"""
+Benchmark del recálculo de cartera: bucle ORM por préstamo vs. SQL por conjuntos.
+También compara la lectura del estado derivado (SQL_ESTADO_DERIVADO, la que usan los reportes)
+con Prestamo.calcular_estado_derivado() préstamo por préstamo.
+
+Uso:
+    python -m benchmarks.recalculo_cartera            # 10k y 100k préstamos
+    python -m benchmarks.recalculo_cartera 5000 20000
+
+Los datos sintéticos se insertan dentro de una transacción que se revierte al
+final, por lo que la base de datos queda intacta. Además de los tiempos, el script
+verifica que ambos métodos produzcan exactamente los mismos valores, al céntimo.
+"""
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from app import app, db, Prestamo, recalcular_cartera, get_current_date, SQL_ESTADO_DERIVADO
+from sqlalchemy import text
+
+TAMANOS_POR_DEFECTO = [10000, 100000]
+
+COLUMNAS = ('saldo', 'deuda_vencida', 'dt', 'estado', 'fecha_pago_completo')
+COLUMNAS_DERIVADAS = COLUMNAS + ('mora_pendiente',)
+CENTIMO = Decimal('0.01')
+
+
+def sembrar_cartera(n, hoy):
+    """Inserta n clientes con un préstamo cada uno y cuotas variadas (activos, vencidos, al día)."""
+    db.session.execute(text("""
+        INSERT INTO clientes (nombre, dni, direccion, telefono)
+        SELECT 'Cliente benchmark ' || g, 'BENCH' || g, 'Lima', '900000000'
+        FROM generate_series(1, :n) g
+    """), {'n': n})
+    db.session.execute(text("""
+        INSERT INTO prestamos (cliente_id, monto_principal, interes, monto_total, fecha_inicio,
+                               fecha_fin, estado, saldo, tipo_prestamo, tipo_frecuencia,
+                               cuota_diaria, dt, deuda_vencida)
+        SELECT c.id, c.monto, 20, c.monto * 1.2, c.inicio, c.inicio + 30,
+               'activo', c.monto * 1.2, 'CR', 'Diario', ROUND(c.monto * 1.2 / 22, 2), 0, 0
+        FROM (
+            SELECT id,
+                   (100 + (id % 20) * 50)::numeric AS monto,
+                   CAST(:hoy AS date) - (id % 75) AS inicio
+            FROM clientes
+            WHERE dni LIKE 'BENCH%'
+        ) c
+    """), {'hoy': hoy})
+    # Cada préstamo paga entre 0 y 25 cuotas diarias según su id
+    db.session.execute(text("""
+        INSERT INTO cuotas (prestamo_id, monto, fecha_pago, descripcion, estado_pago)
+        SELECT p.id, p.cuota_diaria, p.fecha_inicio + k, 'Cuota benchmark', 'a_tiempo'
+        FROM prestamos p
+        JOIN clientes c ON c.id = p.cliente_id AND c.dni LIKE 'BENCH%'
+        CROSS JOIN LATERAL generate_series(
+            0, LEAST(CAST(:hoy AS date) - p.fecha_inicio, 25 - (p.id % 7) * 4)
+        ) k
+    """), {'hoy': hoy})
+    # Totales acumulados de pagos, como los mantiene registrar_cuota()
+    db.session.execute(text("""
+        UPDATE prestamos p
+        SET total_pagado = t.total, num_cuotas = t.cantidad, ultima_fecha_pago = t.ultima
+        FROM (
+            SELECT prestamo_id, SUM(monto) AS total, COUNT(*) AS cantidad, MAX(fecha_pago) AS ultima
+            FROM cuotas
+            GROUP BY prestamo_id
+        ) t
+        JOIN clientes c ON c.dni LIKE 'BENCH%'
+        WHERE p.id = t.prestamo_id AND p.cliente_id = c.id
+    """))
+    db.session.flush()
+    # Estadísticas al día, como en una base de datos en producción
+    db.session.execute(text('ANALYZE clientes; ANALYZE prestamos; ANALYZE cuotas'))
+
+
+def recalculo_por_objeto():
+    """Recálculo original: un objeto Prestamo y una carga de cuotas por préstamo."""
+    prestamos = Prestamo.query.filter(Prestamo.estado.in_(['activo', 'vencido'])).all()
+    for prestamo in prestamos:
+        prestamo.calcular_dias_transcurridos()
+        prestamo.calcular_deuda_vencida()
+    db.session.flush()
+
+
+def leer_resultados():
+    """Lee los campos derivados de todos los préstamos para compararlos."""
+    filas = db.session.execute(text(
+        f"SELECT id, {', '.join(COLUMNAS)} FROM prestamos ORDER BY id"
+    )).fetchall()
+    return {fila[0]: tuple(fila[1:]) for fila in filas}
+
+
+def derivado_por_objeto(hoy):
+    """Estado derivado de cada préstamo activo con Prestamo.calcular_estado_derivado(), redondeado a céntimos."""
+    resultados = {}
+    for prestamo in Prestamo.query.filter(Prestamo.estado.in_(['activo', 'vencido'])).all():
+        derivado = prestamo.calcular_estado_derivado(hoy)
+        resultados[prestamo.id] = tuple(
+            derivado[columna].quantize(CENTIMO, ROUND_HALF_UP) if isinstance(derivado[columna], Decimal)
+            else derivado[columna]
+            for columna in COLUMNAS_DERIVADAS
+        )
+    db.session.expunge_all()
+    return resultados
+
+
+def derivado_sql(hoy):
+    """Estado derivado de cada préstamo activo leído con SQL_ESTADO_DERIVADO."""
+    filas = db.session.execute(SQL_ESTADO_DERIVADO, {'hoy': hoy}).mappings()
+    return {fila['id']: tuple(fila[columna] for columna in COLUMNAS_DERIVADAS) for fila in filas}
+
+
+def medir(funcion):
+    """Ejecuta la función dentro de un savepoint y devuelve (segundos, resultados)."""
+    savepoint = db.session.begin_nested()
+    inicio = time.perf_counter()
+    funcion()
+    segundos = time.perf_counter() - inicio
+    resultados = leer_resultados()
+    savepoint.rollback()
+    db.session.expunge_all()
+    return segundos, resultados
+
+
+def ejecutar_benchmark(n):
+    hoy = get_current_date()
+    try:
+        sembrar_cartera(n, hoy)
+        t_sql, res_sql = medir(lambda: recalcular_cartera(hoy))
+        t_objeto, res_objeto = medir(recalculo_por_objeto)
+
+        inicio = time.perf_counter()
+        derivado_objeto = derivado_por_objeto(hoy)
+        t_derivado_objeto = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        derivado_lectura = derivado_sql(hoy)
+        t_derivado_sql = time.perf_counter() - inicio
+    finally:
+        db.session.rollback()
+
+    diferencias = [pid for pid in res_objeto if res_objeto[pid] != res_sql.get(pid)]
+    diferencias += [pid for pid in derivado_objeto if derivado_objeto[pid] != derivado_lectura.get(pid)]
+    diferencias += [pid for pid in derivado_lectura if pid not in derivado_objeto]
+    return t_objeto, t_sql, t_derivado_objeto, t_derivado_sql, sorted(set(diferencias))
+
+
+if __name__ == '__main__':
+    tamanos = [int(arg) for arg in sys.argv[1:]] or TAMANOS_POR_DEFECTO
+
+    with app.app_context():
+        print(f"{'Préstamos':>10} | {'ORM (s)':>9} | {'SQL (s)':>9} | {'Mejora':>7} | "
+              f"{'Lectura ORM (s)':>15} | {'Lectura SQL (s)':>15} | Diferencias")
+        print('-' * 96)
+        for n in tamanos:
+            t_objeto, t_sql, t_derivado_objeto, t_derivado_sql, diferencias = ejecutar_benchmark(n)
+            mejora = t_objeto / t_sql if t_sql else float('inf')
+            print(f"{n:>10} | {t_objeto:>9.2f} | {t_sql:>9.3f} | {mejora:>6.0f}x | "
+                  f"{t_derivado_objeto:>15.2f} | {t_derivado_sql:>15.3f} | {len(diferencias)}")
+            if diferencias:
+                print(f"   ❌ Préstamos con valores distintos (primeros 10): {diferencias[:10]}")
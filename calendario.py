@@ -0,0 +1,168 @@
+"""
+Calendario laboral con índice de sumas acumuladas.
+
+El número de días hábiles entre dos fechas se obtiene en O(1) restando dos
+posiciones de un arreglo precalculado, en lugar de recorrer el rango día por día.
+"""
+import threading
+from array import array
+from datetime import date, timedelta
+from typing import NamedTuple
+
+# Lunes = 0 ... Domingo = 6 (igual que date.weekday())
+DIAS_LABORABLES_POR_DEFECTO = (0, 1, 2, 3, 4, 5)  # Lunes a sábado
+
+# Tope de días hábiles que se cobran en un préstamo (cuota diaria = monto_total / 22)
+MAXIMO_DIAS_HABILES = 22
+
+INICIO_CALENDARIO = date(2000, 1, 1)
+ANIOS_HACIA_ADELANTE = 5
+
+# Feriados nacionales de fecha fija en Perú: (mes, día, año desde el que rige)
+FERIADOS_FIJOS_PERU = [
+    (1, 1, None),     # Año Nuevo
+    (5, 1, None),     # Día del Trabajo
+    (6, 7, 2022),     # Batalla de Arica y Día de la Bandera
+    (6, 29, None),    # San Pedro y San Pablo
+    (7, 23, 2022),    # Día de la Fuerza Aérea del Perú
+    (7, 28, None),    # Fiestas Patrias
+    (7, 29, None),    # Fiestas Patrias
+    (8, 6, 2022),     # Batalla de Junín
+    (8, 30, None),    # Santa Rosa de Lima
+    (10, 8, None),    # Combate de Angamos
+    (11, 1, None),    # Todos los Santos
+    (12, 8, None),    # Inmaculada Concepción
+    (12, 9, 2022),    # Batalla de Ayacucho
+    (12, 25, None),   # Navidad
+]
+
+
+def calcular_domingo_de_pascua(anio):
+    """Calcula el domingo de Pascua (algoritmo gregoriano anónimo)."""
+    a = anio % 19
+    b, c = divmod(anio, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes, dia = divmod(h + l - 7 * m + 114, 31)
+    return date(anio, mes, dia + 1)
+
+
+def feriados_peru(anio):
+    """Devuelve el conjunto de feriados nacionales de Perú para un año."""
+    feriados = {
+        date(anio, mes, dia)
+        for mes, dia, desde in FERIADOS_FIJOS_PERU
+        if desde is None or anio >= desde
+    }
+    pascua = calcular_domingo_de_pascua(anio)
+    feriados.add(pascua - timedelta(days=3))  # Jueves Santo
+    feriados.add(pascua - timedelta(days=2))  # Viernes Santo
+    return feriados
+
+
+class _Rango(NamedTuple):
+    """Estado inmutable del calendario: se reemplaza entero al ampliarlo."""
+    inicio: date
+    fin: date
+    feriados: frozenset
+    habiles_antes: array
+
+
+class CalendarioLaboral:
+    """
+    Calendario de días hábiles indexado por fecha.
+
+    `habiles_antes[i]` guarda cuántos días hábiles hay desde `inicio` hasta el día
+    anterior a `inicio + i`, de modo que los días hábiles en [desde, hasta] son
+    `habiles_antes[idx(hasta) + 1] - habiles_antes[idx(desde)]`.
+
+    Lo comparten los hilos de cada worker: límites, feriados y arreglo forman un solo _Rango que
+    cada lectura toma una vez y que una ampliación (bajo un lock) sustituye en una sola asignación,
+    así ninguna lectura combina los límites nuevos con el arreglo viejo.
+    """
+
+    def __init__(self, dias_laborables=DIAS_LABORABLES_POR_DEFECTO, incluir_feriados=True,
+                 feriados_adicionales=(), inicio=INICIO_CALENDARIO, fin=None):
+        self.dias_laborables = frozenset(dias_laborables)
+        self.incluir_feriados = incluir_feriados
+        self.feriados_adicionales = frozenset(feriados_adicionales)
+        fin = fin or date(date.today().year + ANIOS_HACIA_ADELANTE, 12, 31)
+        self._ampliacion = threading.Lock()
+        self._rango = self._construir(inicio, fin)
+
+    @property
+    def inicio(self):
+        return self._rango.inicio
+
+    @property
+    def fin(self):
+        return self._rango.fin
+
+    def _construir(self, inicio, fin):
+        feriados = set(self.feriados_adicionales)
+        if self.incluir_feriados:
+            for anio in range(inicio.year, fin.year + 1):
+                feriados |= feriados_peru(anio)
+
+        total_dias = (fin - inicio).days + 1
+        habiles_antes = array('i', [0]) * (total_dias + 1)
+        acumulado = 0
+        fecha = inicio
+        for i in range(total_dias):
+            habiles_antes[i] = acumulado
+            if fecha.weekday() in self.dias_laborables and fecha not in feriados:
+                acumulado += 1
+            fecha += timedelta(days=1)
+        habiles_antes[total_dias] = acumulado
+        return _Rango(inicio, fin, frozenset(feriados), habiles_antes)
+
+    def _cubrir(self, desde, hasta=None):
+        """
+        Devuelve un _Rango que cubre [desde, hasta], ampliando el calendario (al menos un año)
+        si alguna fecha queda fuera.
+        """
+        hasta = hasta or desde
+        rango = self._rango
+        if rango.inicio <= desde and hasta <= rango.fin:
+            return rango
+        with self._ampliacion:
+            rango = self._rango  # Otro hilo pudo ampliarlo mientras se esperaba el lock
+            inicio = rango.inicio if desde >= rango.inicio else date(desde.year - 1, 1, 1)
+            fin = rango.fin if hasta <= rango.fin else date(hasta.year + 1, 12, 31)
+            if (inicio, fin) != (rango.inicio, rango.fin):
+                rango = self._rango = self._construir(inicio, fin)
+            return rango
+
+    def _es_habil(self, rango, fecha):
+        return fecha.weekday() in self.dias_laborables and fecha not in rango.feriados
+
+    def es_habil(self, fecha):
+        """Indica si la fecha es un día laborable que no es feriado."""
+        return self._es_habil(self._cubrir(fecha), fecha)
+
+    def contar(self, desde, hasta):
+        """Cuenta los días hábiles en el rango [desde, hasta], sin tope."""
+        if hasta < desde:
+            return 0
+        rango = self._cubrir(desde, hasta)
+        i = (desde - rango.inicio).days
+        j = (hasta - rango.inicio).days
+        return rango.habiles_antes[j + 1] - rango.habiles_antes[i]
+
+    def filas(self, desde=None, hasta=None):
+        """Genera (fecha, es_habil, habiles_antes, habiles_hasta) para materializar el calendario en SQL."""
+        rango = self._rango
+        desde = desde or rango.inicio
+        hasta = hasta or rango.fin
+        rango = self._cubrir(min(desde, hasta), max(desde, hasta))
+        fecha = desde
+        i = (desde - rango.inicio).days
+        while fecha <= hasta:
+            yield fecha, self._es_habil(rango, fecha), rango.habiles_antes[i], rango.habiles_antes[i + 1]
+            fecha += timedelta(days=1)
+            i += 1
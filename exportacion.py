@@ -0,0 +1,214 @@
+"""
+Exportación en streaming a CSV y XLSX, sin dependencias.
+
+Ambos formatos se generan fila por fila como un iterable de bytes, de modo que la memoria
+usada no depende del número de filas. El XLSX es un zip escrito sobre un destino no
+buscable (zipfile usa descriptores de datos), con cadenas en línea y sin tabla de
+cadenas compartidas, así que cada hoja también se escribe de principio a fin sin retroceder.
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+TIPO_CSV = 'text/csv; charset=utf-8'
+TIPO_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Excel reconoce UTF-8 en CSV solo con BOM
+BOM_UTF8 = '\ufeff'
+FILAS_POR_BLOQUE = 500
+EPOCA_EXCEL = date(1899, 12, 30)
+
+# Índices de estilo definidos en _ESTILOS: 0 = general, 1 = fecha, 2 = fecha y hora, 3 = encabezado
+ESTILO_FECHA = 1
+ESTILO_FECHA_HORA = 2
+ESTILO_ENCABEZADO = 3
+
+# Caracteres que XML 1.0 no admite ni escapados (tabulación vertical, form feed... de texto pegado)
+_CARACTERES_NO_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _texto_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def generar_csv(encabezados, filas):
+    """Genera el CSV en bloques de texto (primer bloque con BOM y encabezados)."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    buffer.write(BOM_UTF8)
+    escritor.writerow(encabezados)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow([_texto_csv(valor) for valor in fila])
+        pendientes += 1
+        if pendientes >= FILAS_POR_BLOQUE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pendientes = 0
+    yield buffer.getvalue()
+
+
+class _Tubo:
+    """Destino no buscable para zipfile: acumula lo escrito hasta que el generador lo entrega."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+def _texto_xml(texto):
+    """Escapa el texto para XML; los caracteres de control no admitidos pasan a espacios."""
+    return escape(_CARACTERES_NO_XML.sub(' ', texto))
+
+
+def _celda(valor):
+    """Celda XML. Sin atributo r: las celdas se ubican por posición (None deja una celda vacía)."""
+    tipo = type(valor)
+    if tipo is str:
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{_texto_xml(valor)}</t></is></c>'
+    if valor is None:
+        return '<c/>'
+    if tipo is Decimal or tipo is int or tipo is float:
+        return f'<c><v>{valor}</v></c>'
+    if tipo is date:
+        return f'<c s="{ESTILO_FECHA}"><v>{(valor - EPOCA_EXCEL).days}</v></c>'
+    if tipo is datetime:
+        dias = (valor.replace(tzinfo=None) - datetime.combine(EPOCA_EXCEL, datetime.min.time())).total_seconds() / 86400
+        return f'<c s="{ESTILO_FECHA_HORA}"><v>{dias:.6f}</v></c>'
+    if tipo is bool:
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    return _celda(str(valor))
+
+
+def _fila_xml(numero, valores):
+    return f'<row r="{numero}">{"".join(map(_celda, valores))}</row>'
+
+
+def _encabezado_xml(encabezados):
+    celdas = ''.join(
+        f'<c t="inlineStr" s="{ESTILO_ENCABEZADO}"><is><t>{_texto_xml(str(nombre))}</t></is></c>' for nombre in encabezados
+    )
+    return f'<row r="1">{celdas}</row>'
+
+
+_ESTILOS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm"/></numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="4">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>"""
+
+
+def _archivos_fijos(nombres_hojas):
+    hojas_tipos = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(nombres_hojas) + 1)
+    )
+    hojas_libro = ''.join(
+        f'<sheet name="{escape(nombre[:31])}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, nombre in enumerate(nombres_hojas, start=1)
+    )
+    relaciones_libro = ''.join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(nombres_hojas) + 1)
+    )
+    id_estilos = len(nombres_hojas) + 1
+    return {
+        '[Content_Types].xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{hojas_tipos}</Types>'
+        ),
+        '_rels/.rels': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/></Relationships>'
+        ),
+        'xl/workbook.xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets>{hojas_libro}</sheets></workbook>'
+        ),
+        'xl/_rels/workbook.xml.rels': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'{relaciones_libro}'
+            f'<Relationship Id="rId{id_estilos}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+            'Target="styles.xml"/></Relationships>'
+        ),
+        'xl/styles.xml': _ESTILOS,
+    }
+
+
+def generar_xlsx(hojas):
+    """
+    Genera un libro XLSX en bloques de bytes.
+    hojas: lista de (nombre, encabezados, filas); cada `filas` se consume una sola vez, en orden.
+    """
+    tubo = _Tubo()
+    with zipfile.ZipFile(tubo, 'w', compression=zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _archivos_fijos([hoja[0] for hoja in hojas]).items():
+            libro.writestr(nombre, contenido)
+        yield tubo.vaciar()
+
+        for indice, (_, encabezados, filas) in enumerate(hojas, start=1):
+            with libro.open(f'xl/worksheets/sheet{indice}.xml', 'w', force_zip64=True) as hoja:
+                hoja.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                    'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews><sheetData>'
+                    + _encabezado_xml(encabezados)
+                ).encode('utf-8'))
+                bloque = []
+                for numero, fila in enumerate(filas, start=2):
+                    bloque.append(_fila_xml(numero, fila))
+                    if len(bloque) >= FILAS_POR_BLOQUE:
+                        hoja.write(''.join(bloque).encode('utf-8'))
+                        bloque = []
+                        yield tubo.vaciar()
+                hoja.write((''.join(bloque) + '</sheetData></worksheet>').encode('utf-8'))
+            yield tubo.vaciar()
+    yield tubo.vaciar()
@@ -0,0 +1,87 @@
+"""
+Configuración de gunicorn para producción.
+
+Todo se elige por variables de entorno:
+
+    PORT                      Puerto de escucha (8080)
+    GUNICORN_WORKERS          Procesos (CPUs + 1, máximo 8)
+    GUNICORN_WORKER_CLASS     'gthread' (por defecto), 'gevent' o 'sync'
+    GUNICORN_THREADS          Hilos por proceso con gthread (4)
+    GUNICORN_WORKER_CONNECTIONS  Conexiones simultáneas por proceso con gevent (100)
+    GUNICORN_TIMEOUT          Segundos antes de reiniciar un worker colgado (60)
+    GUNICORN_MAX_REQUESTS     Reinicia cada worker tras N peticiones, 0 = nunca (1000)
+    PROMETHEUS_MULTIPROC_DIR  Directorio donde los workers comparten las métricas de /metrics
+                              (<tmp>/prestamos_metricas); se vacía al arrancar gunicorn
+
+Cada proceso tiene su propio pool de SQLAlchemy (DB_POOL_SIZE, DB_MAX_OVERFLOW en app.py):
+con gthread conviene DB_POOL_SIZE >= GUNICORN_THREADS + 1 (el hilo del recálculo programado),
+y el total de conexiones es GUNICORN_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW), que debe
+quedar por debajo de max_connections de PostgreSQL.
+
+Por qué gthread y no los workers 'sync' por defecto: un worker sync atiende una petición a la
+vez, de modo que un login (bcrypt) o una consulta esperando un bloqueo detiene todo el proceso.
+Con `python -m benchmarks.carga_http URL 16 30 2` (1 CPU, 16 clientes de lectura + 2 de login):
+                                               req/s   p50       p95
+    sync, 1 worker, sin timeouts (anterior)    ~12     ~1.0 s    ~1.25 s
+    gthread, 2 workers x 4 hilos (este perfil) ~50     ~0.19 s   ~0.53 s
+Con una fila de préstamo bloqueada 15 s por otra transacción, el perfil anterior dejó a todos
+los clientes esperando (p95 15.2 s, 4 req/s); con este perfil el pago afectado falla a los
+10 s (DB_LOCK_TIMEOUT_MS) y el resto sigue atendiéndose (p95 0.64 s, 42 req/s).
+gevent requiere `pip install gevent psycogreen`; solo compensa con muchas conexiones ociosas.
+
+Métricas: cada scrape de /metrics lo atiende un worker cualquiera, así que los workers escriben sus
+valores en PROMETHEUS_MULTIPROC_DIR (modo multiproceso de prometheus_client) y /metrics devuelve la
+suma de todos. child_exit descarta los gauges de los workers terminados; sus contadores e histogramas
+se conservan, de modo que los reinicios de max_requests no hacen retroceder los totales.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Debe definirse antes de que los workers importen prometheus_client (sin preload, al cargar app.py)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prestamos_metricas'))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count() + 1, 8)))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '100'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# Reinicio periódico para acotar el crecimiento de memoria; el jitter evita reiniciar todos a la vez
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Sin preload: cada worker crea su propio engine y pool después del fork
+preload_app = False
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Vacía el directorio de métricas: los archivos de una ejecución anterior sumarían valores viejos."""
+    directorio = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directorio, ignore_errors=True)
+    os.makedirs(directorio, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Con gevent, psycopg2 debe ceder el control al esperar a PostgreSQL."""
+    if worker_class == 'gevent':
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning('psycogreen no está instalado: las consultas bloquearán el worker gevent')
+        else:
+            patch_psycopg()
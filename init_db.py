@@ -1,127 +1,83 @@
-from app import app, db, bcrypt, Usuario, Prestamo, Cliente, Cuota
+import os
+
+# Las migraciones (índices, conciliación) pueden tardar más que el límite por sentencia de la API
+os.environ.setdefault('DB_STATEMENT_TIMEOUT_MS', '0')
+
+from app import (
+    app, db, bcrypt, Usuario, Prestamo, Cliente, Cuota, sincronizar_calendario_sql, crear_indices_busqueda,
+    conciliar_totales_pagos, registrar_cambio_cartera, actualizar_por_lotes, SQL_CLASIFICAR_PUNTUALIDAD
+)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import text, inspect
 from decimal import Decimal
 import sys
+import migraciones
 
-def agregar_columnas_faltantes():
-    """
-    Agrega las nuevas columnas necesarias para el sistema mejorado.
-    """
-    with app.app_context():
-        try:
-            inspector = inspect(db.engine)
 
-            # Verificar columnas de clientes
-            clientes_columns = [col['name'] for col in inspector.get_columns('clientes')]
-            
-            nuevas_columnas_clientes = []
-            if 'trabajador_id' not in clientes_columns:
-                nuevas_columnas_clientes.append('ADD COLUMN trabajador_id INTEGER REFERENCES usuarios(id)')
-            
-            if nuevas_columnas_clientes:
-                print(f"Agregando {len(nuevas_columnas_clientes)} columnas a la tabla clientes...")
-                with db.engine.connect() as connection:
-                    connection.execute(text(f"ALTER TABLE clientes {', '.join(nuevas_columnas_clientes)}"))
-                    connection.commit()
-                print("Columnas agregadas exitosamente a clientes.")
-            
-            # Verificar columnas de prestamos
-            prestamos_columns = [col['name'] for col in inspector.get_columns('prestamos')]
-            
-            nuevas_columnas_prestamos = []
-            
-            if 'fecha_pago_completo' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN fecha_pago_completo DATE')
-                
-            if 'monto_principal' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN monto_principal NUMERIC(10,2)')
-                
-            if 'monto_total' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN monto_total NUMERIC(10,2)')
-                
-            if 'tipo_prestamo' not in prestamos_columns:
-                nuevas_columnas_prestamos.append("ADD COLUMN tipo_prestamo VARCHAR(10) DEFAULT 'CR'")
-                
-            if 'tipo_frecuencia' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN tipo_frecuencia VARCHAR(50)')
-                
-            if 'cuota_diaria' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN cuota_diaria NUMERIC(10,2) DEFAULT 0.0')
-                
-            if 'prestamo_refinanciado_id' not in prestamos_columns:
-                nuevas_columnas_prestamos.append('ADD COLUMN prestamo_refinanciado_id INTEGER REFERENCES prestamos(id)')
-            
+CONDICION_SIN_FORMATO_NUEVO = "monto_principal IS NULL OR monto_total IS NULL"
 
-            if nuevas_columnas_prestamos:
-                print(f"Agregando {len(nuevas_columnas_prestamos)} columnas a la tabla prestamos...")
-                with db.engine.connect() as connection:  # Usar conexión explícita
-                    connection.execute(text(f"ALTER TABLE prestamos {', '.join(nuevas_columnas_prestamos)}"))
-                    connection.commit()  # Confirmar los cambios
-                print("Columnas agregadas exitosamente a prestamos.")
-            
-            # Verificar columnas de cuotas
-            if 'cuotas' in inspector.get_table_names():
-                cuotas_columns = [col['name'] for col in inspector.get_columns('cuotas')]
-                
-                if 'estado_pago' not in cuotas_columns:
-                    print("Agregando columna estado_pago a la tabla cuotas...")
-                    with db.engine.connect() as connection:
-                        connection.execute(text("ALTER TABLE cuotas ADD COLUMN estado_pago VARCHAR(20) DEFAULT 'a_tiempo'"))
-                        connection.commit()
-                    print("Columna estado_pago agregada exitosamente.")
-            
-            # Migrar columnas antiguas si existen
-            if 'tipo' in prestamos_columns and 'tipo_frecuencia' in prestamos_columns:
-                print("Migrando datos de columna 'tipo' a 'tipo_frecuencia'...")
-                with db.engine.connect() as connection:
-                    connection.execute(text("UPDATE prestamos SET tipo_frecuencia = tipo WHERE tipo IS NOT NULL AND tipo_frecuencia IS NULL"))
-                    connection.execute(text("ALTER TABLE prestamos DROP COLUMN IF EXISTS tipo"))
-                    connection.commit()
-                
-            if 'cuota' in prestamos_columns and 'cuota_diaria' in prestamos_columns:
-                print("Migrando datos de columna 'cuota' a 'cuota_diaria'...")
-                with db.engine.connect() as connection:
-                    connection.execute(text("UPDATE prestamos SET cuota_diaria = cuota WHERE cuota IS NOT NULL AND cuota_diaria = 0"))
-                    connection.execute(text("ALTER TABLE prestamos DROP COLUMN IF EXISTS cuota"))
-                    connection.commit()
-                
-        except Exception as e:
-            print(f"Error agregando columnas faltantes: {e}")
-            db.session.rollback()
-            return False
-        return True
+# {monto}: la columna antigua 'monto' si existe, o NULL. Sin capital conocido queda en 0.
+SQL_MIGRAR_PRESTAMOS = """
+    UPDATE prestamos
+    SET monto_principal = COALESCE(monto_principal, {monto}, 0),
+        monto_total = COALESCE(
+            monto_total, COALESCE(monto_principal, {monto}, 0) * (1 + COALESCE(interes, 0) / 100)
+        ),
+        tipo_prestamo = COALESCE(NULLIF(tipo_prestamo, ''), 'CR'),
+        tipo_frecuencia = COALESCE(NULLIF(tipo_frecuencia, ''), 'Diario'),
+        cuota_diaria = COALESCE(cuota_diaria, 0),
+        saldo = COALESCE(
+            saldo, monto_total, COALESCE(monto_principal, {monto}, 0) * (1 + COALESCE(interes, 0) / 100)
+        )
+    WHERE id > :desde AND id <= :hasta AND (""" + CONDICION_SIN_FORMATO_NUEVO + """)
+"""
+
+# Saldo = monto total - suma de cuotas (nunca negativo); un préstamo activo/vencido sin saldo pasa
+# a pagado y uno pagado con saldo vuelve a activo. Solo escribe las filas que cambian.
+SQL_ACTUALIZAR_SALDOS_Y_ESTADOS = text("""
+    WITH pagado AS (
+        SELECT prestamo_id, SUM(monto) AS total
+        FROM cuotas
+        WHERE prestamo_id > :desde AND prestamo_id <= :hasta
+        GROUP BY prestamo_id
+    ),
+    saldos AS (
+        SELECT p.id, p.estado, GREATEST(0, p.monto_total - COALESCE(pg.total, 0)) AS saldo
+        FROM prestamos p
+        LEFT JOIN pagado pg ON pg.prestamo_id = p.id
+        WHERE p.id > :desde AND p.id <= :hasta AND p.monto_total IS NOT NULL
+    ),
+    nuevo AS (
+        SELECT s.id,
+               s.saldo,
+               CASE
+                   WHEN s.saldo <= 0 AND s.estado IN ('activo', 'vencido') THEN 'pagado'
+                   WHEN s.estado = 'pagado' AND s.saldo > 0 THEN 'activo'
+                   ELSE s.estado
+               END AS estado
+        FROM saldos s
+    )
+    UPDATE prestamos p
+    SET saldo = n.saldo,
+        estado = n.estado
+    FROM nuevo n
+    WHERE p.id = n.id AND (p.saldo, p.estado) IS DISTINCT FROM (n.saldo, n.estado)
+""")
 
 
-def crear_tabla_cuotas():
+def aplicar_migraciones_del_esquema():
     """
-    Crea la tabla de cuotas si no existe.
+    Aplica las revisiones pendientes de migraciones/ (columnas del sistema de cuotas e índices).
+    Equivale a `flask --app app migrar`.
     """
     with app.app_context():
         try:
-            inspector = inspect(db.engine)
-            tables = inspector.get_table_names()
-            
-            if 'cuotas' not in tables:
-                print("Creando tabla de cuotas...")
-                db.engine.execute(text("""
-                    CREATE TABLE cuotas (
-                        id SERIAL PRIMARY KEY,
-                        prestamo_id INTEGER NOT NULL REFERENCES prestamos(id) ON DELETE CASCADE,
-                        monto NUMERIC(10,2) NOT NULL,
-                        fecha_pago DATE NOT NULL DEFAULT CURRENT_DATE,
-                        descripcion VARCHAR(200),
-                        estado_pago VARCHAR(20) DEFAULT 'a_tiempo'
-                    )
-                """))
-                print("Tabla de cuotas creada exitosamente.")
-            else:
-                print("La tabla de cuotas ya existe.")
-                
+            aplicadas = migraciones.actualizar(db.engine)
+            print(f"Revisiones aplicadas: {', '.join(aplicadas)}." if aplicadas else "El esquema ya está al día.")
+            return True
         except Exception as e:
-            print(f"Error creando tabla de cuotas: {e}")
+            print(f"Error aplicando las migraciones del esquema: {e}")
             return False
-        return True
 
 
 def migrar_prestamos_al_nuevo_formato():
@@ -132,81 +88,21 @@ def migrar_prestamos_al_nuevo_formato():
         try:
             print("Migrando préstamos al nuevo formato...")
             
-            # Verificar si la columna 'monto' existe
-            inspector = inspect(db.engine)
-            prestamos_columns = [col['name'] for col in inspector.get_columns('prestamos')]
-            has_monto = 'monto' in prestamos_columns
-            
-            # Ajustar la consulta según las columnas disponibles
-            if has_monto:
-                prestamos_query = text("""
-                    SELECT id, monto, interes, monto_principal, monto_total, tipo_prestamo, tipo_frecuencia, cuota_diaria
-                    FROM prestamos 
-                    WHERE monto_principal IS NULL OR monto_total IS NULL
-                """)
-            else:
-                prestamos_query = text("""
-                    SELECT id, monto_principal AS monto, interes, monto_principal, monto_total, tipo_prestamo, tipo_frecuencia, cuota_diaria
-                    FROM prestamos 
-                    WHERE monto_principal IS NULL OR monto_total IS NULL
-                """)
-            
-            with db.engine.connect() as connection:
-                result = connection.execute(prestamos_query)
-                prestamos_a_migrar = result.fetchall()
+            # Las bases muy antiguas guardaban el capital en la columna 'monto'
+            columnas = [col['name'] for col in inspect(db.engine).get_columns('prestamos')]
+            sentencia = SQL_MIGRAR_PRESTAMOS.format(monto='monto' if 'monto' in columnas else 'NULL')
             
-            if not prestamos_a_migrar:
+            pendientes = db.session.execute(text(
+                f"SELECT COUNT(*) FROM prestamos WHERE {CONDICION_SIN_FORMATO_NUEVO}"
+            )).scalar()
+            db.session.commit()
+            if not pendientes:
                 print("No hay préstamos que necesiten migración.")
                 return True
             
-            print(f"Migrando {len(prestamos_a_migrar)} préstamos...")
-            
-            for prestamo in prestamos_a_migrar:
-                prestamo_id = prestamo[0]
-                monto = Decimal(str(prestamo[1])) if has_monto and prestamo[1] else Decimal('0')
-                interes = Decimal(str(prestamo[2])) if prestamo[2] else Decimal('0')
-                
-                # Calcular monto principal y total
-                if prestamo[3] is None:
-                    monto_principal = monto if has_monto else Decimal('0')
-                else:
-                    monto_principal = Decimal(str(prestamo[3]))
-                
-                if prestamo[4] is None:
-                    interes_monto = monto_principal * (interes / 100)
-                    monto_total = monto_principal + interes_monto
-                else:
-                    monto_total = Decimal(str(prestamo[4]))
-                
-                # Valores por defecto
-                tipo_prestamo = prestamo[5] if prestamo[5] else 'CR'
-                tipo_frecuencia = prestamo[6] if prestamo[6] else 'Diario'
-                cuota_diaria = Decimal(str(prestamo[7])) if prestamo[7] else Decimal('0')
-                
-                # Actualizar el préstamo
-                update_query = text("""
-                    UPDATE prestamos 
-                    SET monto_principal = :monto_principal,
-                        monto_total = :monto_total,
-                        tipo_prestamo = :tipo_prestamo,
-                        tipo_frecuencia = :tipo_frecuencia,
-                        cuota_diaria = :cuota_diaria,
-                        saldo = COALESCE(saldo, :monto_total)
-                    WHERE id = :prestamo_id
-                """)
-                
-                with db.engine.connect() as connection:
-                    connection.execute(update_query, {
-                        'prestamo_id': prestamo_id,
-                        'monto_principal': monto_principal,
-                        'monto_total': monto_total,
-                        'tipo_prestamo': tipo_prestamo,
-                        'tipo_frecuencia': tipo_frecuencia,
-                        'cuota_diaria': cuota_diaria
-                    })
-                    connection.commit()
-            
-            print(f"Migración de {len(prestamos_a_migrar)} préstamos completada.")
+            print(f"Migrando {pendientes} préstamos...")
+            migrados = actualizar_por_lotes("Migración al nuevo formato", text(sentencia))
+            print(f"Migración de {migrados} préstamos completada.")
             
         except Exception as e:
             print(f"Error migrando préstamos: {e}")
@@ -262,58 +158,8 @@ def actualizar_saldos_y_estados():
     with app.app_context():
         try:
             print("Actualizando saldos y estados de préstamos...")
-            
-            prestamos_query = text("""
-                SELECT id, monto_total, estado 
-                FROM prestamos 
-                WHERE monto_total IS NOT NULL
-            """)
-            
-            with db.engine.connect() as connection:
-                result = connection.execute(prestamos_query)
-                prestamos = result.fetchall()
-            
-            for prestamo in prestamos:
-                prestamo_id = prestamo[0]
-                monto_total = Decimal(str(prestamo[1]))
-                estado_actual = prestamo[2]
-                
-                cuotas_query = text("""
-                    SELECT COALESCE(SUM(monto), 0) 
-                    FROM cuotas 
-                    WHERE prestamo_id = :prestamo_id
-                """)
-                
-                with db.engine.connect() as connection:
-                    result_cuotas = connection.execute(cuotas_query, {'prestamo_id': prestamo_id})
-                    row = result_cuotas.fetchone()
-                    total_pagado = Decimal(str(row[0])) if row and row[0] is not None else Decimal('0')
-                
-                nuevo_saldo = max(Decimal('0'), monto_total - total_pagado)
-                
-                if nuevo_saldo <= 0 and estado_actual in ['activo', 'vencido']:
-                    nuevo_estado = 'pagado'
-                elif estado_actual == 'pagado' and nuevo_saldo > 0:
-                    nuevo_estado = 'activo'
-                else:
-                    nuevo_estado = estado_actual
-                
-                update_query = text("""
-                    UPDATE prestamos 
-                    SET saldo = :saldo, 
-                        estado = :estado
-                    WHERE id = :prestamo_id
-                """)
-                
-                with db.engine.connect() as connection:
-                    connection.execute(update_query, {
-                        'prestamo_id': prestamo_id,
-                        'saldo': nuevo_saldo,
-                        'estado': nuevo_estado
-                    })
-                    connection.commit()
-            
-            print(f"Saldos y estados actualizados para {len(prestamos)} préstamos.")
+            actualizados = actualizar_por_lotes("Saldos y estados", SQL_ACTUALIZAR_SALDOS_Y_ESTADOS)
+            print(f"Saldos y estados actualizados para {actualizados} préstamos.")
             
         except Exception as e:
             print(f"Error actualizando saldos: {e}")
@@ -321,6 +167,75 @@ def actualizar_saldos_y_estados():
             return False
         return True
 
+def poblar_calendario_laboral():
+    """
+    Materializa el calendario laboral (días hábiles y feriados) en la base de datos.
+    """
+    with app.app_context():
+        try:
+            print("Poblando calendario laboral...")
+            total = sincronizar_calendario_sql()
+            db.session.commit()
+            print(f"Calendario laboral con {total} días.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error poblando calendario laboral: {e}")
+            return False
+        return True
+
+
+def crear_indices_de_busqueda():
+    """
+    Instala pg_trgm y unaccent y crea los índices de búsqueda de clientes (nombre y DNI).
+    Si las extensiones no están disponibles, la búsqueda sigue funcionando sin índice.
+    """
+    with app.app_context():
+        try:
+            print("Creando índices de búsqueda de clientes...")
+            crear_indices_busqueda()
+            db.session.commit()
+            print("Índices de búsqueda creados.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ No se pudieron crear los índices de búsqueda (¿faltan pg_trgm/unaccent?): {e}")
+            print("La búsqueda de clientes usará coincidencia parcial sin índice.")
+        return True
+
+
+def conciliar_totales_de_pagos():
+    """
+    Calcula total_pagado, num_cuotas y ultima_fecha_pago de cada préstamo a partir de sus cuotas.
+    """
+    with app.app_context():
+        try:
+            print("Conciliando totales de pagos con las cuotas...")
+            corregidos = conciliar_totales_pagos(corregir=True)
+            db.session.commit()
+            print(f"Totales actualizados en {len(corregidos)} préstamos.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error conciliando totales de pagos: {e}")
+            return False
+        return True
+
+
+def clasificar_puntualidad_de_cuotas():
+    """
+    Vuelve a calcular si cada cuota se pagó a tiempo, con retraso o anticipada, con las sumas
+    acumuladas de cada préstamo. Equivale a `flask --app app clasificar-puntualidad`.
+    """
+    with app.app_context():
+        try:
+            print("Clasificando la puntualidad de las cuotas...")
+            actualizadas = actualizar_por_lotes("Puntualidad", SQL_CLASIFICAR_PUNTUALIDAD)
+            print(f"Cuotas reclasificadas: {actualizadas}.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error clasificando la puntualidad: {e}")
+            return False
+        return True
+
+
 def crear_usuarios_por_defecto():
     """
     Crea los usuarios por defecto del sistema.
@@ -557,14 +472,19 @@ def ejecutar_migracion_completa():
     
     pasos = [
         ("Creando tablas de la base de datos", lambda: db.create_all()),
-        ("Creando tabla de cuotas", crear_tabla_cuotas),
-        ("Agregando columnas faltantes", agregar_columnas_faltantes),
+        ("Aplicando migraciones del esquema", aplicar_migraciones_del_esquema),
         ("Migrando préstamos al nuevo formato", migrar_prestamos_al_nuevo_formato),
         ("Migrando pagos a cuotas", migrar_pagos_a_cuotas),
         ("Actualizando saldos y estados", actualizar_saldos_y_estados),
+        ("Poblando calendario laboral", poblar_calendario_laboral),
+        ("Creando índices de búsqueda", crear_indices_de_busqueda),
         ("Creando usuarios por defecto", crear_usuarios_por_defecto),
         ("Verificando integridad de datos", verificar_integridad_datos),
-        ("Generando datos de prueba", generar_datos_de_prueba)
+        ("Generando datos de prueba", generar_datos_de_prueba),
+        ("Conciliando totales de pagos", conciliar_totales_de_pagos),
+        ("Clasificando la puntualidad de las cuotas", clasificar_puntualidad_de_cuotas),
+        # Los datos cambiaron fuera de la API: invalida los ETag que tengan los navegadores
+        ("Avanzando la versión de la cartera", registrar_cambio_cartera)
     ]
     
     errores = []
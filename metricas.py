@@ -0,0 +1,85 @@
+"""
+Registro de métricas en formato de texto de Prometheus sobre prometheus_client.
+
+Contadores, gauges e histogramas con etiquetas por nombre (metrica.inc(endpoint=..., metodo=...)).
+Con gunicorn, cada scrape lo atiende un worker cualquiera: si PROMETHEUS_MULTIPROC_DIR está definido
+(gunicorn.conf.py lo define y lo limpia al arrancar) cada proceso escribe sus valores en archivos de ese
+directorio y /metrics expone la suma de todos los workers, vivos y terminados, de modo que los
+contadores no vuelven a cero cuando max_requests reinicia un worker. Sin esa variable (flask run,
+comandos de la CLI) el registro es el del propio proceso.
+"""
+import os
+
+import prometheus_client
+from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+
+# Buckets por defecto de Prometheus, en segundos
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_SENTENCIAS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+TIPO_CONTENIDO = prometheus_client.CONTENT_TYPE_LATEST
+
+# Las series *_created no aportan nada aquí y duplican el tamaño de la salida
+prometheus_client.disable_created_metrics()
+
+
+def modo_multiproceso():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+class _Metrica:
+    def __init__(self, metrica):
+        self._metrica = metrica
+
+    def _serie(self, etiquetas):
+        return self._metrica.labels(**etiquetas) if etiquetas else self._metrica
+
+
+class Contador(_Metrica):
+    def inc(self, cantidad=1, **etiquetas):
+        self._serie(etiquetas).inc(cantidad)
+
+
+class Gauge(_Metrica):
+    def set(self, valor, **etiquetas):
+        self._serie(etiquetas).set(valor)
+
+
+class Histograma(_Metrica):
+    def observe(self, valor, **etiquetas):
+        self._serie(etiquetas).observe(valor)
+
+
+class RegistroMetricas:
+    """Conjunto de métricas de la aplicación; `exponer()` devuelve el texto para /metrics."""
+
+    def __init__(self):
+        self._registro = CollectorRegistry(auto_describe=True)
+        self._recolectores = []
+
+    def contador(self, nombre, descripcion, etiquetas=()):
+        return Contador(prometheus_client.Counter(nombre, descripcion, etiquetas, registry=self._registro))
+
+    def gauge(self, nombre, descripcion, etiquetas=(), modo='livesum'):
+        """
+        `modo` dice cómo se combinan los valores de los workers: 'livesum' suma los procesos vivos
+        (conexiones del pool); 'mostrecent' toma el último valor escrito por cualquiera (trabajos programados).
+        """
+        return Gauge(prometheus_client.Gauge(nombre, descripcion, etiquetas, registry=self._registro, multiprocess_mode=modo))
+
+    def histograma(self, nombre, descripcion, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        return Histograma(prometheus_client.Histogram(nombre, descripcion, etiquetas, registry=self._registro, buckets=buckets))
+
+    def al_exponer(self, funcion):
+        """Registra una función que actualiza gauges justo antes de cada scrape (decorador)."""
+        self._recolectores.append(funcion)
+        return funcion
+
+    def exponer(self):
+        for recolector in self._recolectores:
+            recolector()
+        registro = self._registro
+        if modo_multiproceso():
+            registro = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro)
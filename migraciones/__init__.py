@@ -0,0 +1,174 @@
+"""
+Migraciones versionadas del esquema, sin dependencias.
+
+Cada revisión es un módulo vNNNN_descripcion.py de este paquete con:
+
+    DESCRIPCION            texto corto
+    TRANSACCIONAL          False si usa sentencias que no pueden ir en una transacción
+                           (CREATE INDEX CONCURRENTLY); por defecto True
+    actualizar(conexion)   aplica la revisión
+    revertir(conexion)     la deshace
+
+Las revisiones aplicadas quedan registradas en la tabla esquema_revisiones. Una revisión
+transaccional se aplica y se registra en la misma transacción; una no transaccional debe
+ser idempotente, porque si falla a la mitad se vuelve a ejecutar completa. Un advisory lock
+evita que dos procesos (por ejemplo dos contenedores arrancando) migren a la vez.
+
+Uso (ver los comandos en app.py):
+    flask --app app migrar                    # aplica las revisiones pendientes
+    flask --app app migrar --hasta 0001
+    flask --app app revertir-migracion 0001   # deja la base en la revisión 0001 ('base' = ninguna)
+    flask --app app marcar-migracion 0002     # registra sin ejecutar
+    flask --app app estado-migraciones
+"""
+import importlib
+import pkgutil
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+TABLA_REVISIONES = 'esquema_revisiones'
+CLAVE_BLOQUEO_MIGRACIONES = 720003
+BASE = 'base'
+
+
+def revisiones():
+    """Lista ordenada de (revisión, módulo) de todas las revisiones del paquete."""
+    encontradas = []
+    for modulo in pkgutil.iter_modules(__path__):
+        if modulo.name[:1] == 'v' and modulo.name[1:5].isdigit():
+            encontradas.append((modulo.name[1:5], importlib.import_module(f'{__name__}.{modulo.name}')))
+    return sorted(encontradas, key=lambda revision: revision[0])
+
+
+def _validar(revision):
+    if revision != BASE and revision not in dict(revisiones()):
+        raise ValueError(f'Revisión desconocida: {revision}')
+
+
+@contextmanager
+def _conexion_exclusiva(engine):
+    """Conexión con el advisory lock de migraciones y sin límite de tiempo por sentencia."""
+    with engine.connect() as conexion:
+        conexion.execute(text('SELECT pg_advisory_lock(:clave)'), {'clave': CLAVE_BLOQUEO_MIGRACIONES})
+        conexion.execute(text('SET statement_timeout = 0'))  # Crear un índice puede tardar minutos
+        conexion.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {TABLA_REVISIONES} (
+                revision VARCHAR(10) PRIMARY KEY,
+                descripcion VARCHAR(200) NOT NULL,
+                aplicada_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            )
+        """))
+        conexion.commit()
+        try:
+            yield conexion
+        finally:
+            conexion.rollback()
+            conexion.execute(text('SELECT pg_advisory_unlock(:clave)'), {'clave': CLAVE_BLOQUEO_MIGRACIONES})
+            conexion.commit()
+
+
+def _aplicadas(conexion):
+    filas = conexion.execute(text(f'SELECT revision, aplicada_en FROM {TABLA_REVISIONES}')).fetchall()
+    conexion.commit()
+    return dict(filas)
+
+
+def _registrar(conexion, revision, modulo):
+    conexion.execute(
+        text(f'INSERT INTO {TABLA_REVISIONES} (revision, descripcion) VALUES (:revision, :descripcion)'),
+        {'revision': revision, 'descripcion': modulo.DESCRIPCION}
+    )
+
+
+def _desregistrar(conexion, revision):
+    conexion.execute(text(f'DELETE FROM {TABLA_REVISIONES} WHERE revision = :revision'), {'revision': revision})
+
+
+def _ejecutar(conexion, paso, registro, transaccional):
+    """Ejecuta un paso de migración y su registro: juntos si es transaccional, el registro al final si no."""
+    if transaccional:
+        with conexion.begin():
+            paso(conexion)
+            registro(conexion)
+        return
+    conexion.execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        paso(conexion)
+        conexion.commit()
+    finally:
+        conexion.execution_options(isolation_level=conexion.default_isolation_level)
+    with conexion.begin():
+        registro(conexion)
+
+
+def actualizar(engine, hasta=None):
+    """Aplica en orden las revisiones pendientes (hasta la indicada, inclusive). Devuelve las aplicadas."""
+    if hasta:
+        _validar(hasta)
+    aplicadas_ahora = []
+    with _conexion_exclusiva(engine) as conexion:
+        aplicadas = _aplicadas(conexion)
+        for revision, modulo in revisiones():
+            if hasta and revision > hasta:
+                break
+            if revision in aplicadas:
+                continue
+            print(f'Aplicando {revision}: {modulo.DESCRIPCION}...')
+            _ejecutar(conexion, modulo.actualizar, lambda c: _registrar(c, revision, modulo),
+                      getattr(modulo, 'TRANSACCIONAL', True))
+            aplicadas_ahora.append(revision)
+    return aplicadas_ahora
+
+
+def revertir(engine, hasta):
+    """Revierte, de la más nueva a la más vieja, las revisiones posteriores a `hasta` ('base' = todas)."""
+    _validar(hasta)
+    revertidas = []
+    with _conexion_exclusiva(engine) as conexion:
+        aplicadas = _aplicadas(conexion)
+        for revision, modulo in reversed(revisiones()):
+            if hasta != BASE and revision <= hasta:
+                break
+            if revision not in aplicadas:
+                continue
+            print(f'Revirtiendo {revision}: {modulo.DESCRIPCION}...')
+            _ejecutar(conexion, modulo.revertir, lambda c: _desregistrar(c, revision),
+                      getattr(modulo, 'TRANSACCIONAL', True))
+            revertidas.append(revision)
+    return revertidas
+
+
+def marcar(engine, revision):
+    """Registra la base como migrada exactamente hasta `revision` sin ejecutar nada."""
+    _validar(revision)
+    with _conexion_exclusiva(engine) as conexion, conexion.begin():
+        conexion.execute(text(f'DELETE FROM {TABLA_REVISIONES}'))
+        for actual, modulo in revisiones():
+            if revision == BASE or actual > revision:
+                break
+            _registrar(conexion, actual, modulo)
+
+
+def estado(engine):
+    """Lista de (revisión, descripción, fecha de aplicación o None si está pendiente)."""
+    with _conexion_exclusiva(engine) as conexion:
+        aplicadas = _aplicadas(conexion)
+    return [(revision, modulo.DESCRIPCION, aplicadas.get(revision)) for revision, modulo in revisiones()]
+
+
+def crear_indice_concurrente(conexion, nombre, definicion):
+    """
+    CREATE INDEX CONCURRENTLY idempotente (requiere una revisión no transaccional). Si un intento
+    anterior se interrumpió, PostgreSQL deja el índice marcado como inválido: se borra y se rehace.
+    """
+    invalido = conexion.execute(text("""
+        SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :nombre
+    """), {'nombre': nombre}).scalar()
+    if invalido:
+        conexion.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {nombre}'))
+    conexion.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON {definicion}'))
+
+
+def eliminar_indice_concurrente(conexion, nombre):
+    conexion.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {nombre}'))
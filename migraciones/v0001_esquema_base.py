@@ -0,0 +1,61 @@
+"""
+Columnas del sistema de cuotas sobre el esquema original (antes agregar_columnas_faltantes() y
+crear_tabla_cuotas() de init_db.py). Cada sentencia es idempotente: en una base creada con
+db.create_all() no cambia nada.
+"""
+from sqlalchemy import text
+
+DESCRIPCION = 'Esquema base: tabla de cuotas y columnas del sistema de cuotas'
+
+SENTENCIAS = [
+    """
+    CREATE TABLE IF NOT EXISTS cuotas (
+        id SERIAL PRIMARY KEY,
+        prestamo_id INTEGER NOT NULL REFERENCES prestamos(id) ON DELETE CASCADE,
+        monto NUMERIC(10,2) NOT NULL,
+        fecha_pago DATE NOT NULL DEFAULT CURRENT_DATE,
+        descripcion VARCHAR(200),
+        estado_pago VARCHAR(20) DEFAULT 'a_tiempo'
+    )
+    """,
+    "ALTER TABLE clientes ADD COLUMN IF NOT EXISTS trabajador_id INTEGER REFERENCES usuarios(id)",
+    """
+    ALTER TABLE prestamos
+        ADD COLUMN IF NOT EXISTS fecha_pago_completo DATE,
+        ADD COLUMN IF NOT EXISTS monto_principal NUMERIC(10,2),
+        ADD COLUMN IF NOT EXISTS monto_total NUMERIC(10,2),
+        ADD COLUMN IF NOT EXISTS tipo_prestamo VARCHAR(10) DEFAULT 'CR',
+        ADD COLUMN IF NOT EXISTS tipo_frecuencia VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS cuota_diaria NUMERIC(10,2) DEFAULT 0.0,
+        ADD COLUMN IF NOT EXISTS prestamo_refinanciado_id INTEGER REFERENCES prestamos(id),
+        ADD COLUMN IF NOT EXISTS total_pagado NUMERIC(10,2) NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS num_cuotas INTEGER NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS ultima_fecha_pago DATE
+    """,
+    "ALTER TABLE cuotas ADD COLUMN IF NOT EXISTS estado_pago VARCHAR(20) DEFAULT 'a_tiempo'",
+    # Columnas antiguas renombradas: tipo -> tipo_frecuencia, cuota -> cuota_diaria
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'prestamos' AND column_name = 'tipo') THEN
+            UPDATE prestamos SET tipo_frecuencia = tipo WHERE tipo IS NOT NULL AND tipo_frecuencia IS NULL;
+            ALTER TABLE prestamos DROP COLUMN tipo;
+        END IF;
+        IF EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'prestamos' AND column_name = 'cuota') THEN
+            UPDATE prestamos SET cuota_diaria = cuota WHERE cuota IS NOT NULL AND cuota_diaria = 0;
+            ALTER TABLE prestamos DROP COLUMN cuota;
+        END IF;
+    END $$
+    """,
+]
+
+
+def actualizar(conexion):
+    for sentencia in SENTENCIAS:
+        conexion.execute(text(sentencia))
+
+
+def revertir(conexion):
+    raise RuntimeError('La revisión base no se puede revertir: eliminaría columnas con datos de la cartera')
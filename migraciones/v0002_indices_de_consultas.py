@@ -0,0 +1,42 @@
+"""
+Índices de las consultas frecuentes y de las claves foráneas. Sin índice en una clave foránea,
+cada préstamo o cliente borrado recorre completas las tablas que lo referencian (ON DELETE
+CASCADE y la comprobación de la restricción). Se crean con CONCURRENTLY para no bloquear las
+escrituras de la cartera mientras se construyen.
+
+Los modelos declaran los mismos índices, así que una base nueva ya los recibe de db.create_all().
+"""
+from migraciones import crear_indice_concurrente, eliminar_indice_concurrente
+
+DESCRIPCION = 'Índices de consultas frecuentes y claves foráneas'
+TRANSACCIONAL = False
+
+INDICES = [
+    # Clientes con préstamos activos/vencidos (listado, ruta de cobro, recálculo): índice parcial,
+    # mucho más chico que uno sobre todos los préstamos
+    ('ix_prestamos_activos_cliente_id', "prestamos (cliente_id) WHERE estado IN ('activo', 'vencido')"),
+    # Historial de un cliente y borrado en cascada desde clientes
+    ('ix_prestamos_cliente_id', 'prestamos (cliente_id)'),
+    # Cadena de refinanciaciones; solo las filas REF tienen valor
+    ('ix_prestamos_prestamo_refinanciado_id',
+     'prestamos (prestamo_refinanciado_id) WHERE prestamo_refinanciado_id IS NOT NULL'),
+    # Cuotas de un préstamo ordenadas por fecha, conciliación y borrado en cascada
+    ('ix_cuotas_prestamo_id_fecha_pago', 'cuotas (prestamo_id, fecha_pago)'),
+    # Cuotas por rango de fechas (exportación)
+    ('ix_cuotas_fecha_pago', 'cuotas (fecha_pago)'),
+    ('ix_pagos_prestamo_id', 'pagos (prestamo_id)'),
+    # Ruta de cobro (ya creado por init_db en bases anteriores a esta revisión)
+    ('ix_clientes_trabajador_id', 'clientes (trabajador_id)'),
+    # Listado de clientes ordenado por nombre (paginación keyset por (nombre, id))
+    ('ix_clientes_nombre_id', 'clientes (nombre, id)'),
+]
+
+
+def actualizar(conexion):
+    for nombre, definicion in INDICES:
+        crear_indice_concurrente(conexion, nombre, definicion)
+
+
+def revertir(conexion):
+    for nombre, _ in reversed(INDICES):
+        eliminar_indice_concurrente(conexion, nombre)
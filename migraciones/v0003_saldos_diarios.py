@@ -0,0 +1,48 @@
+"""
+Fotos diarias de saldos (modelos SaldoDiario y ResumenSaldosDiario de app.py): una fila por préstamo
+activo/vencido y día, más una fila de totales por día. Las escribe el trabajo programado que cierra
+cada día; los reportes históricos las leen en lugar de recalcular la historia.
+"""
+from sqlalchemy import text
+
+DESCRIPCION = 'Fotos diarias de saldos por préstamo y sus totales'
+
+SENTENCIAS = [
+    """
+    CREATE TABLE IF NOT EXISTS saldos_diarios (
+        fecha DATE NOT NULL,
+        prestamo_id INTEGER NOT NULL,
+        cliente_id INTEGER NOT NULL,
+        trabajador_id INTEGER,
+        estado VARCHAR(50) NOT NULL,
+        saldo NUMERIC(10,2) NOT NULL,
+        deuda_vencida NUMERIC(10,2) NOT NULL,
+        mora_pendiente NUMERIC(10,2) NOT NULL,
+        PRIMARY KEY (fecha, prestamo_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_saldos_diarios_prestamo_id_fecha ON saldos_diarios (prestamo_id, fecha)",
+    "CREATE INDEX IF NOT EXISTS ix_saldos_diarios_trabajador_id_fecha ON saldos_diarios (trabajador_id, fecha)",
+    """
+    CREATE TABLE IF NOT EXISTS resumen_saldos_diarios (
+        fecha DATE PRIMARY KEY,
+        prestamos INTEGER NOT NULL,
+        vigentes INTEGER NOT NULL,
+        vencidos INTEGER NOT NULL,
+        saldo_total NUMERIC(14,2) NOT NULL,
+        deuda_vencida_total NUMERIC(14,2) NOT NULL,
+        mora_total NUMERIC(14,2) NOT NULL,
+        creado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+]
+
+
+def actualizar(conexion):
+    for sentencia in SENTENCIAS:
+        conexion.execute(text(sentencia))
+
+
+def revertir(conexion):
+    conexion.execute(text('DROP TABLE IF EXISTS resumen_saldos_diarios'))
+    conexion.execute(text('DROP TABLE IF EXISTS saldos_diarios'))
@@ -0,0 +1,87 @@
+"""
+Archivo de préstamos cerrados (tablas prestamos_archivados, cuotas_archivadas y pagos_archivados de
+app.py): mismas columnas que las tablas vigentes, más la fecha en que se archivó el préstamo. El
+trabajo de archivo mueve ahí los préstamos pagados o refinanciados antiguos para que las tablas que
+recorren el recálculo, la conciliación y los pagos solo tengan la cartera viva.
+
+Revertir devuelve las filas archivadas a las tablas vigentes antes de eliminar las de archivo.
+"""
+from sqlalchemy import text
+
+DESCRIPCION = 'Tablas de archivo de préstamos cerrados, sus cuotas y pagos'
+
+COLUMNAS_PRESTAMOS = (
+    'id, cliente_id, monto_principal, interes, monto_total, fecha_inicio, fecha_fin, fecha_pago_completo, '
+    'estado, saldo, tipo_prestamo, tipo_frecuencia, dt, cuota_diaria, deuda_vencida, prestamo_refinanciado_id, '
+    'total_pagado, num_cuotas, ultima_fecha_pago'
+)
+COLUMNAS_CUOTAS = 'id, prestamo_id, monto, fecha_pago, descripcion, estado_pago'
+COLUMNAS_PAGOS = 'id, prestamo_id, monto, fecha_pago'
+
+SENTENCIAS = [
+    """
+    CREATE TABLE IF NOT EXISTS prestamos_archivados (
+        id INTEGER PRIMARY KEY,
+        cliente_id INTEGER NOT NULL REFERENCES clientes (id) ON DELETE CASCADE,
+        monto_principal NUMERIC(10,2) NOT NULL,
+        interes NUMERIC(5,2) NOT NULL,
+        monto_total NUMERIC(10,2) NOT NULL,
+        fecha_inicio DATE NOT NULL,
+        fecha_fin DATE,
+        fecha_pago_completo DATE,
+        estado VARCHAR(50) NOT NULL,
+        saldo NUMERIC(10,2),
+        tipo_prestamo VARCHAR(10),
+        tipo_frecuencia VARCHAR(50),
+        dt INTEGER,
+        cuota_diaria NUMERIC(10,2),
+        deuda_vencida NUMERIC(10,2),
+        prestamo_refinanciado_id INTEGER,
+        total_pagado NUMERIC(10,2) NOT NULL,
+        num_cuotas INTEGER NOT NULL,
+        ultima_fecha_pago DATE,
+        archivado_en TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_prestamos_archivados_cliente_id ON prestamos_archivados (cliente_id)",
+    """
+    CREATE TABLE IF NOT EXISTS cuotas_archivadas (
+        id INTEGER PRIMARY KEY,
+        prestamo_id INTEGER NOT NULL REFERENCES prestamos_archivados (id) ON DELETE CASCADE,
+        monto NUMERIC(10,2) NOT NULL,
+        fecha_pago DATE NOT NULL,
+        descripcion VARCHAR(200),
+        estado_pago VARCHAR(20)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_cuotas_archivadas_prestamo_id_fecha_pago
+    ON cuotas_archivadas (prestamo_id, fecha_pago)
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_cuotas_archivadas_fecha_pago ON cuotas_archivadas (fecha_pago)",
+    """
+    CREATE TABLE IF NOT EXISTS pagos_archivados (
+        id INTEGER PRIMARY KEY,
+        prestamo_id INTEGER NOT NULL REFERENCES prestamos_archivados (id) ON DELETE CASCADE,
+        monto NUMERIC(10,2) NOT NULL,
+        fecha_pago DATE NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_pagos_archivados_prestamo_id ON pagos_archivados (prestamo_id)",
+]
+
+
+def actualizar(conexion):
+    for sentencia in SENTENCIAS:
+        conexion.execute(text(sentencia))
+
+
+def revertir(conexion):
+    # Los préstamos primero: las cuotas y los pagos los referencian
+    for tabla, archivo, columnas in (('prestamos', 'prestamos_archivados', COLUMNAS_PRESTAMOS),
+                                     ('cuotas', 'cuotas_archivadas', COLUMNAS_CUOTAS),
+                                     ('pagos', 'pagos_archivados', COLUMNAS_PAGOS)):
+        conexion.execute(text(f'INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM {archivo}'))
+    conexion.execute(text('DROP TABLE IF EXISTS pagos_archivados'))
+    conexion.execute(text('DROP TABLE IF EXISTS cuotas_archivadas'))
+    conexion.execute(text('DROP TABLE IF EXISTS prestamos_archivados'))
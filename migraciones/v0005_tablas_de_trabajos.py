@@ -0,0 +1,43 @@
+"""
+Objetos de los trabajos programados que hasta ahora solo creaba db.create_all(): la secuencia
+version_cartera (ETag y caché del resumen de créditos), el calendario laboral materializado
+(calendario_laboral, modelo DiaCalendario) y el registro de ejecuciones de los trabajos
+(ejecuciones_programadas). El calendario se llena solo la primera vez que se necesita
+(asegurar_calendario_sql() en app.py).
+"""
+from sqlalchemy import text
+
+DESCRIPCION = 'Secuencia version_cartera, calendario laboral y registro de trabajos programados'
+
+SENTENCIAS = [
+    "CREATE SEQUENCE IF NOT EXISTS version_cartera",
+    """
+    CREATE TABLE IF NOT EXISTS calendario_laboral (
+        fecha DATE PRIMARY KEY,
+        es_habil BOOLEAN NOT NULL,
+        habiles_antes INTEGER NOT NULL,
+        habiles_hasta INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ejecuciones_programadas (
+        nombre VARCHAR(50) PRIMARY KEY,
+        ultima_ejecucion TIMESTAMP WITH TIME ZONE,
+        fecha_calculo DATE,
+        duracion_ms INTEGER,
+        filas_actualizadas INTEGER,
+        motivo VARCHAR(30)
+    )
+    """,
+]
+
+
+def actualizar(conexion):
+    for sentencia in SENTENCIAS:
+        conexion.execute(text(sentencia))
+
+
+def revertir(conexion):
+    conexion.execute(text('DROP TABLE IF EXISTS ejecuciones_programadas'))
+    conexion.execute(text('DROP TABLE IF EXISTS calendario_laboral'))
+    conexion.execute(text('DROP SEQUENCE IF EXISTS version_cartera'))
@@ -0,0 +1,48 @@
+"""
+Búsqueda de clientes (buscar_clientes() en app.py): extensiones pg_trgm y unaccent, la función
+normalizar_texto() (unaccent() no es IMMUTABLE y no se puede indexar directamente) y los índices
+trigram del nombre y de prefijo del DNI, creados con CONCURRENTLY.
+
+Si el servidor no tiene las extensiones instaladas la revisión se registra sin crear nada y la
+búsqueda sigue sin índice; después de instalarlas, init_db.py crea lo que falta.
+"""
+from sqlalchemy import text
+
+from migraciones import crear_indice_concurrente, eliminar_indice_concurrente
+
+DESCRIPCION = 'Función normalizar_texto() e índices de búsqueda de clientes'
+TRANSACCIONAL = False
+
+EXTENSIONES = ('pg_trgm', 'unaccent')
+
+SQL_FUNCION = """
+    CREATE OR REPLACE FUNCTION normalizar_texto(texto text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto)) $$
+"""
+
+INDICES = [
+    ('ix_clientes_nombre_trgm', 'clientes USING gin (normalizar_texto(nombre) gin_trgm_ops)'),
+    ('ix_clientes_dni_prefijo', 'clientes (dni varchar_pattern_ops)'),
+]
+
+
+def actualizar(conexion):
+    disponibles = conexion.execute(
+        text('SELECT COUNT(*) FROM pg_available_extensions WHERE name = ANY(:nombres)'),
+        {'nombres': list(EXTENSIONES)}
+    ).scalar()
+    if disponibles < len(EXTENSIONES):
+        print(f"   ⚠️ Faltan las extensiones {', '.join(EXTENSIONES)}: la búsqueda de clientes queda sin índice")
+        return
+    for extension in EXTENSIONES:
+        conexion.execute(text(f'CREATE EXTENSION IF NOT EXISTS {extension}'))
+    conexion.execute(text(SQL_FUNCION))
+    for nombre, definicion in INDICES:
+        crear_indice_concurrente(conexion, nombre, definicion)
+
+
+def revertir(conexion):
+    for nombre, _ in reversed(INDICES):
+        eliminar_indice_concurrente(conexion, nombre)
+    conexion.execute(text('DROP FUNCTION IF EXISTS normalizar_texto(text)'))
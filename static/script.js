@@ -3,6 +3,9 @@ const API_BASE_URL = '';
 const INACTIVITY_LIMIT = 30 * 60 * 1000; // 30 minutos
 
 // ---- FUNCIÓN HELPER PARA PETICIONES HTTP ----
+// Últimas respuestas GET con ETag, por URL: { etag, data }
+const respuestasConEtag = new Map();
+
 async function fetchJSON(url, method = 'GET', body = null) {
     const opts = { 
         method, 
@@ -14,19 +17,35 @@ async function fetchJSON(url, method = 'GET', body = null) {
         opts.headers['Content-Type'] = 'application/json';
         opts.body = JSON.stringify(body);
     }
+
+    const guardada = method === 'GET' ? respuestasConEtag.get(url) : null;
+    if (guardada) {
+        opts.headers['If-None-Match'] = guardada.etag;
+    }
     
     const res = await fetch(url, opts);
 
     if (res.status === 401) {
         localStorage.removeItem('rol');
+        respuestasConEtag.clear();
         window.location.href = '/';
         return { res, data: null };
     }
 
+    // 304: nada cambió en el servidor, se reutilizan los datos ya descargados
+    if (res.status === 304 && guardada) {
+        return { res: { ok: true, status: 304, statusText: res.statusText }, data: guardada.data };
+    }
+
     let data = null;
     try {
         data = await res.json();
     } catch(e) {}
+
+    const etag = res.headers.get('ETag');
+    if (method === 'GET' && res.ok && etag) {
+        respuestasConEtag.set(url, { etag, data });
+    }
     return { res, data };
 }
 
@@ -103,27 +122,67 @@ function getEstadoPagoText(estadoPago) {
     return textos[estadoPago] || 'Desconocido';
 }
 
+// ---- PAGINACIÓN DE CLIENTES ----
+const LIMITE_PAGINA_CLIENTES = 50;
+const paginacionClientes = { cursor: null, q: '', estado: '' };
+let temporizadorBusquedaClientes = null;
+
+function construirUrlClientes() {
+    const params = new URLSearchParams({ limite: LIMITE_PAGINA_CLIENTES });
+    if (paginacionClientes.q) params.set('q', paginacionClientes.q);
+    if (paginacionClientes.estado) params.set('estado', paginacionClientes.estado);
+    if (paginacionClientes.cursor) params.set('cursor', paginacionClientes.cursor);
+    return `/api/clientes?${params.toString()}`;
+}
+
+function actualizarBotonCargarMas(siguienteCursor) {
+    paginacionClientes.cursor = siguienteCursor;
+    const boton = document.getElementById('cargarMasClientes');
+    if (boton) {
+        boton.style.display = siguienteCursor ? 'inline-block' : 'none';
+    }
+}
+
+async function recargarTablaClientes(reiniciar = true) {
+    if (document.getElementById('clientesTableAdmin')) {
+        await cargarClientesAdmin(reiniciar);
+    } else {
+        await cargarClientesTrabajador();
+    }
+}
+
+async function cargarMasClientes() {
+    await recargarTablaClientes(false);
+}
+
 // ---- FUNCIONES PARA CARGAR DATOS ----
-async function cargarClientesAdmin() {
+async function cargarClientesAdmin(reiniciar = true) {
     const tBody = document.querySelector('#clientesTableAdmin tbody');
     if (!tBody) return;
 
+    if (reiniciar) {
+        paginacionClientes.cursor = null;
+    }
+
     try {
-        const { res, data } = await fetchJSON('/api/clientes');
+        const { res, data } = await fetchJSON(construirUrlClientes());
         if (!res.ok) {
             console.error('Error al cargar clientes:', data?.msg || res.statusText);
             tBody.innerHTML = '<tr><td colspan="17">Error al cargar clientes.</td></tr>';
             return;
         }
 
-        tBody.innerHTML = '';
+        if (reiniciar) {
+            tBody.innerHTML = '';
+        }
         
-        if (data.length === 0) {
+        if (reiniciar && data.clientes.length === 0) {
             tBody.innerHTML = '<tr><td colspan="18" class="text-center">No hay clientes con préstamos activos.</td></tr>';
+            actualizarBotonCargarMas(null);
             return;
         }
 
-        data.forEach(cliente => {
+        data.clientes.forEach(cliente => {
             if (cliente.prestamos && cliente.prestamos.length > 0) {
                 cliente.prestamos.forEach(prestamo => {
                     const tr = document.createElement('tr');
@@ -200,96 +259,104 @@ async function cargarClientesAdmin() {
                 });
             }
         });
+        actualizarBotonCargarMas(data.siguiente_cursor);
     } catch (error) {
         console.error('Error al cargar clientes:', error);
         tBody.innerHTML = '<tr><td colspan="17">Error de conexión al servidor.</td></tr>';
     }
 }
 
+// La ruta del trabajador llega completa (solo sus clientes); la búsqueda y el estado se filtran aquí
+function normalizarBusqueda(texto) {
+    return (texto || '').normalize('NFD').replace(/[\u0300-\u036f]/g, '').toLowerCase();
+}
+
 async function cargarClientesTrabajador() {
     const tBody = document.querySelector('#clientesTableTrabajador tbody');
     if (!tBody) return;
 
     try {
-        const { res, data } = await fetchJSON('/api/clientes');
+        const { res, data } = await fetchJSON('/api/ruta');
         if (!res.ok) {
-            console.error('Error al cargar clientes:', data?.msg || res.statusText);
-            tBody.innerHTML = '<tr><td colspan="17">Error al cargar clientes.</td></tr>';
+            console.error('Error al cargar la ruta:', data?.msg || res.statusText);
+            tBody.innerHTML = '<tr><td colspan="18">Error al cargar clientes.</td></tr>';
             return;
         }
 
+        const busqueda = normalizarBusqueda(paginacionClientes.q);
+        const prestamos = data.prestamos.filter(prestamo =>
+            (!paginacionClientes.estado || prestamo.estado === paginacionClientes.estado) &&
+            (!busqueda || normalizarBusqueda(prestamo.nombre).includes(busqueda) ||
+                (prestamo.dni || '').startsWith(busqueda))
+        );
+
         tBody.innerHTML = '';
-        
-        if (data.length === 0) {
-            tBody.innerHTML = '<tr><td colspan="17" class="text-center">No hay clientes con préstamos activos.</td></tr>';
+        actualizarBotonCargarMas(null);
+        if (prestamos.length === 0) {
+            tBody.innerHTML = '<tr><td colspan="18" class="text-center">No hay clientes con préstamos activos.</td></tr>';
             return;
         }
 
-        data.forEach(cliente => {
-            if (cliente.prestamos && cliente.prestamos.length > 0) {
-                cliente.prestamos.forEach(prestamo => {
-                    const tr = document.createElement('tr');
-                    
-                    let claseAlerta = '';
-                    if (prestamo.fecha_fin) {
-                        const fechaHoy = new Date();
-                        const fechaFin = new Date(prestamo.fecha_fin);
-                        const diferenciaMs = fechaFin.getTime() - fechaHoy.getTime();
-                        const diasRestantes = Math.ceil(diferenciaMs / (1000 * 60 * 60 * 24));
-                        
-                        if (prestamo.estado === 'vencido') {
-                            claseAlerta = 'alerta-vencido';
-                        } else if (diasRestantes < 0) {
-                            claseAlerta = 'alerta-vencido';
-                        } else if (diasRestantes <= 3) {
-                            claseAlerta = 'alerta-rojo';
-                        } else if (diasRestantes <= 10) {
-                            claseAlerta = 'alerta-amarillo';
-                        }
-                    }
-                    
-                    const iconoTipo = prestamo.tipo_prestamo === 'REF' ? 
-                        '<i class="fas fa-redo-alt" title="Refinanciación"></i>' : 
-                        '<i class="fas fa-plus-circle" title="Crédito Reciente"></i>';
-                    
-                    tr.className = claseAlerta;
-                    tr.innerHTML = `
-                        <td>${cliente.id}</td>
-                        <td>${cliente.dni || 'N/A'}</td>
-                        <td>${cliente.nombre || ''}</td>
-                        <td>${cliente.direccion || ''}</td>
-                        <td>${cliente.telefono || ''}</td>
-                        <td>${cliente.trabajador_nombre || 'No asignado'}</td>
-                        <td>${formatearMoneda(prestamo.monto_principal)}</td>
-                        <td><strong>${formatearMoneda(prestamo.monto_total)}</strong></td>
-                        <td>${formatearMoneda(prestamo.saldo)}</td>
-                        <td>${iconoTipo} ${prestamo.tipo_prestamo}</td>
-                        <td>${prestamo.tipo_frecuencia || 'Diario'}</td>
-                        <td><span class="badge">${prestamo.dt || 0}</span></td>
-                        <td>${prestamo.total_cuotas || 0}</td>
-                        <td class="deuda-vencida">${formatearMoneda(prestamo.deuda_vencida)}</td>
-                        <td>${formatearMoneda(prestamo.cuota_diaria)}</td>
-                        <td><span class="${getEstadoBadgeClass(prestamo.estado)}">${prestamo.estado.toUpperCase()}</span></td>
-                        <td>
-                            <div class="action-buttons">
-                                ${prestamo.estado === 'activo' || prestamo.estado === 'vencido' ? `
-                                <button class="action-btn primary-btn" onclick="abrirModalCuota(${prestamo.id})" title="Registrar Cuota">
-                                    <i class="fas fa-dollar-sign"></i>
-                                </button>
-                                ` : ''}
-                                <button class="action-btn info-btn" onclick="verHistorialCuotas(${prestamo.id})" title="Ver Cuotas">
-                                    <i class="fas fa-history"></i>
-                                </button>
-                            </div>
-                        </td>
-                    `;
-                    tBody.appendChild(tr);
-                });
+        prestamos.forEach(prestamo => {
+            const tr = document.createElement('tr');
+
+            let claseAlerta = '';
+            if (prestamo.fecha_fin) {
+                const fechaHoy = new Date();
+                const fechaFin = new Date(prestamo.fecha_fin);
+                const diferenciaMs = fechaFin.getTime() - fechaHoy.getTime();
+                const diasRestantes = Math.ceil(diferenciaMs / (1000 * 60 * 60 * 24));
+
+                if (prestamo.estado === 'vencido') {
+                    claseAlerta = 'alerta-vencido';
+                } else if (diasRestantes < 0) {
+                    claseAlerta = 'alerta-vencido';
+                } else if (diasRestantes <= 3) {
+                    claseAlerta = 'alerta-rojo';
+                } else if (diasRestantes <= 10) {
+                    claseAlerta = 'alerta-amarillo';
+                }
             }
+
+            const iconoTipo = prestamo.tipo_prestamo === 'REF' ? 
+                '<i class="fas fa-redo-alt" title="Refinanciación"></i>' : 
+                '<i class="fas fa-plus-circle" title="Crédito Reciente"></i>';
+
+            tr.className = claseAlerta;
+            tr.innerHTML = `
+                <td>${prestamo.cliente_id}</td>
+                <td>${prestamo.dni || 'N/A'}</td>
+                <td>${prestamo.nombre || ''}</td>
+                <td>${prestamo.direccion || ''}</td>
+                <td>${prestamo.telefono || ''}</td>
+                <td>${data.trabajador.nombre}</td>
+                <td>${formatearMoneda(prestamo.monto_principal)}</td>
+                <td><strong>${formatearMoneda(prestamo.monto_total)}</strong></td>
+                <td>${formatearMoneda(prestamo.saldo)}</td>
+                <td>${iconoTipo} ${prestamo.tipo_prestamo}</td>
+                <td>${prestamo.tipo_frecuencia || 'Diario'}</td>
+                <td><span class="badge">${prestamo.dt || 0}</span></td>
+                <td>${prestamo.total_cuotas || 0}</td>
+                <td>${formatearMoneda(prestamo.esperado_hoy)}</td>
+                <td class="deuda-vencida">${formatearMoneda(prestamo.faltante)}</td>
+                <td>${formatearMoneda(prestamo.cuota_diaria)}${prestamo.pagado_hoy ? ' <i class="fas fa-check" title="Pagó hoy"></i>' : ''}</td>
+                <td><span class="${getEstadoBadgeClass(prestamo.estado)}">${prestamo.estado.toUpperCase()}</span></td>
+                <td>
+                    <div class="action-buttons">
+                        <button class="action-btn primary-btn" onclick="abrirModalCuota(${prestamo.id})" title="Registrar Cuota">
+                            <i class="fas fa-dollar-sign"></i>
+                        </button>
+                        <button class="action-btn info-btn" onclick="verHistorialCuotas(${prestamo.id})" title="Ver Cuotas">
+                            <i class="fas fa-history"></i>
+                        </button>
+                    </div>
+                </td>
+            `;
+            tBody.appendChild(tr);
         });
     } catch (error) {
         console.error('Error al cargar clientes:', error);
-        tBody.innerHTML = '<tr><td colspan="16">Error de conexión al servidor.</td></tr>';
+        tBody.innerHTML = '<tr><td colspan="18">Error de conexión al servidor.</td></tr>';
     }
 }
 
@@ -312,15 +379,17 @@ async function cargarTrabajadoresSelect(selectId) {
     }
 }
 
-async function cargarClientesSinPrestamo() {
+async function cargarClientesSinPrestamo(busqueda = '') {
     try {
-        const { res, data } = await fetchJSON('/api/clientes_sin_prestamo');
+        const params = new URLSearchParams({ limite: LIMITE_PAGINA_CLIENTES, orden: 'nombre' });
+        if (busqueda.trim()) params.set('q', busqueda.trim());
+        const { res, data } = await fetchJSON(`/api/clientes_sin_prestamo?${params.toString()}`);
         if (res.ok) {
             const selectCliente = document.getElementById('selectCliente');
             if (selectCliente) {
                 selectCliente.innerHTML = '<option value="">Seleccione un cliente</option>';
                 
-                data.forEach(cliente => {
+                data.clientes.forEach(cliente => {
                     const option = document.createElement('option');
                     option.value = cliente.id;
                     option.textContent = `${cliente.nombre} - ${cliente.dni}`;
@@ -328,6 +397,13 @@ async function cargarClientesSinPrestamo() {
                     option.dataset.telefono = cliente.telefono || '';
                     selectCliente.appendChild(option);
                 });
+
+                if (data.siguiente_cursor) {
+                    const option = document.createElement('option');
+                    option.disabled = true;
+                    option.textContent = 'Hay más clientes: escriba nombre o DNI para filtrar...';
+                    selectCliente.appendChild(option);
+                }
             }
         }
     } catch (error) {
@@ -795,7 +871,15 @@ async function marcarPrestamoComoPagado(prestamoId) {
 }
 
 // Funciones de búsqueda y filtrado
-async function buscarHistorial(searchText) {
+let temporizadorBusquedaHistorial = null;
+
+function buscarHistorial(searchText) {
+    // Se espera a que el usuario deje de escribir para no consultar en cada tecla
+    clearTimeout(temporizadorBusquedaHistorial);
+    temporizadorBusquedaHistorial = setTimeout(() => buscarClientesHistorial(searchText.trim()), 300);
+}
+
+async function buscarClientesHistorial(searchText) {
     const tBody = document.querySelector('#prestamosTableAdmin tbody');
     if (!tBody) return;
     
@@ -819,33 +903,22 @@ async function buscarHistorial(searchText) {
             return;
         }
 
+        // Una fila por cliente; sus préstamos se cargan al abrirlo
         data.forEach(cliente => {
-            if (cliente.prestamos && cliente.prestamos.length > 0) {
-                cliente.prestamos.forEach(prestamo => {
-                    const tr = document.createElement('tr');
-                    const iconoTipo = prestamo.tipo_prestamo === 'REF' ? 
-                        '<i class="fas fa-redo-alt" title="Refinanciación"></i>' : 
-                        '<i class="fas fa-plus-circle" title="Crédito Reciente"></i>';
-                    
-                    tr.innerHTML = `
-                        <td>${cliente.nombre}</td>
-                        <td>${cliente.dni || 'N/A'}</td>
-                        <td>${formatearMoneda(prestamo.monto_principal)}</td>
-                        <td>${formatearMoneda(prestamo.monto_total)}</td>
-                        <td>${(prestamo.interes || 0).toFixed(2)}%</td>
-                        <td>${iconoTipo} ${prestamo.tipo_prestamo}</td>
-                        <td>${prestamo.fecha_inicio || 'N/A'}</td>
-                        <td>${prestamo.fecha_pago_completo || 'N/A'}</td>
-                        <td><span class="${getEstadoBadgeClass(prestamo.estado)}">${prestamo.estado.toUpperCase()}</span></td>
-                        <td>
-                            <button class="action-btn info-btn" onclick="verHistorialCuotas(${prestamo.id})" title="Ver Cuotas">
-                                <i class="fas fa-history"></i>
-                            </button>
-                        </td>
-                    `;
-                    tBody.appendChild(tr);
-                });
-            }
+            const tr = document.createElement('tr');
+            tr.className = 'fila-cliente-historial';
+            tr.innerHTML = `
+                <td>${cliente.nombre}</td>
+                <td>${cliente.dni || 'N/A'}</td>
+                <td colspan="7">${cliente.total_prestamos} préstamo(s)${cliente.tiene_prestamo_activo ? ' · con préstamo activo' : ''}</td>
+                <td>
+                    <button class="action-btn info-btn" title="Ver Préstamos">
+                        <i class="fas fa-chevron-down"></i>
+                    </button>
+                </td>
+            `;
+            tr.querySelector('button').addEventListener('click', () => verPrestamosClienteHistorial(cliente, tr));
+            tBody.appendChild(tr);
         });
 
     } catch (error) {
@@ -854,31 +927,73 @@ async function buscarHistorial(searchText) {
     }
 }
 
-function filtrarClientes(searchText) {
-    const table = document.getElementById('clientesTableAdmin') || document.getElementById('clientesTableTrabajador');
-    if (!table) return;
-    
-    const rows = table.getElementsByTagName('tr');
-    const filter = searchText.toLowerCase();
-
-    for (let i = 1; i < rows.length; i++) {
-        const dni = rows[i].getElementsByTagName('td')[1];
-        const nombre = rows[i].getElementsByTagName('td')[2];
-
-        if (dni && nombre) {
-            const dniText = dni.textContent || dni.innerText;
-            const nombreText = nombre.textContent || nombre.innerText;
+async function verPrestamosClienteHistorial(cliente, filaCliente) {
+    // Si ya están abiertos, se cierran
+    const abiertas = document.querySelectorAll(`tr[data-historial-cliente="${cliente.id}"]`);
+    if (abiertas.length > 0) {
+        abiertas.forEach(fila => fila.remove());
+        return;
+    }
 
-            if (dniText.toLowerCase().indexOf(filter) > -1 || 
-                nombreText.toLowerCase().indexOf(filter) > -1) {
-                rows[i].style.display = "";
-            } else {
-                rows[i].style.display = "none";
-            }
+    try {
+        const { res, data } = await fetchJSON(`/api/prestamos/historial/${cliente.id}`);
+        if (!res.ok) {
+            alert(data.msg || 'Error al cargar los préstamos del cliente');
+            return;
         }
+
+        let anterior = filaCliente;
+        data.forEach(prestamo => {
+            const tr = document.createElement('tr');
+            tr.dataset.historialCliente = cliente.id;
+            const iconoTipo = prestamo.tipo_prestamo === 'REF' ? 
+                '<i class="fas fa-redo-alt" title="Refinanciación"></i>' : 
+                '<i class="fas fa-plus-circle" title="Crédito Reciente"></i>';
+            
+            tr.innerHTML = `
+                <td>${cliente.nombre}</td>
+                <td>${cliente.dni || 'N/A'}</td>
+                <td>${formatearMoneda(prestamo.monto_principal)}</td>
+                <td>${formatearMoneda(prestamo.monto_total)}</td>
+                <td>${(prestamo.interes || 0).toFixed(2)}%</td>
+                <td>${iconoTipo} ${prestamo.tipo_prestamo}</td>
+                <td>${prestamo.fecha_inicio || 'N/A'}</td>
+                <td>${prestamo.fecha_pago_completo || 'N/A'}</td>
+                <td><span class="${getEstadoBadgeClass(prestamo.estado)}">${prestamo.estado.toUpperCase()}</span></td>
+                <td>
+                    <button class="action-btn info-btn" onclick="verHistorialCuotas(${prestamo.id})" title="Ver Cuotas">
+                        <i class="fas fa-history"></i>
+                    </button>
+                </td>
+            `;
+            anterior.after(tr);
+            anterior = tr;
+        });
+    } catch (error) {
+        console.error('Error al cargar los préstamos del cliente:', error);
+        alert('Error de conexión al servidor.');
     }
 }
 
+function filtrarClientes(searchText) {
+    // El filtro se aplica en el servidor (prefijo de nombre o DNI) para no depender de las filas ya cargadas
+    clearTimeout(temporizadorBusquedaClientes);
+    temporizadorBusquedaClientes = setTimeout(() => {
+        paginacionClientes.q = searchText.trim();
+        recargarTablaClientes();
+    }, 300);
+}
+
+function filtrarClientesPorEstado(estado) {
+    paginacionClientes.estado = estado;
+    recargarTablaClientes();
+}
+
+function buscarClientesSinPrestamo(searchText) {
+    clearTimeout(temporizadorBusquedaClientes);
+    temporizadorBusquedaClientes = setTimeout(() => cargarClientesSinPrestamo(searchText), 300);
+}
+
 function filtrarTrabajadores(searchText) {
     const table = document.getElementById('trabajadoresTableAdmin');
     if (!table) return;
@@ -924,17 +1039,15 @@ function togglePasswordVisibility() {
 }
 
 function exportarClientesExcel() {
-    const table = document.getElementById('clientesTableAdmin') || document.getElementById('clientesTableTrabajador');
-    if (!table) {
-        alert('No se encontró tabla para exportar');
-        return;
-    }
-    
-    let html = table.outerHTML;
-    let url = 'data:application/vnd.ms-excel,' + encodeURIComponent(html);
-    let a = document.createElement('a');
-    a.href = url;
-    a.download = `clientes_prestamos_${new Date().toISOString().split('T')[0]}.xls`;
+    // El servidor genera el archivo en streaming con toda la cartera (no solo lo que está en pantalla).
+    // Hojas: clientes, préstamos y cuotas; un trabajador solo recibe sus propios clientes.
+    const params = new URLSearchParams({ formato: 'xlsx' });
+    const filtroEstado = document.getElementById('filtroEstadoClientes');
+    params.set('estado', filtroEstado && filtroEstado.value ? filtroEstado.value : 'activo,vencido');
+
+    const a = document.createElement('a');
+    a.href = `/api/exportar?${params.toString()}`;
+    a.download = `cartera_${new Date().toISOString().split('T')[0]}.xlsx`;
     document.body.appendChild(a);
     a.click();
     document.body.removeChild(a);
@@ -1465,13 +1578,18 @@ window.addEventListener('unhandledrejection', function(event) {
     event.preventDefault();
 });
 
-// Actualización automática cada 5 minutos
+// El recálculo de la cartera corre en el servidor; aquí solo se detecta si hubo uno nuevo
+let ultimoRecalculoCartera = null;
 setInterval(async () => {
     try {
-        await fetchJSON('/api/actualizar_prestamos', 'POST');
-        console.log('Préstamos actualizados automáticamente');
+        const { res, data } = await fetchJSON('/api/actualizar_prestamos');
+        if (!res.ok) return;
+        if (ultimoRecalculoCartera && data.ultima_ejecucion !== ultimoRecalculoCartera) {
+            cargarResumenCreditos();
+        }
+        ultimoRecalculoCartera = data.ultima_ejecucion;
     } catch (error) {
-        console.warn('Error en actualización automática:', error);
+        console.warn('Error al consultar la actualización de préstamos:', error);
     }
 }, 5 * 60 * 1000);
 
@@ -1481,6 +1599,9 @@ window.cargarClientesTrabajador = cargarClientesTrabajador;
 window.cargarTrabajadoresAdmin = cargarTrabajadoresAdmin;
 window.cargarResumenCreditos = cargarResumenCreditos;
 window.filtrarClientes = filtrarClientes;
+window.filtrarClientesPorEstado = filtrarClientesPorEstado;
+window.buscarClientesSinPrestamo = buscarClientesSinPrestamo;
+window.cargarMasClientes = cargarMasClientes;
 window.filtrarTrabajadores = filtrarTrabajadores;
 window.exportarClientesExcel = exportarClientesExcel;
 window.buscarHistorial = buscarHistorial;